@@ -7,6 +7,7 @@ See LICENSE for details.
 """
 from __future__ import print_function
 from . import colors
+from . import core
 from . import errors
 from . import template
 from . import util
@@ -16,9 +17,11 @@ import datetime
 import difflib
 import itertools
 import logging
+import multiprocessing
 import os
 import re
 import sys
+import threading
 import time
 
 try:
@@ -32,6 +35,11 @@ try:
 except ImportError:
     from .orddict import OrderedDict
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
 
 if sys.version_info[0] == 2:
     string_types = basestring  # pylint: disable=E0602
@@ -39,6 +47,58 @@ else:
     string_types = str
 
 
+# number of files copied at the same time by Manager.copy_tree()
+COPY_JOBS = 4
+# deploying to a node with at least this many files missing, and at least
+# half of its files missing, writes them all at once
+BULK_DEPLOY_MIN_FILES = 10
+
+# (manager, [(index, entry), ...]) inherited by forked render processes
+_parallel_render = None
+
+
+def _render_in_process(position):
+    """
+    Render a single entry in a forked process, None if not possible
+
+    Returns (dest_path, output, dynamic), 'dynamic' telling whether the render
+    made dynamic lookups or None if the output was served from a cache.
+    """
+    manager, entries = _parallel_render
+    entry = entries[position][1]
+    source_path = os.path.join(entry["config"].path, entry["source_path"])
+    access_count = manager.bucket_access_count
+    hit_count = manager.cache_hit_count
+    lookup_count = manager.lookup_count
+    try:
+        result = entry["render"](source_path,
+                                 get_dest_path(entry, source_path),
+                                 source_text=entry["source_text"])
+    except Exception:  # pylint: disable=W0703
+        # rendered again in the parent process for proper error reporting
+        return None
+
+    if manager.bucket_access_count != access_count:
+        # bucket records added in this process would be lost
+        return None
+
+    dest_path, output = result
+    if manager.cache_hit_count != hit_count:
+        return dest_path, output, None
+
+    return dest_path, output, manager.lookup_count != lookup_count
+
+
+def get_dest_path(entry, source_path):
+    """return the unrendered destination path of a file entry"""
+    dest_path = entry["dest_path"]
+    if dest_path and dest_path[-1:] == "/":
+        # dest path ending in slash: use source filename
+        dest_path = os.path.join(dest_path, os.path.basename(source_path))
+
+    return dest_path
+
+
 class RenderContext(object):
     """Log information about the template upon rendering errors"""
     def __init__(self, entry, target):
@@ -66,78 +126,324 @@ class Manager(object):
         self.files = []
         self.error_count = 0
         self.buckets = {}
+        self.bucket_access_count = 0
+        self.lookup_count = 0  # dynamic lookups made by templates
+        self.cache_hit_count = 0  # renders served from a cache
+        self.render_cache = None  # optional rendercache.RenderCache
+        self.verify_state = None  # optional verifystate.VerifyState
+        # optional hooks set when only some of the nodes have been collected:
+        # node_collector(found) collects the nodes returned by a lookup,
+        # collect_remaining() collects all the other nodes
+        self.node_collector = None
+        self.collect_remaining = None
 
     def reset(self):
         self.files = []
         self.error_count = 0
         self.buckets = {}
 
-    def get_bucket(self, name):
+    def get_bucket(self, name, collect=True):
+        # renders accessing buckets depend on other renders: see cached_template()
+        self.bucket_access_count += 1
+        if collect:
+            # buckets contain records added by any node
+            self.collect_remaining_nodes()
+
         return self.buckets.setdefault(name, OrderedSet())
 
+    def render_record(self, entry):
+        """
+        Render a file entry and add its output to its bucket, returns False
+        if the render failed
+        """
+        source_path = os.path.join(entry["config"].path, entry["source_path"])
+        try:
+            dest_path, output = entry["render"](
+                source_path, get_dest_path(entry, source_path),
+                source_text=entry["source_text"])
+        except (IOError, errors.Error) as error:
+            self.log.debug("%s: record from %s failed: %s: %s",
+                           entry["node"].name, source_path,
+                           error.__class__.__name__, error)
+            return False
+
+        if output:
+            entry["config"].plugin.add_record(entry["dest_bucket"], text=output)
+
+        return True
+
+    def collect_remaining_nodes(self):
+        """collect the nodes left out from a partial collection, if any"""
+        collect = self.collect_remaining
+        if collect:
+            self.collect_remaining = None
+            collect()
+
     def emit_error(self, node, source_path, error):
         self.log.warning("node %s: %s: %s: %s", node.name, source_path,
                          error.__class__.__name__, error)
         self.error_count += 1
 
-    def copy_tree(self, source_path, dest_path, remote, path_prefix="", verbose=False):
-        def progress(copied, total, ctx=None):
-            ctx = ctx or {}
-            ctx.setdefault("last", time.time())
-            if (copied == total) or (time.time() - ctx["last"]) > 1.0:
-                sys.stderr.write("\r%s/%s bytes copied" % (copied, total))
-                ctx["last"] = time.time()
+    def get_entry_key(self, entry):
+        """return a key identifying a file entry between poni runs"""
+        return "%s:%s:%s:%s" % (entry["node"].name, entry["config"].full_name,
+                                entry["source_path"], entry["dest_path"])
+
+    def get_entry_inputs(self, entry):
+        """
+        Return (dirs, files) of repository paths an entry's render depends on
+
+        Paths are relative to the repository root: the node's and its
+        systems' property files, and the config directories (plugin,
+        templates, settings) of the config and its parent configs.
+        """
+        root_dir = self.confman.root_dir
+        configs = [entry["config"], entry.get("top_config") or entry["config"]]
+        dirs = set(os.path.relpath(config.path, root_dir) for config in configs)
+        for config in configs:
+            for name, settings_dir in config.get_settings_dirs():
+                dirs.add(os.path.relpath(os.path.dirname(settings_dir),
+                                         root_dir))
+
+        files = set()
+        item = entry["node"]
+        while item:
+            files.add(os.path.relpath(item.conf_file, root_dir))
+            item = item.system
+
+        return dirs, files
+
+    def get_changed_entries(self, entries, changed_paths):
+        """
+        Return the subset of file 'entries' affected by 'changed_paths'
+
+        All entries are affected if any of the changes is not an input of a
+        known entry. Entries whose previous render used dynamic lookups,
+        have no recorded state or add their output to a bucket are always
+        included. Poni's own cache files are not inputs and are ignored.
+        """
+        state = self.verify_state
+        inputs = [self.get_entry_inputs(entry) for entry in entries]
+        all_dirs = set()
+        all_files = set()
+        for dirs, files in inputs:
+            all_dirs.update(dirs)
+            all_files.update(files)
+
+        def is_input(path, dirs, files):
+            return ((path in files)
+                    or any(path.startswith(dir_path + os.sep)
+                           for dir_path in dirs))
+
+        changed_paths = [path for path in
+                         (os.path.normpath(path) for path in changed_paths)
+                         if not path.startswith(core.CACHE_DIR + os.sep)]
+        for path in changed_paths:
+            if not is_input(path, all_dirs, all_files):
+                self.log.info("%s: changed path is not a known input, "
+                              "verifying all files", path)
+                return list(entries)
+
+        changed = []
+        for entry, (dirs, files) in zip(entries, inputs):
+            if ((not state) or entry.get("dest_bucket")
+                or state.is_dynamic(self.get_entry_key(entry))
+                or any(is_input(path, dirs, files) for path in changed_paths)):
+                changed.append(entry)
+
+        return changed
+
+    def copy_tree(self, source_path, dest_path, remote, path_prefix="",
+                  verbose=False, delta=False, jobs=COPY_JOBS):
+        """
+        Copy a directory tree recursively, skipping files having the same
+        size and mtime remotely.
 
+        The remote tree is listed with a single operation if the remote
+        supports it, otherwise each file is checked separately. Changed files
+        are copied up to 'jobs' at a time, each over its own remote channel.
+        """
         dest_dir = path_prefix + dest_path
-        try:
-            remote.stat(dest_dir)
-        except errors.RemoteError:
-            remote.makedirs(dest_dir)
+        remote_files = remote.list_tree(dest_dir)
+        if remote_files is None:
+            self.log.debug("remote listing not available: %s", dest_dir)
+
+        copies = []
+        for dir_path, dir_names, file_names in os.walk(source_path):
+            dir_names.sort()
+            rel_dir = os.path.relpath(dir_path, source_path)
+            if rel_dir == ".":
+                rel_dir = ""
+
+            remote_dir = os.path.join(dest_dir, rel_dir) if rel_dir else dest_dir
+            if (remote_files is None) or not rel_dir:
+                try:
+                    remote.stat(remote_dir)
+                except errors.RemoteError:
+                    remote.makedirs(remote_dir)
+            elif rel_dir not in remote_files:
+                remote.makedirs(remote_dir)
+
+            for name in sorted(file_names):
+                file_path = os.path.join(dir_path, name)
+                remote_path = os.path.join(remote_dir, name)
+                lstat = os.stat(file_path)
+                if remote_files is None:
+                    try:
+                        rstat = remote.stat(remote_path)
+                    except errors.RemoteError:
+                        rstat = None
+                else:
+                    rstat = remote_files.get(os.path.join(rel_dir, name))
 
-        for dir_entry in os.listdir(source_path):
-            file_path = os.path.join(source_path, dir_entry)
-            if os.path.isdir(file_path):
-                continue
-            dest_path = os.path.join(dest_dir, dir_entry)
-            lstat = os.stat(file_path)
-            try:
-                rstat = remote.stat(dest_path)
                 # copy if mtime or size differs
                 # TODO: optional full contents comparison
-                copy = ((lstat.st_size != rstat.st_size)
-                        or (int(lstat.st_mtime) != int(rstat.st_mtime)))
-            except errors.RemoteError:
-                copy = True
+                if (not rstat) or (lstat.st_size != rstat.st_size) \
+                        or (int(lstat.st_mtime) != int(rstat.st_mtime)):
+                    copies.append((file_path, remote_path, lstat,
+                                   rstat is not None))
+                elif verbose:
+                    self.log.info("already copied: %s", remote_path)
+
+        if not copies:
+            return
+
+        total = sum(lstat.st_size for file_path, remote_path, lstat, exists
+                    in copies)
+        state = dict(copied=0, last=time.time())
+        lock = threading.Lock()
+
+        def copy_file(remote, file_path, remote_path, lstat, exists):
+            copied = [0]
+            def progress(file_copied, file_total):
+                with lock:
+                    state["copied"] += file_copied - copied[0]
+                    copied[0] = file_copied
+                    if (time.time() - state["last"]) > 1.0:
+                        sys.stderr.write("\r%s/%s bytes copied" % (
+                                state["copied"], total))
+                        state["last"] = time.time()
+
+            self.log.info("copying: %s", remote_path)
+            if delta and exists:
+                remote.put_file_delta(file_path, remote_path,
+                                      callback=progress)
+            else:
+                remote.put_file(file_path, remote_path, callback=progress)
+
+            remote.utime(remote_path, (int(lstat.st_mtime),
+                                       int(lstat.st_mtime)))
+
+        remotes = [remote]
+        while len(remotes) < min(jobs or 1, len(copies)):
+            clone = remote.clone()
+            if not clone:
+                break
+
+            remotes.append(clone)
 
-            if copy:
-                self.log.info("copying: %s", dest_path)
-                remote.put_file(file_path, dest_path, callback=progress)
-                remote.utime(dest_path, (int(lstat.st_mtime),
-                                         int(lstat.st_mtime)))
-                sys.stderr.write("\n")
-            elif verbose:
-                self.log.info("already copied: %s", dest_path)
+        try:
+            if len(remotes) == 1:
+                for copy in copies:
+                    copy_file(remote, *copy)
+            else:
+                free_remotes = queue.Queue()
+                for item in remotes:
+                    free_remotes.put(item)
+
+                failures = []
+                def copy_task(copy):
+                    task_remote = free_remotes.get()
+                    try:
+                        copy_file(task_remote, *copy)
+                    except Exception as error:
+                        failures.append(error)
+                        raise
+                    finally:
+                        free_remotes.put(task_remote)
+
+                tasks = util.TaskPool(len(remotes))
+                for copy in copies:
+                    tasks.apply_async(copy_task, [copy])
+
+                tasks.wait_all()
+                if failures:
+                    raise failures[0]
+        finally:
+            for clone in remotes[1:]:
+                clone.close()
+
+        sys.stderr.write("\r%s/%s bytes copied\n" % (state["copied"], total))
 
     def verify(self, show=False, deploy=False, audit=False, show_diff=False,
                verbose=False, callback=None, path_prefix="", raw=False,
-               access_method=None, color="auto", config_patterns=None, tag=None):
+               access_method=None, color="auto", config_patterns=None, tag=None,
+               jobs=None, checksum=False, render_processes=None,
+               changed_paths=None, delta=False):
         self.log.debug("verify: %s", dict(show=show, deploy=deploy,
                                           audit=audit, show_diff=show_diff,
-                                          verbose=verbose, callback=callback))
+                                          verbose=verbose, callback=callback,
+                                          jobs=jobs, checksum=checksum,
+                                          render_processes=render_processes))
+        if self.collect_remaining and any(f.get("report") for f in self.files):
+            # reports are rendered from the records of all the nodes
+            self.collect_remaining_nodes()
+
         files = [f for f in self.files if not f.get("report")]
         reports = [f for f in self.files if f.get("report")]
+        partial_collect = self.collect_remaining
+        if partial_collect:
+            collected_count = len(self.files)
+            def collect_remaining():
+                partial_collect()
+                for entry in self.files[collected_count:]:
+                    if entry.get("report"):
+                        reports.append(entry)
+                    elif ((entry["type"] == "file") and entry["dest_bucket"]
+                          and (select(entry) is not None)
+                          and self.render_record(entry)):
+                        # records are added before the bucket being read is
+                        # returned to the template that triggered the collect
+                        pass
+                    else:
+                        # failed records are rendered again and reported in
+                        # the verify loop
+                        files.append(entry)
+
+            self.collect_remaining = collect_remaining
+
         color = colors.Output(sys.stdout, color=color).color
         stats = util.PropDict(dict(error_count=0, file_count=0))
         config_patterns = [re.compile(p) for p in (config_patterns or [])]
         tag = tag or ""  # empty string indicates untagged files
-        for entry in itertools.chain(files, reports):
+        # remote operations are collected per node and run after rendering
+        node_ops = OrderedDict()
+        if self.render_cache:
+            self.render_cache.reset()
+
+        if changed_paths is not None:
+            # incremental: only render the files affected by the changes,
+            # reports may depend on anything and are always rendered
+            changed_files = self.get_changed_entries(
+                [f for f in files if f["type"] == "file"], changed_paths)
+            self.log.info("%d/%d files affected by %d changed paths",
+                          len(changed_files), len(files), len(changed_paths))
+            changed_ids = set(id(f) for f in changed_files)
+            files = [f for f in files
+                     if (f["type"] != "file") or (id(f) in changed_ids)]
+
+        def select(entry):
+            """
+            Return None if 'entry' is skipped altogether, otherwise whether
+            it is filtered out from showing, auditing and deploying
+            """
             if not entry["node"].verify_enabled():
                 self.log.debug("filtered: verify disabled: %r", entry)
-                continue
+                return None
 
             if config_patterns and not any(p.search(entry["config"].name) for p in config_patterns):
                 self.log.debug("filtered: config patterns do not match: %r", entry)
-                continue
+                return None
 
             # is the target excluded from the operation by --tag?
             filtered_out = tag not in (entry.get("tags") or [""])
@@ -146,6 +452,26 @@ class Manager(object):
                 self.log.debug("filtered: callback: %r", entry)
                 filtered_out = True
 
+            return filtered_out
+
+        rendered = {}
+        if render_processes and (render_processes > 1) and not raw:
+            # reports depend on the buckets filled by the other renders and
+            # are always rendered here, as are the filtered out files adding
+            # records to buckets
+            rendered = self.render_parallel(
+                [(index, entry) for index, entry in enumerate(files)
+                 if (entry["type"] == "file") and (select(entry) is False)],
+                render_processes)
+
+        for index, entry in enumerate(itertools.chain(files, reports)):
+            filtered_out = select(entry)
+            if filtered_out is None:
+                continue
+            elif filtered_out and not entry.get("dest_bucket"):
+                # the output would not be used for anything
+                continue
+
             if path_prefix:
                 item_path_prefix = "%s/%s/" % (path_prefix, entry["node"].name)
             else:
@@ -157,19 +483,15 @@ class Manager(object):
             node_name = entry["node"].name
 
             if entry["type"] == "dir":
-                if filtered_out:
-                    # ignore
-                    continue
-
                 with RenderContext(entry, "source_path"):
                     source_path = entry["config"].plugin.render_name(entry["source_path"])
                 with RenderContext(entry, "dest_path"):
                     dest_path = entry["config"].plugin.render_name(entry["dest_path"])
                 if deploy:
                     # copy a directory recursively
-                    remote = entry["node"].get_remote(override=access_method)
-                    self.copy_tree(source_path, dest_path, remote, path_prefix=item_path_prefix,
-                                   verbose=verbose)
+                    node_ops.setdefault(node_name, (entry["node"], []))[1].append(
+                        dict(entry=entry, source_path=source_path,
+                             dest_path=dest_path, path_prefix=item_path_prefix))
                 else:
                     # verify
                     try:
@@ -194,16 +516,34 @@ class Manager(object):
             stats["file_count"] += 1
             source_path = os.path.join(entry["config"].path, entry["source_path"])
             try:
-                dest_path = entry["dest_path"]
-                if dest_path and dest_path[-1:] == "/":
-                    # dest path ending in slash: use source filename
-                    dest_path = os.path.join(dest_path, os.path.basename(source_path))
-
+                dest_path = get_dest_path(entry, source_path)
                 if raw:
                     dest_path, output = dest_path, open(source_path).read()
+                elif index in rendered:
+                    dest_path, output, dynamic = rendered[index]
+                    if self.verify_state and (dynamic is not None):
+                        # not served from a cache: record lookup usage
+                        self.verify_state.set_dynamic(
+                            self.get_entry_key(entry), dynamic)
                 else:
-                    with RenderContext(entry, "template"):
-                        dest_path, output = render(source_path, dest_path, source_text=entry["source_text"])
+                    counts = (self.cache_hit_count, self.lookup_count,
+                              self.bucket_access_count)
+                    entry_key = self.get_entry_key(entry)
+                    try:
+                        with RenderContext(entry, "template"):
+                            dest_path, output = render(source_path, dest_path, source_text=entry["source_text"])
+                    except Exception:
+                        if self.verify_state:
+                            self.verify_state.forget(entry_key)
+                        raise
+
+                    if self.verify_state and (self.cache_hit_count == counts[0]):
+                        # not served from a cache, which keeps the state
+                        # recorded by the original render: record lookup usage
+                        self.verify_state.set_dynamic(
+                            entry_key,
+                            (self.lookup_count, self.bucket_access_count)
+                            != counts[1:])
 
                 if dest_path:
                     dest_path = os.path.normpath(item_path_prefix + dest_path)
@@ -262,67 +602,267 @@ class Manager(object):
                                                    color("---", "header")))
                 sys.stdout.flush()
 
-            remote = None
-
             if (audit or deploy) and dest_path and (not failed) and (not filtered_out):
-                # read existing file
-                try:
-                    remote = entry["node"].get_remote(override=access_method)
-                    active_text = remote.read_file(dest_path)
-                    stat = remote.stat(dest_path)
-                    if stat:
-                        active_time = datetime.datetime.fromtimestamp(
-                            stat.st_mtime)
-                    else:
-                        active_time = ""
-                except errors.RemoteFileDoesNotExist as error:
-                    active_text = None
-                    if audit:
-                        self.log.error("%s: %s: %s: %s", node_name, dest_path,
-                                       error.__class__.__name__, error)
-                        stats["error_count"] += 1
-                except errors.RemoteError as error:
-                    failed = True
-                    if audit or deploy:
-                        self.log.error("%s: %s: %s: %s", node_name, dest_path,
-                                       error.__class__.__name__, error)
-                        stats["error_count"] += 1
+                node_ops.setdefault(node_name, (entry["node"], []))[1].append(
+                    dict(entry=entry, dest_path=dest_path, output=output))
+
+        if partial_collect and self.collect_remaining:
+            self.collect_remaining = partial_collect
+
+        if self.render_cache:
+            self.render_cache.trim()
+
+        if self.verify_state:
+            self.verify_state.save()
+
+        stats["error_count"] += self.run_node_ops(
+            node_ops, jobs=jobs, deploy=deploy, audit=audit,
+            show_diff=show_diff, verbose=verbose,
+            access_method=access_method, color=color, delta=delta,
+            # diffs need the full file contents
+            checksum=checksum and not (audit and show_diff))
 
-                    active_text = None
+        if stats["error_count"]:
+            raise errors.VerifyError(
+                "failed: there were [%(error_count)s/%(file_count)s] errors" % stats)
+
+        return stats
+
+    def render_parallel(self, entries, processes):
+        """
+        Render [(index, entry), ...] file entries in forked worker processes
+
+        Returns {index: (dest_path, output, dynamic)}, see _render_in_process().
+        Entries that failed to render or accessed buckets are left out and
+        must be rendered by the caller.
+        """
+        global _parallel_render
+        try:
+            context = multiprocessing.get_context("fork")
+        except AttributeError:
+            # python 2: always forks
+            context = multiprocessing
+        except ValueError:
+            self.log.warning("parallel rendering requires fork(), "
+                             "rendering in a single process")
+            return {}
+
+        if self.render_cache:
+            # calculated once here instead of in every process
+            self.render_cache.get_fingerprint()
+
+        _parallel_render = (self, entries)
+        pool = context.Pool(processes)
+        try:
+            results = pool.map(_render_in_process, range(len(entries)),
+                               chunksize=(len(entries) // (processes * 4)) + 1)
+        except Exception as error:  # pylint: disable=W0703
+            self.log.warning("parallel rendering failed: %s: %s, "
+                             "rendering in a single process",
+                             error.__class__.__name__, error)
+            results = []
+        finally:
+            pool.close()
+            pool.join()
+            _parallel_render = None
+
+        if self.render_cache:
+            # worker processes may have added entries, see if trimming is needed
+            self.render_cache.written += 1
+
+        return dict((entries[position][0], result)
+                    for position, result in enumerate(results)
+                    if result is not None)
+
+    def run_node_ops(self, node_ops, jobs=None, **options):
+        """
+        Run the remote operations of each node, up to 'jobs' nodes at a time.
+
+        'node_ops' maps node names to (node, [operation, ...]) pairs.
+        Operations of a single node are always run in order by one worker.
+        Returns the total error count.
+        """
+        error_counts = {}
+
+        def run_ops(node, ops):
+            error_counts[node.name] = self.verify_node(node, ops, **options)
+
+        if (not jobs) or (jobs <= 1) or (len(node_ops) <= 1):
+            for node, ops in node_ops.values():
+                run_ops(node, ops)
+        else:
+            tasks = util.TaskPool(min(jobs, len(node_ops)))
+            for node, ops in node_ops.values():
+                tasks.apply_async(run_ops, [node, ops])
+
+            tasks.wait_all()
+
+        error_count = 0
+        for node_name, (_, ops) in node_ops.items():
+            if node_name in error_counts:
+                error_count += error_counts[node_name]
             else:
-                active_text = None
+                # unexpected error, already logged by the task pool
+                error_count += len(ops)
+
+        return error_count
+
+    def verify_node(self, node, ops, deploy=False, audit=False,
+                    show_diff=False, verbose=False, access_method=None,
+                    color=None, checksum=False, delta=False):
+        """
+        Audit and/or deploy the files of a single node, returns error count
+
+        With 'checksum' only the digests of the existing files are fetched
+        and compared instead of the full contents. With 'delta' only the
+        changes to existing files are sent when copying directories.
+        """
+        error_count = 0
+        node_name = node.name
+        # fetch all existing files at once, any errors are reported per file
+        active_files = {}
+        dest_paths = [op["dest_path"] for op in ops
+                      if op["entry"]["type"] != "dir"]
+        if dest_paths:
+            try:
+                remote = node.get_remote(override=access_method)
+                if checksum:
+                    active_files = remote.checksum_files(dest_paths)
+                else:
+                    active_files = remote.read_files(dest_paths)
+            except errors.RemoteError as error:
+                self.log.debug("%s: prefetch failed: %s: %s", node_name,
+                               error.__class__.__name__, error)
+
+        written = set()
+        if deploy and not audit:
+            # a new node: write the missing files all at once
+            missing = [op for op in ops
+                       if (op["entry"]["type"] != "dir")
+                       and os.path.isabs(op["dest_path"])
+                       and isinstance(active_files.get(op["dest_path"]),
+                                      errors.RemoteFileDoesNotExist)]
+            if (len(missing) >= BULK_DEPLOY_MIN_FILES) \
+                    and (len(missing) * 2 >= len(dest_paths)):
+                written = self.deploy_files(
+                    node.get_remote(override=access_method), missing)
+
+        for op in ops:
+            entry = op["entry"]
+            dest_path = op["dest_path"]
+            if id(op) in written:
+                continue
+            elif entry["type"] == "dir":
+                remote = node.get_remote(override=access_method)
+                self.copy_tree(op["source_path"], dest_path, remote,
+                               path_prefix=op["path_prefix"], verbose=verbose,
+                               delta=delta)
+                continue
+
+            output = op["output"]
+            failed = False
+            active_text = None
+            active_digest = None
+            # read existing file
+            try:
+                remote = node.get_remote(override=access_method)
+                active_file = active_files.get(dest_path)
+                if active_file is None:
+                    if checksum:
+                        active_file = remote.checksum_files([dest_path])
+                    else:
+                        active_file = remote.read_files([dest_path])
+
+                    active_file = active_file[dest_path]
+
+                if isinstance(active_file, errors.RemoteError):
+                    raise active_file
+
+                if checksum:
+                    active_digest, stat = active_file
+                else:
+                    active_text, stat = active_file
+
+                if stat:
+                    active_time = datetime.datetime.fromtimestamp(
+                        stat.st_mtime)
+                else:
+                    active_time = ""
+            except errors.RemoteFileDoesNotExist as error:
+                if audit:
+                    self.log.error("%s: %s: %s: %s", node_name, dest_path,
+                                   error.__class__.__name__, error)
+                    error_count += 1
+            except errors.RemoteError as error:
+                failed = True
+                self.log.error("%s: %s: %s: %s", node_name, dest_path,
+                               error.__class__.__name__, error)
+                error_count += 1
 
-            if active_text and audit:
+            changed = None
+            if active_digest is not None:
+                changed = (active_digest != util.content_digest(output))
+
+            if audit and (active_text or (active_digest is not None)):
                 audit_error = self.audit_output(
                     entry, dest_path, active_text, active_time, output,
                     show_diff=show_diff, color=color,
-                    verbose=verbose)
+                    verbose=verbose, changed=changed)
 
                 if audit_error:
-                    stats["error_count"] += 1
+                    error_count += 1
 
-            if deploy and dest_path and (not failed) and (not filtered_out):
-                remote = entry["node"].get_remote(override=access_method)
+            if deploy and (not failed):
                 try:
                     self.deploy_file(remote, entry, dest_path, output,
                                      active_text, verbose=verbose,
                                      mode=entry.get("mode"),
                                      owner=entry.get("owner"),
-                                     group=entry.get("group"))
+                                     group=entry.get("group"),
+                                     changed=changed)
                 except errors.RemoteError as error:
-                    stats["error_count"] += 1
+                    error_count += 1
                     self.log.error("%s: %s: %s", node_name, dest_path, error)
                     # NOTE: continuing
 
-        if stats["error_count"]:
-            raise errors.VerifyError(
-                "failed: there were [%(error_count)s/%(file_count)s] errors" % stats)
+        return error_count
 
-        return stats
+    def deploy_files(self, remote, ops):
+        """
+        Write the files of 'ops' with a single remote operation
+
+        Returns the ids of the ops handled, none if the remote failed, in
+        which case the files are expected to be deployed one by one.
+        """
+        try:
+            remote.write_files([
+                    (op["dest_path"], op["output"], op["entry"].get("mode"),
+                     op["entry"].get("owner"), op["entry"].get("group"))
+                    for op in ops])
+        except errors.RemoteError as error:
+            self.log.warning("%s: writing %d files at once failed, "
+                             "writing them separately: %s: %s",
+                             ops[0]["entry"]["node"].name, len(ops),
+                             error.__class__.__name__, error)
+            return set()
+
+        for op in ops:
+            entry = op["entry"]
+            self.log.info(self.audit_format, "WROTE", entry["node"].name,
+                          op["dest_path"])
+            post_process = entry.get("post_process")
+            if post_process:
+                post_process(op["dest_path"])
+
+        return set(id(op) for op in ops)
 
     def deploy_file(self, remote, entry, dest_path, output, active_text,
-                    verbose=False, mode=None, owner=None, group=None):
-        if output == active_text:
+                    verbose=False, mode=None, owner=None, group=None,
+                    changed=None):
+        if changed is None:
+            changed = (output != active_text)
+
+        if not changed:
             # nothing to do
             if verbose:
                 self.log.info(self.audit_format, "OK",
@@ -347,13 +887,16 @@ class Manager(object):
 
     def audit_output(self, entry, dest_path, active_text, active_time,
                      output, show_diff=False, color="auto",
-                     verbose=False):
+                     verbose=False, changed=None):
         error = False
-        if (active_text is not None) and (active_text != output):
+        if changed is None:
+            changed = (active_text is not None) and (active_text != output)
+
+        if changed:
             error = True
             self.log.warning(self.audit_format, "DIFFERS",
                              entry["node"].name, dest_path)
-            if show_diff:
+            if show_diff and (active_text is not None):
                 color = colors.Output(sys.stdout, color=color).color
                 diff = difflib.unified_diff(
                     output.splitlines(True),
@@ -362,13 +905,14 @@ class Manager(object):
                     "", active_time,  # TODO: mtime for config?
                     lineterm="\n")
 
+                # written in one go so that diffs of concurrently audited
+                # nodes do not get mixed up
                 diff_colors = {"+": "lgreen", "@": "white", "-": "lred"}
-                for line in diff:
-                    sys.stdout.write(
-                        color(line, diff_colors.get(line[:1], "reset")))
-
+                sys.stdout.write("".join(
+                        color(line, diff_colors.get(line[:1], "reset"))
+                        for line in diff))
                 sys.stdout.flush()
-        elif active_text and verbose:
+        elif verbose:
             self.log.info(self.audit_format, "OK", entry["node"].name,
                           dest_path)
 
@@ -550,6 +1094,7 @@ class PlugIn(object):
         if auto_override:
             source_path = self.get_override_config_path(source_path)
         return self.manager.add_file(node=self.node, config=self.config,
+                                     top_config=self.top_config,
                                      type="file", dest_path=dest_path,
                                      source_path=source_path,
                                      source_text=source_text,
@@ -562,7 +1107,9 @@ class PlugIn(object):
     def add_dir(self, source_path, dest_path, render=None, tags=None):
         render = render or self.render
         return self.manager.add_file(type="dir", node=self.node,
-                                     config=self.config, dest_path=dest_path,
+                                     config=self.config,
+                                     top_config=self.top_config,
+                                     dest_path=dest_path,
                                      source_path=source_path, render=render,
                                      tag=tags)
 
@@ -599,19 +1146,20 @@ class PlugIn(object):
                         **kwargs)
 
     def add_record(self, bucket_name, **kwargs):
-        self.manager.get_bucket(bucket_name).add(
+        self.manager.get_bucket(bucket_name, collect=False).add(
             Edge(source_node=self.node, source_config=self.top_config, **kwargs))
 
     def get_names(self):
+        track = self.track_lookups
         names = dict(node=self.node,
                      s=self.top_config.settings,
                      settings=self.top_config.settings,
                      system=self.node.system,
-                     find=self.manager.confman.find,
-                     find_config=self.manager.confman.find_config,
-                     get_node=self.get_one,
-                     get_system=self.get_system,
-                     get_config=self.manager.confman.get_config,
+                     find=track(self.manager.confman.find),
+                     find_config=track(self.manager.confman.find_config),
+                     get_node=track(self.get_one),
+                     get_system=track(self.get_system),
+                     get_config=track(self.manager.confman.get_config),
                      config=self.top_config,
                      bucket=self.manager.get_bucket,
                      edge=self.add_edge,
@@ -619,7 +1167,19 @@ class PlugIn(object):
                      plugin=self)
         return names
 
-    def cached_template(self, key, renderer):
+    def track_lookups(self, method):
+        """count calls to 'method' as dynamic lookups of the repository"""
+        def lookup(*args, **kwargs):
+            self.manager.lookup_count += 1
+            found = method(*args, **kwargs)
+            if self.manager.node_collector:
+                self.manager.node_collector(found)
+
+            return found
+
+        return lookup
+
+    def cached_template(self, key, renderer, persistent_key_func=None):
         if self.manager.confman._cache_reset_counter != self._template_cache_reset_counter:
             # conf manager cache has been reset, we need to invalidate our internal cache, too
             self._template_cache = {}
@@ -628,12 +1188,48 @@ class PlugIn(object):
         # see if the template has already been rendered and is in cache
         cached = self._template_cache.get(key)
         if cached:
+            self.manager.cache_hit_count += 1
             return cached
 
-        rendered = renderer()
+        render_cache = self.manager.render_cache
+        persistent_key = None
+        if render_cache and persistent_key_func:
+            persistent_key = persistent_key_func()
+
+        if persistent_key:
+            rendered = render_cache.get(persistent_key)
+            if rendered is None:
+                # renders that read or add bucket records depend on (or
+                # affect) the other renders and cannot be skipped next time
+                access_count = self.manager.bucket_access_count
+                rendered = renderer()
+                if access_count == self.manager.bucket_access_count:
+                    render_cache.put(persistent_key, rendered)
+            else:
+                self.manager.cache_hit_count += 1
+        else:
+            rendered = renderer()
+
         self._template_cache[key] = rendered  # cache result for next time
         return rendered
 
+    def get_persistent_key(self, engine, source_text, source_path):
+        """return the render cache key of a template or None if not cacheable"""
+        if source_text:
+            source_id = util.content_digest(source_text)
+        else:
+            # template files may reside outside of the repository
+            source_path = self.render_name(source_path)
+            try:
+                source_stat = os.stat(source_path)
+            except (OSError, TypeError):
+                return None
+
+            source_id = "%r:%d" % (source_stat.st_mtime, source_stat.st_size)
+
+        return (engine, source_id, source_path, self.node.name,
+                self.config.name, self.top_config.name)
+
     def render_name(self, name, names=None):
         if not name or (("$" not in name) and ("#" not in name)):
             return name  # skip rendering in trivial cases
@@ -652,17 +1248,20 @@ class PlugIn(object):
         else:
             return (self.render_name(dest_path),
                     self.cached_template(("cheetah", hash(source_text), source_path),
-                                         lambda: self._render(template.render_cheetah, source_text, source_path)))
+                                         lambda: self._render(template.render_cheetah, source_text, source_path),
+                                         lambda: self.get_persistent_key("cheetah", source_text, source_path)))
 
     def render_mako(self, source_path, dest_path, source_text=None):
         return (self.render_name(dest_path),
                 self.cached_template(("mako", hash(source_text), source_path),
-                                     lambda: self._render(template.render_mako, source_text, source_path)))
+                                     lambda: self._render(template.render_mako, source_text, source_path),
+                                     lambda: self.get_persistent_key("mako", source_text, source_path)))
 
     def render_genshi_xml(self, source_path, dest_path, source_text=None):
         return (self.render_name(dest_path),
                 self.cached_template(("genshi", hash(source_text), source_path),
-                                     lambda: self._render(template.render_genshi, source_text, source_path)))
+                                     lambda: self._render(template.render_genshi, source_text, source_path),
+                                     lambda: self.get_persistent_key("genshi", source_text, source_path)))
 
     def _render(self, renderer, source_text, source_path):
         names = self.get_names()
@@ -0,0 +1,139 @@
+"""
+persistent catalogue of the control operations in the repository
+
+Copyright (c) 2010-2012 Mika Eloranta
+See LICENSE for details.
+
+"""
+
+import hashlib
+import logging
+import os
+import time
+from glob import glob
+from . import util
+from .repoindex import MIN_AGE
+
+CATALOG_VERSION = 1
+
+
+class ControlCatalog(object):
+    """
+    On-disk list of the control operations of every node and config
+
+    Each operation is stored as a dict with its node, config and operation
+    names and the features it provides and requires. The catalogue is keyed
+    by the node, system and config property files, the settings layers, the
+    plugin files used by each config and the files in the library
+    directories 'lib_paths' the plugins may import, so that the operations
+    needed for a single 'poni control' can be selected without loading all
+    the plugins in the repository.
+    """
+    def __init__(self, file_path, lib_paths=()):
+        self.log = logging.getLogger("controlcatalog")
+        self.file_path = file_path
+        self.lib_paths = list(lib_paths)
+
+    def get_key(self, configs):
+        """
+        return the key for [(node, config), ...] or None if any of the files
+        is too fresh for its modifications to be reliably noticed
+        """
+        digest = hashlib.sha256(("%d" % CATALOG_VERSION).encode("utf-8"))
+        now = time.time()
+        for lib_path in self.lib_paths:
+            digest.update(("%s\0" % lib_path).encode("utf-8"))
+            for rel_path, mtime, size in util.tree_stats(lib_path):
+                if (now - mtime) < MIN_AGE:
+                    return None
+
+                digest.update(("%s\0%r\0%d\0" % (rel_path, mtime, size)
+                               ).encode("utf-8"))
+
+        stamps = {}  # systems and settings layers are shared by many configs
+        for node, conf in configs:
+            parts = [node.name, conf.name,
+                     repr(bool(node.get_tree_property("template", False)))]
+            file_paths = [node.conf_file, conf.conf_file,
+                          conf.get_plugin_path()]
+            system = node.system
+            while system:
+                file_paths.append(system.conf_file)
+                system = system.system
+
+            for layer_name, settings_dir in conf.get_settings_dirs():
+                # the sorted list of layer files notices added and removed ones
+                file_paths.extend(sorted(glob(os.path.join(settings_dir,
+                                                           "*.json"))))
+
+            for file_path in file_paths:
+                stamp = stamps.get(file_path)
+                if stamp is None:
+                    try:
+                        file_stat = os.stat(file_path)
+                    except (TypeError, OSError):
+                        stamp = "-"
+                    else:
+                        if (now - file_stat.st_mtime) < MIN_AGE:
+                            return None
+
+                        stamp = "%s:%r:%d" % (file_path, file_stat.st_mtime,
+                                              file_stat.st_size)
+
+                    stamps[file_path] = stamp
+
+                parts.append(stamp)
+
+            digest.update(("\0".join(parts) + "\n").encode("utf-8"))
+
+        return digest.hexdigest()
+
+    def load(self, key):
+        """return the list of operations stored with 'key' or None"""
+        data = util.json_load_or_default(self.file_path, {},
+                                         version=CATALOG_VERSION, log=self.log)
+        if data.get("key") != key:
+            return None
+
+        return data.get("ops")
+
+    def save(self, key, ops):
+        """store the operations from PlugIn.iter_control_operations()"""
+        ops = [dict(node=op["node"].name, config=op["config"].name,
+                    name=op["name"], provides=list(op["provides"]),
+                    requires=list(op["requires"]),
+                    optional_requires=list(op["optional_requires"]))
+               for op in ops]
+        data = dict(version=CATALOG_VERSION, key=key, ops=ops)
+        try:
+            util.json_dump_atomic(data, self.file_path)
+        except (IOError, OSError) as error:
+            self.log.debug("control catalogue %r not saved: %s: %s",
+                           self.file_path, error.__class__.__name__, error)
+
+
+def select_configs(ops, is_target):
+    """
+    return {(node name, config name), ...} of the configs needed for running
+    the operations accepted by 'is_target(op)' and everything they require
+    """
+    provider = {}
+    for op in ops:
+        for feature in op["provides"]:
+            provider.setdefault(feature, []).append(op)
+
+    needed = set()
+    handled = set()
+    pending = [op for op in ops if is_target(op)]
+    while pending:
+        op = pending.pop()
+        key = (op["node"], op["config"], op["name"])
+        if key in handled:
+            continue
+
+        handled.add(key)
+        needed.add((op["node"], op["config"]))
+        for feature in op["requires"] + op["optional_requires"]:
+            pending.extend(provider.get(feature, []))
+
+    return needed
@@ -9,6 +9,7 @@ See LICENSE for details.
 from . import errors
 from . import newconfig
 from . import rcontrol_all
+from . import repoindex
 from . import util
 from . import vc
 from .util import json
@@ -26,6 +27,13 @@ REPO_CONF_FILE = "repo.json"
 CONFIG_DIR = "config"
 PLUGIN_FILE = "plugin.py"
 SETTINGS_DIR = "settings"
+CACHE_DIR = ".cache"
+INDEX_FILE = "index.json"
+RENDER_CACHE_DIR = "render"
+TEMPLATE_MODULE_DIR = "templates"
+VERIFY_STATE_FILE = "verify-state.json"
+CONTROL_JOURNAL_DIR = "control-runs"
+CONTROL_CATALOG_FILE = "control-catalog.json"
 
 DONT_SHOW = set(["cloud"])
 DONT_SAVE = set(["index", "sub_count", "depth"])
@@ -189,14 +197,21 @@ class Config(Item):
         Item.__init__(self, "config", None, name, config_dir,
                       os.path.join(config_dir, CONFIG_CONF_FILE),
                       extra)
-        self.update(json.load(open(self.conf_file)))
+        self.update(node.confman.index.load_json(self.conf_file))
         self.node = node
         self.settings_dir = os.path.join(self.path, SETTINGS_DIR)
-        # TODO: lazy-load settings
-        self.settings = newconfig.Config(self.get_settings_dirs())
+        self._settings = None  # loaded on first access
         self.controls = None
         self.plugin = None
 
+    def get_settings(self):
+        if self._settings is None:
+            self._settings = newconfig.Config(self.get_settings_dirs())
+
+        return self._settings
+
+    settings = property(get_settings, doc="merged settings layers")
+
     def get_full_path(self):
         return "%s/%s" % (self.node.name, self.name)
 
@@ -222,6 +237,21 @@ class Config(Item):
 
         return parent_config.get_plugin()
 
+    def get_plugin_path(self):
+        """return the path of the plugin file used by this config or None"""
+        plugin_path = os.path.join(self.path, PLUGIN_FILE)
+        if os.path.exists(plugin_path):
+            return plugin_path
+
+        parent_config_name = self.get("parent")
+        if not parent_config_name:
+            return None
+
+        parent_conf_node, parent_config = self.node.confman.get_config(
+            parent_config_name)
+
+        return parent_config.get_plugin_path()
+
     def load_settings_layer(self, file_name):
         try:
             return json.load(open(os.path.join(self.settings_dir, file_name)))
@@ -234,7 +264,8 @@ class Config(Item):
 
         full_path = os.path.join(self.settings_dir, file_name)
         util.json_dump(layer, full_path)
-        self.settings.reload()
+        if self._settings is not None:
+            self._settings.reload()
 
     def get_settings_dirs(self):
         parent_config_name = self.get("parent")
@@ -313,7 +344,7 @@ class Node(Item):
         self.confman = confman
         self._remotes = {}
         self.config_cache = {}
-        self.update(json.load(open(self.conf_file)))
+        self.update(confman.index.load_json(self.conf_file))
 
     def addr(self, network=None):
         """Return node's network address for the given network name"""
@@ -401,12 +432,12 @@ class Node(Item):
 
     def iter_configs(self):
         config_dir = os.path.join(self.path, CONFIG_DIR)
-        dirs = []
-        if os.path.exists(config_dir):
-            for dir_entry in os.listdir(config_dir):
-                config_path = os.path.join(config_dir, dir_entry)
-                if os.path.isdir(config_path):
-                    dirs.append(config_path)
+        try:
+            sub_dirs, files = self.confman.index.listdir(config_dir)
+        except OSError:
+            sub_dirs = []  # no configs
+
+        dirs = [os.path.join(config_dir, dir_entry) for dir_entry in sub_dirs]
 
         for config_path in dirs:
             conf = self.config_cache.get(config_path)
@@ -454,14 +485,18 @@ class Node(Item):
 
 
 class System(Item):
-    def __init__(self, system, name, system_path, sub_count, extra=None):
+    def __init__(self, system, name, system_path, sub_count, extra=None,
+                 props=None):
         Item.__init__(self, "system", system, name, system_path,
                       os.path.join(system_path, SYSTEM_CONF_FILE), extra)
         self["sub_count"] = sub_count
-        try:
-            self.update(json.load(open(self.conf_file)))
-        except IOError:
-            pass
+        if props is None:
+            try:
+                props = json.load(open(self.conf_file))
+            except IOError:
+                props = {}
+
+        self.update(props)
 
 
 class PathPyCompat(str):
@@ -481,6 +516,8 @@ class ConfigMan(object):
         self.find_cache = {}
         self.find_config_cache = {}
         self._cache_reset_counter = g_cache_reset_counter
+        self.index = repoindex.RepoIndex(self.root_dir,
+                                         self.get_cache_path(INDEX_FILE))
         if must_exist:
             conf = self.load_config()
             self.apply_library_paths(conf.get("libpath", {}))
@@ -494,6 +531,10 @@ class ConfigMan(object):
             find_config_cache=len(self.find_config_cache),
             )
 
+    def get_cache_path(self, name):
+        """return the path of a repository-local cache file or dir 'name'"""
+        return os.path.join(self.root_dir, CACHE_DIR, name)
+
     def reset_cache(self):
         self.node_cache = {}
         self.node_addr_cache = {}
@@ -503,6 +544,13 @@ class ConfigMan(object):
         g_cache_reset_counter += 1
         self._cache_reset_counter = g_cache_reset_counter
 
+    def get_library_paths(self):
+        """return the sorted absolute paths of the repo's custom library dirs"""
+        return sorted(
+            lib_path if os.path.isabs(lib_path)
+            else os.path.join(self.root_dir, lib_path)
+            for lib_path in self.load_config().get("libpath", {}).values())
+
     def apply_library_paths(self, path_dict):
         """add repo's custom library include paths to sys.path"""
         for lib_path in path_dict.values():
@@ -643,7 +691,13 @@ class ConfigMan(object):
         key = ("system", parent_system, name, current, level, tuple(extra.items()))
         system = self.node_cache.get(key)
         if not system:
-            system = System(parent_system, name, current, level, extra=extra)
+            try:
+                props = self.index.load_json(os.path.join(current, SYSTEM_CONF_FILE))
+            except (IOError, OSError):
+                props = {}
+
+            system = System(parent_system, name, current, level, extra=extra,
+                            props=props)
             self.node_cache[key] = system
 
         return system
@@ -665,6 +719,7 @@ class ConfigMan(object):
         if not results:
             results = list(self._find_config(pattern, all_configs=all_configs, full_match=full_match))
             self.find_config_cache[key] = results
+            self.index.save()
 
         return results
 
@@ -690,6 +745,7 @@ class ConfigMan(object):
         if not results:
             results = list(self._find(pattern, nodes=nodes, systems=systems, depth=depth, full_match=full_match, exclude=exclude))
             self.find_cache[key] = results
+            self.index.save()
 
         return results
 
@@ -714,18 +770,17 @@ class ConfigMan(object):
 
         match_op = pattern.match if full_match else pattern.search
         current = current or self.system_root
-        node_conf_file = os.path.join(current, NODE_CONF_FILE)
         name = current[len(self.system_root) + 1:]
         ok_depth = (not depth) or (curr_depth in depth)
+        sub_dirs, files = self.index.listdir(current)
 
-        if os.path.exists(node_conf_file):
+        if NODE_CONF_FILE in files:
             # this is a node dir
             if nodes and match_op(name) and ok_depth and not exclude(name):
                 yield self.get_node(current, system, extra=extra)
         else:
             # system dir
-            subdirs = [os.path.join(current, entry) for entry in os.listdir(current)]
-            subdirs = sorted(entry for entry in subdirs if os.path.isdir(entry))
+            subdirs = [os.path.join(current, entry) for entry in sub_dirs]
 
             system = self.get_system(system, name, current, len(subdirs), extra)
             if (systems and (current != self.system_root) and ok_depth
@@ -0,0 +1,203 @@
+"""
+rsync-style delta transfer of files over an existing remote copy
+
+The remote host lists the checksums of the fixed-size blocks of its copy of
+the file, the local file is scanned with a rolling checksum for blocks that
+the remote already has and a delta consisting of block references and
+literal data is sent over and applied to the remote copy.
+
+Both of the remote helpers are small Python scripts run over the remote
+control exec channel.
+
+Copyright (c) 2010-2012 Mika Eloranta
+See LICENSE for details.
+
+"""
+
+import hashlib
+import mmap
+import struct
+import sys
+import zlib
+
+try:
+    from shlex import quote
+except ImportError:
+    # python 2
+    from pipes import quote
+
+# files smaller than this are always copied in full
+MIN_SIZE = 2**16
+MIN_BLOCK_SIZE = 2**11
+MAX_BLOCK_SIZE = 2**17
+# giving up when the data does not match the remote copy: at most this many
+# blocks worth of data is scanned byte-by-byte
+MAX_ROLL_BLOCKS = 64
+MAX_LITERAL_SIZE = 2**20
+ADLER_MOD = 65521
+
+if sys.version_info[0] == 2:
+    byte_value = ord
+else:
+    byte_value = int
+
+SIGNATURE_SCRIPT = r"""
+import hashlib, sys, zlib
+block_size = int(sys.argv[2])
+f = open(sys.argv[1], "rb")
+while True:
+    block = f.read(block_size)
+    if len(block) < block_size:
+        break
+    sys.stdout.write("%08x %s\n" % (zlib.adler32(block) & 0xffffffff,
+                                    hashlib.sha1(block).hexdigest()))
+"""
+
+PATCH_SCRIPT = r"""
+import hashlib, os, struct, sys
+file_path, delta_path, block_size = sys.argv[1], sys.argv[2], int(sys.argv[3])
+temp_path = file_path + ".poni-new"
+try:
+    base = open(file_path, "rb")
+    delta = open(delta_path, "rb")
+    out = open(temp_path, "wb")
+    expected = delta.read(40).decode("ascii")
+    digest = hashlib.sha1()
+    while True:
+        op = delta.read(1)
+        if not op:
+            break
+        elif op == b"C":
+            index, count = struct.unpack(">QI", delta.read(12))
+            base.seek(index * block_size)
+            chunks = [base.read(block_size) for i in range(count)]
+        elif op == b"D":
+            chunks = [delta.read(struct.unpack(">I", delta.read(4))[0])]
+        else:
+            sys.exit("invalid delta")
+        for chunk in chunks:
+            digest.update(chunk)
+            out.write(chunk)
+    out.close()
+    if digest.hexdigest() != expected:
+        sys.exit("checksum mismatch")
+    file_stat = os.stat(file_path)
+    os.chmod(temp_path, file_stat.st_mode & 0o7777)
+    try:
+        os.chown(temp_path, file_stat.st_uid, file_stat.st_gid)
+    except OSError:
+        pass
+    os.rename(temp_path, file_path)
+finally:
+    for path in (delta_path, temp_path):
+        if os.path.exists(path):
+            os.unlink(path)
+"""
+
+
+class NoMatch(Exception):
+    """the local file does not have enough in common with the remote copy"""
+
+
+def python_command(script, args):
+    """return a shell command running 'script' with the remote Python"""
+    return "$(command -v python3 || command -v python) -c %s %s" % (
+        quote(script), " ".join(quote(str(arg)) for arg in args))
+
+
+def get_block_size(file_size):
+    """block size for a file: the square root of the size, like rsync"""
+    block_size = MIN_BLOCK_SIZE
+    while (block_size < MAX_BLOCK_SIZE) and (block_size ** 2 < file_size):
+        block_size *= 2
+
+    return block_size
+
+
+def parse_signatures(text):
+    """return {weak checksum: {strong checksum: block index}} from SIGNATURE_SCRIPT"""
+    signatures = {}
+    for index, line in enumerate(text.splitlines()):
+        weak, strong = line.split()
+        signatures.setdefault(int(weak, 16), {}).setdefault(strong, index)
+
+    return signatures
+
+
+def make_delta(data, signatures, block_size, out):
+    """
+    Write the delta of 'data' against a file having the block 'signatures'
+    to file object 'out', returns the number of literal bytes in the delta.
+
+    Raises NoMatch if too much of the data needs to be scanned byte-by-byte.
+    """
+    out.write(hashlib.sha1(data).hexdigest().encode("ascii"))
+    size = len(data)
+    literal_size = [0]
+    run = []  # [first block index, block count] of pending copies
+
+    def flush_run():
+        if run:
+            out.write(b"C" + struct.pack(">QI", run[0], run[1]))
+            del run[:]
+
+    def literal(start, end):
+        if start == end:
+            return
+
+        flush_run()
+        literal_size[0] += end - start
+        for pos in range(start, end, MAX_LITERAL_SIZE):
+            chunk = data[pos:min(end, pos + MAX_LITERAL_SIZE)]
+            out.write(b"D" + struct.pack(">I", len(chunk)))
+            out.write(chunk)
+
+    def copy(index):
+        if run and (run[0] + run[1] == index):
+            run[1] += 1
+        else:
+            flush_run()
+            run[:] = [index, 1]
+
+    roll_budget = MAX_ROLL_BLOCKS * block_size
+    pos = 0
+    literal_start = 0
+    weak = None
+    while pos + block_size <= size:
+        if weak is None:
+            weak = zlib.adler32(data[pos:pos + block_size]) & 0xffffffff
+            a, b = weak & 0xffff, weak >> 16
+
+        candidates = signatures.get(weak)
+        if candidates:
+            index = candidates.get(
+                hashlib.sha1(data[pos:pos + block_size]).hexdigest())
+            if index is not None:
+                literal(literal_start, pos)
+                copy(index)
+                pos += block_size
+                literal_start = pos
+                weak = None
+                continue
+
+        roll_budget -= 1
+        if roll_budget < 0:
+            raise NoMatch()
+
+        if pos + block_size < size:
+            # slide the window by one byte
+            old, new = byte_value(data[pos]), byte_value(data[pos + block_size])
+            a = (a - old + new) % ADLER_MOD
+            b = (b - block_size * old + a - 1) % ADLER_MOD
+            weak = (b << 16) | a
+
+        pos += 1
+
+    literal(literal_start, size)
+    flush_run()
+    return literal_size[0]
+
+
+def map_file(source_file):
+    """return a read-only memory map of a non-empty file"""
+    return mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,92 @@
+"""
+control run journal for resuming interrupted or failed runs
+
+Copyright (c) 2010-2012 Mika Eloranta
+See LICENSE for details.
+
+"""
+
+import logging
+import os
+import threading
+import time
+from . import errors
+from .util import json
+
+
+def new_run_id():
+    return "%s-%d" % (time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+
+
+class ControlJournal(object):
+    """
+    Append-only log of a 'poni control' run, one JSON object per line
+
+    The first line records the command arguments of the run, the following
+    lines the start and finish of each task. Every line is flushed to disk
+    as soon as it is written so that the journal survives the run.
+    """
+    def __init__(self, file_path):
+        self.log = logging.getLogger("journal")
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.out = None
+
+    def load(self):
+        """return (run arguments, {task key: result}) of the finished tasks"""
+        args = None
+        results = {}
+        try:
+            with open(self.file_path) as journal_file:
+                for line in journal_file:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # last line of a run that got killed mid-write
+                        continue
+
+                    if event.get("event") == "run":
+                        args = event["args"]
+                    elif event.get("event") == "finish":
+                        results[tuple(event["task"])] = event["result"]
+        except (IOError, OSError) as error:
+            raise errors.UserError("cannot read control journal %r: %s: %s" % (
+                    self.file_path, error.__class__.__name__, error))
+
+        if args is None:
+            raise errors.UserError("invalid control journal %r" % (
+                    self.file_path))
+
+        return args, results
+
+    def write(self, **event):
+        event["time"] = time.time()
+        line = json.dumps(event) + "\n"
+        with self.lock:
+            if not self.out:
+                journal_dir = os.path.dirname(self.file_path)
+                if not os.path.isdir(journal_dir):
+                    os.makedirs(journal_dir)
+
+                self.out = open(self.file_path, "a")
+
+            self.out.write(line)
+            self.out.flush()
+            os.fsync(self.out.fileno())
+
+    def run_started(self, args):
+        self.write(event="run", args=args)
+
+    def task_started(self, key):
+        self.write(event="start", task=list(key))
+
+    def task_finished(self, key, result):
+        # failure messages are only shown to the user, keep them serializable
+        result = str(result) if result else None
+        self.write(event="finish", task=list(key), result=result)
+
+    def close(self):
+        with self.lock:
+            if self.out:
+                self.out.close()
+                self.out = None
@@ -8,13 +8,54 @@ TODO: this simple draft is VERY likely to change a lot
 
 """
 
+import copy
 import logging
 import os
+import time
 from glob import glob
 from . import errors
+from .repoindex import MIN_AGE
 from .util import json
 
 
+# parsed layer files and merged results of layer sequences, shared by all
+# Config instances: {file_path: ((file_path, mtime, size), data)} and
+# {((file_path, mtime, size), ...): merged}, emptied when they get too big
+MAX_CACHED = 10000
+_parsed_layers = {}
+_merged_layers = {}
+
+
+def get_layer_key(file_path):
+    """return (file_path, mtime, size) or None if the file is too fresh to cache"""
+    file_stat = os.stat(file_path)
+    if (time.time() - file_stat.st_mtime) < MIN_AGE:
+        # another modification within the same mtime tick would go unnoticed
+        return None
+
+    return (file_path, file_stat.st_mtime, file_stat.st_size)
+
+
+def load_layer(file_path, layer_key):
+    cached = _parsed_layers.get(file_path)
+    if layer_key and cached and (cached[0] == layer_key):
+        return copy.deepcopy(cached[1])
+
+    try:
+        config_dict = json.load(open(file_path, "r"))
+    except ValueError as error:
+        raise errors.SettingsError("%s: %s: %s" % (
+                file_path, error.__class__.__name__, error))
+
+    if layer_key:
+        if len(_parsed_layers) >= MAX_CACHED:
+            _parsed_layers.clear()
+
+        _parsed_layers[file_path] = (layer_key, copy.deepcopy(config_dict))
+
+    return config_dict
+
+
 class Config(dict):
     def __init__(self, config_dirs):
         dict.__init__(self)
@@ -37,13 +78,29 @@ class Config(dict):
 
         self.layers.sort()
 
-        for sort_key, layer_name, file_path in self.layers:
-            try:
-                config_dict = json.load(open(file_path, "r"))
-            except ValueError as error:
-                raise errors.SettingsError("%s: %s: %s" % (
-                        file_path, error.__class__.__name__, error))
-
+        layer_keys = [get_layer_key(file_path)
+                      for sort_key, layer_name, file_path in self.layers]
+        if None in layer_keys:
+            layer_keys = None
+
+        # continue from the longest already merged sequence of layers,
+        # typically the ones inherited from the parent configs
+        start = 0
+        if layer_keys:
+            for count in range(len(layer_keys), 0, -1):
+                merged = _merged_layers.get(tuple(layer_keys[:count]))
+                if merged is not None:
+                    self.update(copy.deepcopy(merged))
+                    start = count
+                    break
+
+        # the merged result of the inherited layers is shared by the children
+        inherited_count = len([layer for layer in self.layers
+                               if layer[0][1] < len(self.config_dirs) - 1])
+        for position in range(start, len(self.layers)):
+            sort_key, layer_name, file_path = self.layers[position]
+            config_dict = load_layer(file_path,
+                                     layer_keys and layer_keys[position])
             self.log.debug("loaded %r: %r", file_path, config_dict)
             if not self:
                 # base config (defaults)
@@ -51,6 +108,14 @@ class Config(dict):
             else:
                 self.apply_update(config_dict, self, file_path)
 
+            if layer_keys and (position + 1 in (inherited_count,
+                                                len(self.layers))):
+                if len(_merged_layers) >= MAX_CACHED:
+                    _merged_layers.clear()
+
+                _merged_layers[tuple(layer_keys[:position + 1])] = \
+                    copy.deepcopy(dict(self))
+
     def apply_update(self, update, target, file_path):
         self.log.debug("apply update: %r -> %r", update, target)
         if not isinstance(update, dict):
@@ -9,17 +9,34 @@ See LICENSE for details.
 from __future__ import with_statement
 
 from io import BytesIO
+import binascii
 import errno
 import logging
 import os
 import select
 import shutil
+import stat
 import subprocess
 import sys
 import tarfile
+import tempfile
+import threading
 import time
+from . import delta
 from . import errors
 from . import colors
+from . import util
+
+try:
+    from shlex import quote
+except ImportError:
+    # python 2
+    from pipes import quote
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 DONE = 0
@@ -146,13 +163,87 @@ class RemoteControl(object):
     def read_file(self, file_path):
         assert 0, "must implement in sub-class"
 
+    def read_files(self, file_paths):
+        """
+        Read multiple files and their stat info: {file_path: (contents, stat)}
+
+        A file that cannot be read maps to the errors.RemoteError raised by
+        read_file() or stat() instead. Sub-classes can override this to fetch
+        all the files with fewer round-trips.
+        """
+        files = {}
+        for file_path in file_paths:
+            try:
+                files[file_path] = (self.read_file(file_path),
+                                    self.stat(file_path))
+            except errors.RemoteError as error:
+                files[file_path] = error
+
+        return files
+
+    def checksum_files(self, file_paths):
+        """
+        Get the content digests of multiple files: {file_path: (digest, stat)}
+
+        Digests are util.content_digest() compatible. 'stat' may be None if
+        the implementation does not get it for free. Errors are returned like
+        in read_files(). Sub-classes can override this to calculate the
+        digests remotely without transferring the file contents.
+        """
+        files = self.read_files(file_paths)
+        for file_path, item in files.items():
+            if not isinstance(item, errors.RemoteError):
+                files[file_path] = (util.content_digest(item[0]), item[1])
+
+        return files
+
     def put_file(self, source_path, dest_path, callback=None):
         assert 0, "must implement in sub-class"
 
+    def put_file_delta(self, source_path, dest_path, callback=None):
+        """
+        Copy a file over an existing remote copy sending only the changes,
+        see SshRemoteControl. The default implementation copies it in full.
+        """
+        self.put_file(source_path, dest_path, callback=callback)
+
+    def list_tree(self, dir_path):
+        """
+        List a directory tree with a single operation
+
+        Returns {relative path: stat} of everything under 'dir_path', an
+        empty dict if it does not exist, or None if not supported.
+        """
+        return None
+
+    def clone(self):
+        """
+        Return a new, independent remote control for the same node for
+        running operations concurrently, or None if not supported.
+        """
+        return None
+
     def write_file(self, file_path, contents, mode=None, owner=None,
                    group=None):
         assert 0, "must implement in sub-class"
 
+    def write_files(self, files):
+        """
+        Write multiple files: [(file_path, contents, mode, owner, group), ...]
+
+        Missing directories are created. Sub-classes can override this to
+        write all the files with fewer round-trips.
+        """
+        for file_path, contents, mode, owner, group in files:
+            dir_path = os.path.dirname(file_path)
+            try:
+                self.stat(dir_path)
+            except errors.RemoteError:
+                self.makedirs(dir_path)
+
+            self.write_file(file_path, contents, mode=mode, owner=owner,
+                            group=group)
+
     def execute_command(self, command, pseudo_tty=False):
         assert 0, "must implement in sub-class"
 
@@ -189,6 +280,20 @@ class LocalControl(RemoteControl):
     def __init__(self, node):
         RemoteControl.__init__(self, node)
 
+    def clone(self):
+        return LocalControl(self.node)
+
+    @convert_local_errors
+    def list_tree(self, dir_path):
+        files = {}
+        for sub_dir, dir_names, file_names in os.walk(dir_path):
+            for name in dir_names + file_names:
+                file_path = os.path.join(sub_dir, name)
+                files[os.path.relpath(file_path, dir_path)] = os.lstat(
+                    file_path)
+
+        return files
+
     @convert_local_errors
     def put_file(self, source_path, dest_path, callback=None):
         shutil.copy(source_path, dest_path)
@@ -232,6 +337,12 @@ class LocalControl(RemoteControl):
             if process.stderr in r:
                 yield STDERR, process.stderr.read(CHUNK)
 
+        # output left in the pipes when the process exited
+        for code, pipe in [(STDOUT, process.stdout), (STDERR, process.stderr)]:
+            output = pipe.read()
+            if output:
+                yield code, output
+
         yield DONE, process.returncode
 
     @convert_local_errors
@@ -251,12 +362,97 @@ class LocalControl(RemoteControl):
         os.utime(file_path, times)
 
 
+class TarArchive(object):
+    """
+    Tar archive kept open for writing, shared by all the remotes writing to
+    the same file
+    """
+    lock = threading.Lock()
+    archives = {}
+
+    def __init__(self, file_path, compression):
+        self.lock = threading.Lock()
+        self.users = 0
+        self.stream = None
+        if compression == "zst" and ("zst" not in tarfile.TarFile.OPEN_METH):
+            if not zstandard:
+                raise errors.RemoteError(
+                    "zstd compression requires the zstandard library")
+
+            self.stream = zstandard.ZstdCompressor().stream_writer(
+                open(file_path, "wb"))
+            self.tar = tarfile.open(fileobj=self.stream, mode="w|")
+        elif compression:
+            self.tar = tarfile.open(file_path, "w:%s" % compression)
+        else:
+            # plain archives are appended to, the existing members are
+            # scanned only once
+            self.tar = tarfile.open(file_path, "a")
+
+    @classmethod
+    def acquire(cls, file_path, compression):
+        with cls.lock:
+            archive = cls.archives.get(file_path)
+            if not archive:
+                archive = cls(file_path, compression)
+                cls.archives[file_path] = archive
+
+            archive.users += 1
+            return archive
+
+    def release(self):
+        with TarArchive.lock:
+            self.users -= 1
+            if self.users:
+                return
+
+            for file_path, archive in list(TarArchive.archives.items()):
+                if archive is self:
+                    del TarArchive.archives[file_path]
+
+        with self.lock:
+            self.tar.close()
+            if self.stream:
+                self.stream.close()
+
+    def add(self, info, contents):
+        with self.lock:
+            self.tar.addfile(info, BytesIO(contents))
+
+
 class LocalTarControl(RemoteControl):
-    """Writing to a local tar file"""
-    def __init__(self, node, tar_dir):
+    """
+    Writing to a local tar file
+
+    The archive is kept open until close(). With 'compression' ("gz", "bz2",
+    "xz" or "zst") a new compressed archive is written, otherwise the files
+    are appended to an existing uncompressed archive.
+    """
+    def __init__(self, node, tar_dir, compression=None):
         self.tar_dir = tar_dir
+        self.compression = compression
+        self.archive = None
         RemoteControl.__init__(self, node)
 
+    def get_archive(self):
+        if not self.archive:
+            name = "image.tar"
+            if self.compression:
+                name += ".%s" % self.compression
+
+            full_path = os.path.join(self.tar_dir, self.node["host"], name)
+            if not os.path.isdir(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+
+            self.archive = TarArchive.acquire(full_path, self.compression)
+
+        return self.archive
+
+    def close(self):
+        if self.archive:
+            self.archive.release()
+            self.archive = None
+
     @convert_local_errors
     def put_file(self, source_path, dest_path, callback=None):
         self.write_file(dest_path, open(source_path, "rb").read())
@@ -272,22 +468,19 @@ class LocalTarControl(RemoteControl):
     @convert_local_errors
     def write_file(self, file_path, contents, mode=None, owner=None,
                    group=None):
-        full_path = os.path.join(self.tar_dir, self.node["host"], "image.tar")
-        if not os.path.isdir(os.path.dirname(full_path)):
-            os.makedirs(os.path.dirname(full_path))
+        if not isinstance(contents, bytes):
+            contents = contents.encode("utf-8")
 
-        file_obj = BytesIO(contents)
-        with tarfile.open(full_path, "a") as output:
-            info = tarfile.TarInfo(file_path)
-            info.size = len(contents)
-            if mode is not None:
-                info.mode = mode
-            if owner is not None:
-                info.uid = owner
-            if group is not None:
-                info.gid = group
-            info.mtime = time.time()
-            output.addfile(info, file_obj)
+        info = tarfile.TarInfo(file_path)
+        info.size = len(contents)
+        if mode is not None:
+            info.mode = mode
+        if owner is not None:
+            info.uid = owner
+        if group is not None:
+            info.gid = group
+        info.mtime = time.time()
+        self.get_archive().add(info, contents)
 
     @convert_local_errors
     def execute_command(self, cmd, pseudo_tty=False):
@@ -329,3 +522,223 @@ class SshRemoteControl(RemoteControl):
             self.key_filename = node.get_tree_property("ssh-key")
 
         self.connect_timeout = node.get_tree_property("ssh-timeout", 60.0)
+
+    def clone(self):
+        return self.__class__(self.node)
+
+    def list_tree(self, dir_path):
+        """list the tree with a single remote 'find', requires GNU find"""
+        dir_path = str(dir_path)
+        cmd = ("if [ -d {0} ]; then find {0} -mindepth 1 "
+               "-printf '%y %s %T@ %P\\0'; fi").format(quote(dir_path))
+        chunks = []
+        exit_code = None
+        try:
+            for code, output in self.execute_command(cmd):
+                if code == STDOUT:
+                    chunks.append(output)
+                elif code == DONE:
+                    exit_code = output
+        except errors.RemoteError as error:
+            self.log.debug("%s: listing %s failed: %s: %s", self.node.name,
+                           dir_path, error.__class__.__name__, error)
+            return None
+
+        if exit_code:
+            self.log.debug("%s: listing %s failed: exit code %r",
+                           self.node.name, dir_path, exit_code)
+            return None
+
+        file_types = {"d": stat.S_IFDIR, "f": stat.S_IFREG, "l": stat.S_IFLNK}
+        files = {}
+        for item in b"".join(chunks).decode("utf-8", "replace").split("\0"):
+            if not item:
+                continue
+
+            file_type, size, mtime, name = item.split(" ", 3)
+            files[name] = util.PropDict(
+                st_mode=file_types.get(file_type, 0), st_size=int(size),
+                st_mtime=float(mtime))
+
+        return files
+
+    def remove_quietly(self, file_path):
+        """remove a remote temporary file, failures are only logged"""
+        try:
+            for code, output in self.execute_command("rm -f %s" % quote(
+                    file_path)):
+                pass
+        except errors.RemoteError as error:
+            self.log.warning("%s: removing %s failed: %s", self.node.name,
+                             file_path, error)
+
+    def write_files(self, files):
+        """
+        Write multiple files with a single remote 'tar'
+
+        Tar archives of the files are spooled to local temporary files,
+        uploaded and extracted under the root directory as the remote user.
+        Files without a mode get the remote umask applied like new files
+        written with write_file(), so they are extracted from an archive of
+        their own without keeping the archived permissions. Files having an
+        owner or group are written separately with write_file(). Only
+        absolute file paths are supported.
+        """
+        archives = {}  # {tar options: [(tar info, contents), ...]}
+        owned = []
+        now = time.time()
+        for file_path, contents, mode, owner, group in files:
+            file_path = str(file_path)
+            if not os.path.isabs(file_path):
+                raise errors.RemoteError("%s: not an absolute path: %r" % (
+                        self.node.name, file_path))
+
+            if (owner is not None) or (group is not None):
+                owned.append((file_path, contents, mode, owner, group))
+                continue
+
+            if not isinstance(contents, bytes):
+                contents = contents.encode("utf-8")
+
+            info = tarfile.TarInfo(os.path.normpath(file_path).lstrip("/"))
+            info.size = len(contents)
+            info.mtime = now
+            if mode is None:
+                info.mode = 0o666
+                options = "--no-same-owner --no-same-permissions"
+            else:
+                info.mode = mode
+                options = "--no-same-owner -p"
+
+            archives.setdefault(options, []).append((info, contents))
+
+        temp_paths = []
+        try:
+            commands = []
+            for options, members in sorted(archives.items()):
+                temp_path = "/tmp/poni-deploy-%s.tar" % binascii.hexlify(
+                    os.urandom(8)).decode("ascii")
+                temp_paths.append(temp_path)
+                self.put_archive(members, temp_path)
+                commands.append("tar -x %s -C / -f %s || code=$?" % (
+                        options, temp_path))
+
+            if commands:
+                cmd = "code=0; %s; rm -f %s; exit $code" % (
+                    "; ".join(commands), " ".join(temp_paths))
+                temp_paths = []
+                self.run_tar(cmd)
+        finally:
+            if temp_paths:
+                # upload failed, clean up the archives already uploaded
+                for temp_path in temp_paths:
+                    self.remove_quietly(temp_path)
+
+        if owned:
+            RemoteControl.write_files(self, owned)
+
+    def put_archive(self, members, dest_path):
+        """upload a tar archive of [(tar info, contents), ...] to 'dest_path'"""
+        fd, temp_path = tempfile.mkstemp(prefix="poni-deploy-", suffix=".tar")
+        try:
+            with os.fdopen(fd, "wb") as archive:
+                tar = tarfile.open(fileobj=archive, mode="w")
+                for info, contents in members:
+                    tar.addfile(info, BytesIO(contents))
+
+                tar.close()
+
+            # created first so that the archive is not readable by others
+            self.write_file(dest_path, b"", mode=0o600)
+            self.put_file(temp_path, dest_path)
+        finally:
+            os.unlink(temp_path)
+
+    def run_tar(self, cmd):
+        """run a remote tar command, raises RemoteError if it fails"""
+        error_chunks = []
+        for code, output in self.execute_command(cmd):
+            if code == STDERR:
+                error_chunks.append(output)
+            elif (code == DONE) and output:
+                raise errors.RemoteError("%s: tar failed: %r: %s" % (
+                        self.node.name, output,
+                        b"".join(error_chunks).decode("utf-8", "replace").strip()))
+
+    def run_script(self, script, args):
+        """run a Python 'script' remotely, returns its output"""
+        chunks = []
+        error_chunks = []
+        exit_code = None
+        for code, output in self.execute_command(
+                delta.python_command(script, args)):
+            if code == STDOUT:
+                chunks.append(output)
+            elif code == STDERR:
+                error_chunks.append(output)
+            elif code == DONE:
+                exit_code = output
+
+        if exit_code:
+            raise errors.RemoteError("%s: remote script failed: %r: %s" % (
+                    self.node.name, exit_code,
+                    b"".join(error_chunks).decode("utf-8", "replace").strip()))
+
+        return b"".join(chunks).decode("utf-8")
+
+    def put_file_delta(self, source_path, dest_path, callback=None):
+        """
+        Copy a file over an existing remote copy sending only the changes
+
+        The checksums of the blocks of the remote copy are listed and only
+        the delta against it is sent and applied remotely. The file is copied
+        in full if it is small, there is no remote copy or Python, or the
+        contents have too little in common.
+        """
+        source_path = str(source_path)
+        dest_path = str(dest_path)
+        size = os.stat(source_path).st_size
+        if size < delta.MIN_SIZE:
+            return self.put_file(source_path, dest_path, callback=callback)
+
+        block_size = delta.get_block_size(size)
+        delta_path = "%s.poni-delta" % dest_path
+        uploaded = False
+        try:
+            signatures = delta.parse_signatures(self.run_script(
+                    delta.SIGNATURE_SCRIPT, [dest_path, block_size]))
+            fd, temp_path = tempfile.mkstemp(prefix="poni-delta-")
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    with open(source_path, "rb") as source:
+                        data = delta.map_file(source)
+                        try:
+                            literal_size = delta.make_delta(
+                                data, signatures, block_size, out)
+                        finally:
+                            data.close()
+
+                uploaded = True
+                self.put_file(temp_path, delta_path)
+                delta_size = os.stat(temp_path).st_size
+            finally:
+                os.unlink(temp_path)
+
+            self.run_script(delta.PATCH_SCRIPT,
+                            [dest_path, delta_path, block_size])
+        except (delta.NoMatch, errors.RemoteError, ValueError, IOError,
+                OSError) as error:
+            self.log.debug("%s: delta copy of %s failed: %s: %s",
+                           self.node.name, dest_path,
+                           error.__class__.__name__, error)
+            if uploaded:
+                # the patch script removes the delta, unless it did not run
+                self.remove_quietly(delta_path)
+
+            return self.put_file(source_path, dest_path, callback=callback)
+
+        self.log.debug("%s: delta copy of %s: %d literal bytes, sent %d/%d",
+                       self.node.name, dest_path, literal_size, delta_size,
+                       size)
+        if callback:
+            callback(size, size)
@@ -6,17 +6,31 @@ See LICENSE for details.
 
 """
 
+import functools
 from . import rcontrol
 from . import rcontrol_paramiko
 #from . import rcontrol_openssh
 from . import errors
 
+try:
+    from . import rcontrol_asyncssh
+except SyntaxError:
+    # requires Python 3
+    rcontrol_asyncssh = None
+
 METHODS = {
     "ssh": rcontrol_paramiko.ParamikoRemoteControl,
     "local": rcontrol.LocalControl,
     "tar": rcontrol.LocalTarControl,
     }
 
+for compression in ["gz", "bz2", "xz", "zst"]:
+    METHODS["tar.%s" % compression] = functools.partial(
+        rcontrol.LocalTarControl, compression=compression)
+
+if rcontrol_asyncssh:
+    METHODS["assh"] = rcontrol_asyncssh.AsyncSSHRemoteControl
+
 
 class RemoteManager(object):
     def __init__(self):
@@ -26,6 +40,8 @@ class RemoteManager(object):
         for remote in self.remotes.values():
             remote.close()
 
+        rcontrol_paramiko.pool.close()
+
     def get_remote(self, node, method):
         method = method or "ssh"
         key = (node.name, method)
@@ -0,0 +1,320 @@
+"""
+Node remote control using the asyncssh library
+
+All the SSH connections, channels and SFTP sessions are driven by a single
+asyncio event loop running in a background thread, so controlling thousands
+of hosts does not need a thread blocking on each channel. The blocking
+RemoteControl interface is provided on top of it for the callers.
+
+Requires Python 3.
+
+Copyright (c) 2010-2012 Mika Eloranta
+See LICENSE for details.
+
+"""
+
+import asyncio
+import concurrent.futures
+import inspect
+import os
+import queue
+import threading
+import time
+from . import errors
+from . import rcontrol
+from . import util
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+
+class EventLoop(object):
+    """asyncio event loop running in a daemon thread, shared by all remotes"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+
+    def get_loop(self):
+        with self.lock:
+            if not self.loop:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever,
+                                               name="asyncssh")
+                self.thread.daemon = True
+                self.thread.start()
+
+            return self.loop
+
+    def submit(self, coro):
+        """schedule 'coro' in the event loop, returns a concurrent Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+
+    def run(self, coro):
+        """run 'coro' in the event loop and wait for its result"""
+        return self.submit(coro).result()
+
+
+event_loop = EventLoop()
+
+
+def convert_error(error):
+    """return the errors.RemoteError for an asyncssh or connection error"""
+    if (isinstance(error, asyncssh.SFTPError)
+        and (error.code == asyncssh.FX_NO_SUCH_FILE)):
+        return errors.RemoteFileDoesNotExist(str(error))
+
+    return errors.RemoteError("%s: %s" % (error.__class__.__name__, error))
+
+
+def convert_asyncssh_errors(method):
+    """
+    Convert remote asyncssh errors to errors.RemoteError, also the ones
+    raised while iterating the output of a generator method
+    """
+    if inspect.isgeneratorfunction(method):
+        def wrapper(self, *args, **kw):
+            try:
+                yield from method(self, *args, **kw)
+            except (OSError, EOFError, asyncssh.Error,
+                    concurrent.futures.TimeoutError) as error:
+                raise convert_error(error)
+    else:
+        def wrapper(self, *args, **kw):
+            try:
+                return method(self, *args, **kw)
+            except (OSError, EOFError, asyncssh.Error,
+                    concurrent.futures.TimeoutError) as error:
+                raise convert_error(error)
+
+    wrapper.__doc__ = method.__doc__
+    wrapper.__name__ = method.__name__
+
+    return wrapper
+
+
+def convert_attrs(attrs):
+    """return os.stat() style attributes for asyncssh SFTPAttrs"""
+    return util.PropDict(st_size=attrs.size, st_mtime=attrs.mtime,
+                         st_atime=attrs.atime, st_mode=attrs.permissions,
+                         st_uid=attrs.uid, st_gid=attrs.gid)
+
+
+class AsyncSSHRemoteControl(rcontrol.SshRemoteControl):
+    def __init__(self, node):
+        if not asyncssh:
+            raise errors.RemoteError("%s: asyncssh is not installed" % (
+                    node.name))
+
+        rcontrol.SshRemoteControl.__init__(self, node)
+        self._conn = None
+        self._sftp = None
+
+    async def get_conn(self):
+        if self._conn:
+            return self._conn
+
+        host = self.node.get("host")
+        user = self.node.get("user")
+        password = self.node.get("password")
+        port = int(self.node.get("ssh-port", os.environ.get("PONI_SSH_PORT", 22)))
+
+        if not host:
+            raise errors.RemoteError("%s: 'host' property not defined" % (
+                        self.node.name))
+        elif not user:
+            raise errors.RemoteError("%s: 'user' property not defined" % (
+                self.node.name))
+
+        options = dict(port=port, username=user, password=password,
+                       known_hosts=None)
+        if self.key_filename:
+            key_file = self.key_filename
+            if not os.path.isabs(key_file):
+                key_file = "%s/.ssh/%s" % (os.environ.get("HOME"),
+                                           key_file)
+            options["client_keys"] = [key_file]
+
+        self.log.debug("ssh connect: host=%s, port=%r, user=%s, key=%s",
+                       host, port, user, options.get("client_keys"))
+
+        end_time = time.time() + self.connect_timeout
+        while True:
+            try:
+                self._conn = await asyncssh.connect(host, **options)
+                return self._conn
+            except (OSError, asyncssh.Error) as error:
+                remaining = max(0, end_time - time.time())
+                if not remaining:
+                    raise errors.RemoteError("%s: ssh connect failed: %s: %s" % (
+                            self.node.name, error.__class__.__name__, error))
+
+                self.log.warning("%s: ssh connection to %s failed: %s: %s, "
+                                 "retry time remaining=%.0fs",
+                                 self.node.name, host,
+                                 error.__class__.__name__, error, remaining)
+                await asyncio.sleep(2.5)
+
+    async def get_sftp(self):
+        if not self._sftp:
+            conn = await self.get_conn()
+            self._sftp = await conn.start_sftp_client()
+
+        return self._sftp
+
+    def run_sftp(self, action):
+        """run 'action(sftp)' coroutine in the event loop and return its result"""
+        async def run():
+            return await action(await self.get_sftp())
+
+        return event_loop.run(run())
+
+    def close(self):
+        async def close():
+            if self._sftp:
+                self._sftp.exit()
+                self._sftp = None
+
+            if self._conn:
+                self._conn.close()
+                await self._conn.wait_closed()
+                self._conn = None
+
+        if self._conn:
+            event_loop.run(close())
+
+    @convert_asyncssh_errors
+    def read_file(self, file_path):
+        async def read(sftp):
+            async with sftp.open(str(file_path), "rb") as f:
+                return await f.read()
+
+        return self.run_sftp(read)
+
+    @convert_asyncssh_errors
+    def write_file(self, file_path, contents, mode=None, owner=None,
+                   group=None):
+        file_path = str(file_path)
+        if not isinstance(contents, bytes):
+            # asyncssh splits text into blocks before encoding it, which
+            # breaks the offsets of multi-byte characters
+            contents = contents.encode("utf-8")
+
+        async def write(sftp):
+            async with sftp.open(file_path, "wb") as f:
+                if mode is not None:
+                    await sftp.chmod(file_path, mode)
+
+                if (owner is not None) or (group is not None):
+                    # set owner and group
+                    attrs = await sftp.stat(file_path)
+                    await sftp.chown(
+                        file_path,
+                        owner if (owner is not None) else attrs.uid,
+                        group if (group is not None) else attrs.gid)
+
+                await f.write(contents)
+
+        self.run_sftp(write)
+
+    @convert_asyncssh_errors
+    def stat(self, file_path):
+        async def stat(sftp):
+            return await sftp.stat(str(file_path))
+
+        return convert_attrs(self.run_sftp(stat))
+
+    @convert_asyncssh_errors
+    def put_file(self, source_path, dest_path, callback=None):
+        def progress(source, dest, copied, total):
+            callback(copied, total)
+
+        async def put(sftp):
+            await sftp.put(str(source_path), str(dest_path),
+                           progress_handler=progress if callback else None)
+
+        self.run_sftp(put)
+
+    @convert_asyncssh_errors
+    def makedirs(self, dir_path):
+        async def makedirs(sftp):
+            await sftp.makedirs(str(dir_path), exist_ok=True)
+
+        self.run_sftp(makedirs)
+
+    @convert_asyncssh_errors
+    def utime(self, file_path, times):
+        async def utime(sftp):
+            await sftp.utime(str(file_path), times)
+
+        self.run_sftp(utime)
+
+    @convert_asyncssh_errors
+    def execute_command(self, cmd, pseudo_tty=False):
+        BS = 2**16
+        output_queue = queue.Queue()
+
+        async def pump(stream, code):
+            while True:
+                chunk = await stream.read(BS)
+                if not chunk:
+                    break
+                output_queue.put((code, chunk))
+
+        async def run():
+            conn = await self.get_conn()
+            process = await conn.create_process(
+                cmd, encoding=None, term_type="vt100" if pseudo_tty else None)
+            try:
+                process.stdin.write_eof()
+                await asyncio.gather(pump(process.stdout, rcontrol.STDOUT),
+                                     pump(process.stderr, rcontrol.STDERR))
+                await process.wait_closed()
+                return process.exit_status
+            finally:
+                process.close()
+
+        future = event_loop.submit(run())
+        future.add_done_callback(lambda future: output_queue.put(None))
+
+        rx_time = time.time()
+        log_name = "%s (%s): %r" % (self.node.name, self.node.get("host"), cmd)
+        next_warn = time.time() + self.warn_timeout
+        try:
+            while True:
+                try:
+                    item = output_queue.get(timeout=1.0)
+                except queue.Empty:
+                    item = False
+
+                if item is None:
+                    # the command has finished and all output has been read
+                    yield rcontrol.DONE, future.result()
+                    break
+                elif item:
+                    rx_time = time.time()
+                    next_warn = time.time() + self.warn_timeout
+                    yield item
+                    continue
+
+                now = time.time()
+                if now > (rx_time + self.terminate_timeout):
+                    # no output in a long time, terminate connection
+                    raise errors.RemoteError(
+                        "%s: no output in %.1f seconds, terminating" % (
+                            log_name, self.terminate_timeout))
+
+                if now > next_warn:
+                    elapsed_since = time.time() - rx_time
+                    self.log.warning("%s: no output in %.1fs", log_name,
+                                     elapsed_since)
+                    next_warn = time.time() + self.warn_timeout
+        finally:
+            future.cancel()
+
+    def execute_shell(self):
+        raise errors.RemoteError(
+            "%s: interactive shell is not supported by the asyncssh remote, "
+            "use the 'ssh' deploy method" % self.node.name)
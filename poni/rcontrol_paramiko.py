@@ -6,9 +6,13 @@ See LICENSE for details.
 
 """
 
+from io import BytesIO
 import os
 import sys
 import socket
+import stat
+import tarfile
+import threading
 import time
 from . import errors
 from . import rcontrol
@@ -27,11 +31,18 @@ try:
 except AttributeError:
     import paramiko
 
+
 try:
     from select import epoll
 except ImportError:
     epoll = None
 
+try:
+    from shlex import quote
+except ImportError:
+    # python 2
+    from pipes import quote
+
 
 def convert_paramiko_errors(method):
     """Convert remote Paramiko errors to errors.RemoteError"""
@@ -83,50 +94,295 @@ def interactive_shell(chan):
         termios.tcsetattr(sys.stdin, termios.TCSADRAIN, oldtty)
 
 
+class SSHPool(object):
+    """
+    Process-wide pool of SSH connections shared by all the remote controls
+
+    Connections are keyed by (host, port, user, key_file, password), so nodes
+    sharing a host address (e.g. containers) open their SFTP sessions and
+    command channels over the same transport instead of doing a handshake of
+    their own. A new connection to the same key is opened only when the
+    existing ones already serve 'max_sessions' remotes and there are less
+    than 'max_connections' of them, otherwise the least busy one is shared.
+    Dead transports are dropped when acquired and unused connections are
+    closed after 'idle_timeout' seconds.
+    """
+    def __init__(self, max_connections=4, max_sessions=4, idle_timeout=60.0):
+        self.max_connections = max_connections
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        # {key: [[ssh, users, last_used], ...]}
+        self.connections = {}
+
+    @staticmethod
+    def is_alive(ssh):
+        transport = ssh.get_transport()
+        return bool(transport and transport.is_active())
+
+    def acquire(self, key, connect):
+        """return a connection for 'key', opening it with connect() if needed"""
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        # connecting may take long, only block others connecting to the same key
+        with key_lock:
+            with self.lock:
+                self.expire()
+                entries = self.connections.setdefault(key, [])
+                for entry in [entry for entry in entries
+                              if not self.is_alive(entry[0])]:
+                    entries.remove(entry)
+                    if not entry[1]:
+                        entry[0].close()
+
+                entry = min(entries, key=lambda entry: entry[1]) \
+                    if entries else None
+                if entry and ((entry[1] < self.max_sessions)
+                              or (len(entries) >= self.max_connections)):
+                    entry[1] += 1
+                    return entry[0]
+
+            ssh = connect()
+            with self.lock:
+                self.connections.setdefault(key, []).append(
+                    [ssh, 1, time.time()])
+
+            return ssh
+
+    def release(self, key, ssh, discard=False):
+        """stop using 'ssh', 'discard' closes it when no-one else is using it"""
+        with self.lock:
+            entries = self.connections.get(key, [])
+            for entry in entries:
+                if entry[0] is ssh:
+                    entry[1] = max(0, entry[1] - 1)
+                    entry[2] = time.time()
+                    if discard:
+                        entries.remove(entry)
+                        if not entry[1]:
+                            ssh.close()
+                    break
+            else:
+                ssh.close()
+
+            self.expire()
+
+    def expire(self):
+        """close idle connections, must be called with the lock held"""
+        now = time.time()
+        for key, entries in list(self.connections.items()):
+            for entry in list(entries):
+                if (not entry[1]) and ((now - entry[2]) > self.idle_timeout):
+                    entries.remove(entry)
+                    entry[0].close()
+
+            if not entries:
+                del self.connections[key]
+
+    def close(self):
+        """close all connections"""
+        with self.lock:
+            for entries in self.connections.values():
+                for entry in entries:
+                    entry[0].close()
+
+            self.connections = {}
+
+
+pool = SSHPool()
+
+
+# SFTP channel flow control: the window must cover the bandwidth-delay
+# product of the link for the pipelined writes to keep it busy
+DEFAULT_WINDOW_SIZE = 16 * 2**20
+DEFAULT_PACKET_SIZE = 2**15
+# local read size for put_file()
+PUT_BLOCK_SIZE = 2**20
+
+
 class ParamikoRemoteControl(rcontrol.SshRemoteControl):
     def __init__(self, node):
         rcontrol.SshRemoteControl.__init__(self, node)
         self._ssh = None
+        self._ssh_key = None
         self._sftp = None
         self.ping_interval = 10
+        self.window_size = int(node.get_tree_property("ssh-window-size",
+                                                      DEFAULT_WINDOW_SIZE))
+        self.packet_size = int(node.get_tree_property("ssh-packet-size",
+                                                      DEFAULT_PACKET_SIZE))
 
     def get_sftp(self):
         if not self._sftp:
-            self._sftp = self.get_ssh(lambda ssh: ssh.open_sftp())
+            self._sftp = self.get_ssh(
+                lambda ssh: paramiko.SFTPClient.from_transport(
+                    ssh.get_transport(), window_size=self.window_size,
+                    max_packet_size=self.packet_size))
         return self._sftp
 
+    def open_write(self, file_path, mode=None, owner=None, group=None):
+        """
+        Open a remote file for pipelined writing
+
+        Writes are sent without waiting for their replies, the replies are
+        checked when the file is closed. The mode and the owner are set on
+        the open handle before any data is written.
+        """
+        sftp = self.get_sftp()
+        f = sftp.file(file_path, mode="wb")
+        try:
+            f.set_pipelined(True)
+            # each write request carries up to one packet of data
+            f.MAX_REQUEST_SIZE = self.packet_size
+            if mode is not None:
+                f.chmod(mode)
+
+            if (owner is not None) or (group is not None):
+                if (owner is None) or (group is None):
+                    # uid and gid can only be set together
+                    file_stat = f.stat()
+                    owner = owner if (owner is not None) else file_stat.st_uid
+                    group = group if (group is not None) else file_stat.st_gid
+
+                f.chown(owner, group)
+        except:
+            f.close()
+            raise
+
+        return f
+
     @convert_paramiko_errors
     def read_file(self, file_path):
         file_path = str(file_path)
         sftp = self.get_sftp()
         return sftp.file(file_path, mode="rb").read()
 
+    def read_files(self, file_paths):
+        """
+        Read multiple files with a single remote 'tar' command
+
+        Files missing from the archive (non-existent, unreadable, or the
+        remote has no usable 'tar') are read one by one to get the exact
+        error for each of them.
+        """
+        file_paths = [str(file_path) for file_path in file_paths]
+        if len(file_paths) <= 1:
+            return rcontrol.RemoteControl.read_files(self, file_paths)
+
+        try:
+            files = self.read_files_tar(file_paths)
+        except errors.RemoteError as error:
+            self.log.debug("%s: bulk read failed: %s: %s", self.node.name,
+                           error.__class__.__name__, error)
+            files = {}
+
+        missing = [file_path for file_path in file_paths
+                   if file_path not in files]
+        if missing:
+            files.update(rcontrol.RemoteControl.read_files(self, missing))
+
+        return files
+
+    def checksum_files(self, file_paths):
+        """
+        Get the digests of multiple files with a single remote 'sha256sum'
+
+        Files without a digest in the output are handled like in read_files().
+        """
+        file_paths = [str(file_path) for file_path in file_paths]
+        try:
+            files = self.checksum_files_sha256sum(file_paths)
+        except errors.RemoteError as error:
+            self.log.debug("%s: remote checksum failed: %s: %s", self.node.name,
+                           error.__class__.__name__, error)
+            files = {}
+
+        missing = [file_path for file_path in file_paths
+                   if file_path not in files]
+        if missing:
+            files.update(rcontrol.RemoteControl.checksum_files(self, missing))
+
+        return files
+
     @convert_paramiko_errors
-    def write_file(self, file_path, contents, mode=None, owner=None,
-                   group=None):
-        file_path = str(file_path)
-        sftp = self.get_sftp()
-        f = sftp.file(file_path, mode="wb")
-        if mode is not None:
-            sftp.chmod(file_path, mode)
+    def checksum_files_sha256sum(self, file_paths):
+        cmd = "sha256sum -- %s 2>/dev/null" % " ".join(
+            quote(file_path) for file_path in file_paths)
+        chunks = []
+        for code, output in self.execute_command(cmd):
+            if code == rcontrol.STDOUT:
+                chunks.append(output)
+
+        files = {}
+        wanted = set(file_paths)
+        for line in b"".join(chunks).decode("utf-8", "replace").splitlines():
+            # "<digest>  <path>", or "<digest> *<path>" in binary mode, lines
+            # with escaped file names start with a backslash and are skipped
+            digest, file_path = line[:64], line[66:]
+            if (len(line) > 66) and (line[64:66] in ("  ", " *")) \
+                    and (file_path in wanted):
+                files[file_path] = (digest, None)
+
+        return files
 
-        if (owner is not None) or (group is not None):
-            # set owner and group
-            file_stat = sftp.stat(file_path)
-            sftp.chown(file_path,
-                       owner if (owner is not None) else file_stat.st_uid,
-                       group if (group is not None) else file_stat.st_gid)
+    @convert_paramiko_errors
+    def read_files_tar(self, file_paths):
+        # tar strips the leading slash from member names
+        names = dict((os.path.normpath(file_path).lstrip("/"), file_path)
+                     for file_path in file_paths)
+        # stderr is combined with stdout, errors must not end up in the archive
+        cmd = "tar -c -h -f - -- %s 2>/dev/null" % " ".join(
+            quote(file_path) for file_path in file_paths)
+        chunks = []
+        for code, output in self.execute_command(cmd):
+            if code == rcontrol.STDOUT:
+                chunks.append(output)
+
+        files = {}
+        try:
+            archive = tarfile.open(fileobj=BytesIO(b"".join(chunks)), mode="r:")
+            for info in archive:
+                file_path = names.get(info.name)
+                if (file_path is None) or not info.isfile():
+                    continue
+
+                attrs = paramiko.SFTPAttributes()
+                attrs.st_size = info.size
+                attrs.st_mtime = info.mtime
+                attrs.st_atime = info.mtime
+                attrs.st_mode = stat.S_IFREG | info.mode
+                attrs.st_uid = info.uid
+                attrs.st_gid = info.gid
+                files[file_path] = (archive.extractfile(info).read(), attrs)
+        except tarfile.TarError as error:
+            raise errors.RemoteError("invalid tar output: %s: %s" % (
+                    error.__class__.__name__, error))
+
+        return files
 
-        f.write(contents)
-        f.close()
+    @convert_paramiko_errors
+    def write_file(self, file_path, contents, mode=None, owner=None,
+                   group=None):
+        f = self.open_write(str(file_path), mode=mode, owner=owner,
+                            group=group)
+        try:
+            f.write(contents)
+        finally:
+            f.close()
 
     def close(self):
+        self.release_ssh()
+
+    def release_ssh(self, discard=False):
+        # the SFTP session is a channel of the released connection
         if self._sftp:
             self._sftp.close()
             self._sftp = None
 
         if self._ssh:
-            self._ssh.close()
+            pool.release(self._ssh_key, self._ssh, discard=discard)
             self._ssh = None
 
     def get_ssh(self, action=None):
@@ -150,17 +406,27 @@ class ParamikoRemoteControl(rcontrol.SshRemoteControl):
         else:
             key_file = None
 
-        self.log.debug("ssh connect: host=%s, port=%r, user=%s, key=%s",
-                       host, port, user, key_file)
-
+        def connect():
+            self.log.debug("ssh connect: host=%s, port=%r, user=%s, key=%s",
+                           host, port, user, key_file)
+            ssh = paramiko.SSHClient()
+            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            ssh.connect(host, port=port, username=user, key_filename=key_file,
+                        password=password)
+            ssh.get_transport().set_keepalive(self.ping_interval)
+            return ssh
+
+        key = (host, port, user, key_file, password)
         end_time = time.time() + self.connect_timeout
         while time.time() < end_time:
             try:
+                if self._ssh and ((self._ssh_key != key)
+                                  or not pool.is_alive(self._ssh)):
+                    self.release_ssh(discard=(self._ssh_key == key))
+
                 if not self._ssh:
-                    ssh = paramiko.SSHClient()
-                    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                    ssh.connect(host, port=port, username=user, key_filename=key_file, password=password)
-                    self._ssh = ssh
+                    self._ssh = pool.acquire(key, connect)
+                    self._ssh_key = key
                 return action(self._ssh) if action else self._ssh
             except (socket.error, paramiko.SSHException) as error:
                 remaining = max(0, end_time - time.time())
@@ -168,7 +434,7 @@ class ParamikoRemoteControl(rcontrol.SshRemoteControl):
                                  "retry time remaining=%.0fs",
                                  self.node.name, host,
                                  error.__class__.__name__, error, remaining)
-                self._ssh = None
+                self.release_ssh(discard=True)
                 time.sleep(2.5)
 
         raise errors.RemoteError("%s: ssh connect failed: %s: %s" % (
@@ -280,8 +546,28 @@ class ParamikoRemoteControl(rcontrol.SshRemoteControl):
     def put_file(self, source_path, dest_path, callback=None):
         source_path = str(source_path)
         dest_path = str(dest_path)
-        sftp = self.get_sftp()
-        sftp.put(source_path, dest_path, callback=callback)
+        with open(source_path, "rb") as source:
+            total = os.fstat(source.fileno()).st_size
+            copied = 0
+            f = self.open_write(dest_path)
+            try:
+                while True:
+                    data = source.read(PUT_BLOCK_SIZE)
+                    if not data:
+                        break
+
+                    f.write(data)
+                    copied += len(data)
+                    if callback:
+                        callback(copied, total)
+            finally:
+                f.close()
+
+        # like SFTPClient.put(): make sure that all of the file got there
+        dest_size = self.get_sftp().stat(dest_path).st_size
+        if dest_size != copied:
+            raise IOError("size mismatch in put: %d != %d" % (dest_size,
+                                                              copied))
 
     @convert_paramiko_errors
     def makedirs(self, dir_path):
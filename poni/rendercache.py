@@ -0,0 +1,135 @@
+"""
+persistent template render cache
+
+Copyright (c) 2010-2012 Mika Eloranta
+See LICENSE for details.
+
+"""
+
+import hashlib
+import io
+import logging
+import os
+import sys
+from . import util
+from . import version
+
+CACHE_VERSION = 1
+
+# total size of the cached renders is trimmed down to this after writing
+DEFAULT_MAX_BYTES = 64 * 2**20
+
+# entries not included in the repository fingerprint
+SKIP_NAMES = set([".cache", ".git"])
+
+if sys.version_info[0] == 2:
+    text_type = unicode  # pylint: disable=E0602
+else:
+    text_type = str
+
+
+class RenderCache(object):
+    """
+    On-disk cache of rendered templates shared between poni invocations
+
+    Templates can look up any node, system or setting in the repository, so
+    each entry is keyed by a fingerprint of the whole repository (the path,
+    mtime and size of every file in it), the library directories in
+    'lib_paths' and the poni version, in addition to the caller-provided
+    key. Any change in them thus invalidates all entries; stale entries are
+    evicted in least-recently-used order by trim().
+    """
+    def __init__(self, cache_dir, root_dir, max_bytes=DEFAULT_MAX_BYTES,
+                 lib_paths=()):
+        self.log = logging.getLogger("rendercache")
+        self.cache_dir = cache_dir
+        self.root_dir = root_dir
+        self.lib_paths = list(lib_paths)
+        self.max_bytes = max_bytes
+        self._fingerprint = None
+        self.written = 0
+
+    def reset(self):
+        """forget the repository fingerprint, it is recalculated when needed"""
+        self._fingerprint = None
+
+    def get_fingerprint(self):
+        if self._fingerprint is None:
+            digest = hashlib.sha256(("%d\0%s\0" % (
+                        CACHE_VERSION, version.__version__)).encode("utf-8"))
+            trees = [("", self.root_dir, SKIP_NAMES)]
+            trees.extend((lib_path, lib_path, ()) for lib_path in self.lib_paths)
+            for name, dir_path, skip_names in trees:
+                digest.update(("%s\0" % name).encode("utf-8"))
+                for rel_path, mtime, size in util.tree_stats(dir_path,
+                                                             skip_names):
+                    digest.update(("%s\0%r\0%d\0" % (
+                                rel_path, mtime, size)).encode("utf-8"))
+
+            self._fingerprint = digest.hexdigest()
+
+        return self._fingerprint
+
+    def get_path(self, key):
+        digest = hashlib.sha256(("%s\0%r" % (self.get_fingerprint(), key)
+                                 ).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest)
+
+    def get(self, key):
+        """return the cached render for 'key' or None"""
+        file_path = self.get_path(key)
+        try:
+            with io.open(file_path, "r", encoding="utf-8", newline="") as f:
+                rendered = f.read()
+
+            os.utime(file_path, None)  # mark as recently used
+        except (IOError, OSError):
+            return None
+
+        return rendered
+
+    def put(self, key, rendered):
+        """store 'rendered' text for 'key', non-text results are not cached"""
+        if not isinstance(rendered, text_type):
+            return
+
+        file_path = self.get_path(key)
+        temp_path = "%s.tmp" % file_path
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+
+            with io.open(temp_path, "w", encoding="utf-8", newline="") as f:
+                f.write(rendered)
+
+            os.rename(temp_path, file_path)
+            self.written += os.path.getsize(file_path)
+        except (IOError, OSError) as error:
+            self.log.debug("render cache %r not written: %s: %s", file_path,
+                           error.__class__.__name__, error)
+
+    def trim(self):
+        """remove least-recently-used entries until within the size limit"""
+        if not self.written:
+            return
+
+        self.written = 0
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                file_path = os.path.join(self.cache_dir, name)
+                file_stat = os.stat(file_path)
+                entries.append((file_stat.st_mtime, file_stat.st_size,
+                                file_path))
+
+            entries.sort()
+            total = sum(size for mtime, size, file_path in entries)
+            for mtime, size, file_path in entries:
+                if total <= self.max_bytes:
+                    break
+
+                os.unlink(file_path)
+                total -= size
+        except (IOError, OSError) as error:
+            self.log.debug("render cache %r not trimmed: %s: %s",
+                           self.cache_dir, error.__class__.__name__, error)
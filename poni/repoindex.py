@@ -0,0 +1,125 @@
+"""
+persistent repository tree index
+
+Copyright (c) 2010-2012 Mika Eloranta
+See LICENSE for details.
+
+"""
+
+import copy
+import logging
+import os
+import time
+from . import util
+from .util import json
+
+INDEX_VERSION = 1
+
+# entries modified less than MIN_AGE seconds before they were read are not
+# stored: another modification within the same mtime tick would go unnoticed
+MIN_AGE = 2.0
+
+
+class RepoIndex(object):
+    """
+    Persistent cache of the repository directory tree
+
+    Directory listings and parsed JSON property files are stored in an index
+    file along with the mtime they had when they were read. An entry is
+    re-read from disk only if its mtime (or size) no longer matches, so an
+    unchanged repository can be walked with a single stat() per directory
+    and property file.
+    """
+    def __init__(self, root_dir, file_path):
+        self.log = logging.getLogger("index")
+        self.root_dir = root_dir
+        self.file_path = file_path
+        self.dirs = {}
+        self.files = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        """load the index file, a missing or invalid index is started from scratch"""
+        data = util.json_load_or_default(self.file_path, {},
+                                         version=INDEX_VERSION, log=self.log)
+        if ("dirs" in data) and ("files" in data):
+            self.dirs, self.files = data["dirs"], data["files"]
+        else:
+            self.log.debug("full rescan: no valid index %r", self.file_path)
+            self.dirs, self.files = {}, {}
+
+        self.dirty = False
+
+    def save(self):
+        """write the index file if any entries have been updated"""
+        if not self.dirty:
+            return
+
+        data = dict(version=INDEX_VERSION, dirs=self.dirs, files=self.files)
+        try:
+            util.json_dump_atomic(data, self.file_path)
+        except (IOError, OSError) as error:
+            # the index is only a cache, a read-only repository works without
+            self.log.debug("index %r not saved: %s: %s", self.file_path,
+                           error.__class__.__name__, error)
+            return
+
+        self.dirty = False
+
+    def _store(self, entries, key, file_stat, entry):
+        if (time.time() - file_stat.st_mtime) >= MIN_AGE:
+            entries[key] = entry
+            self.dirty = True
+        elif entries.pop(key, None) is not None:
+            self.dirty = True
+
+    def listdir(self, dir_path):
+        """
+        Return (sub_dirs, files) name lists of 'dir_path', both sorted
+
+        Raises OSError if 'dir_path' does not exist.
+        """
+        dir_stat = os.stat(dir_path)
+        key = os.path.relpath(dir_path, self.root_dir)
+        entry = self.dirs.get(key)
+        if entry and (entry["mtime"] == dir_stat.st_mtime):
+            return entry["dirs"], entry["files"]
+
+        sub_dirs = []
+        files = []
+        for name in os.listdir(dir_path):
+            if os.path.isdir(os.path.join(dir_path, name)):
+                sub_dirs.append(name)
+            else:
+                files.append(name)
+
+        sub_dirs.sort()
+        files.sort()
+        self._store(self.dirs, key, dir_stat,
+                    dict(mtime=dir_stat.st_mtime, dirs=sub_dirs, files=files))
+        return sub_dirs, files
+
+    def load_json(self, file_path):
+        """
+        Return the parsed contents of the JSON file 'file_path'
+
+        Raises IOError/OSError if the file cannot be read and ValueError if
+        it is not valid JSON.
+        """
+        file_stat = os.stat(file_path)
+        key = os.path.relpath(file_path, self.root_dir)
+        entry = self.files.get(key)
+        if (entry and (entry["mtime"] == file_stat.st_mtime)
+            and (entry["size"] == file_stat.st_size)):
+            data = entry["data"]
+        else:
+            with open(file_path) as json_file:
+                data = json.load(json_file)
+
+            self._store(self.files, key, file_stat,
+                        dict(mtime=file_stat.st_mtime, size=file_stat.st_size,
+                             data=data))
+
+        # callers are free to modify the returned properties
+        return copy.deepcopy(data)
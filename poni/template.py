@@ -9,6 +9,7 @@ See LICENSE for details.
 
 from . import errors
 from io import StringIO
+import os
 import re
 import sys
 
@@ -70,6 +71,34 @@ except ImportError:
 
 _name_re = re.compile(r"(\\?\$(?:\{.+?\}|[._a-zA-Z0-9]+))")
 
+# compiled templates are reused for every node rendering the same source,
+# the cache is simply emptied when it reaches the maximum size
+MAX_COMPILED_TEMPLATES = 1000
+_compiled_templates = {}
+
+# optional directory for storing compiled Mako template modules on disk
+mako_module_dir = None
+
+
+def get_compiled(engine, source_text, source_path, compiler):
+    """return a compiled template from cache or compile it with compiler()"""
+    if source_text is not None:
+        key = (engine, None, source_text)
+    else:
+        # template file changes are noticed via mtime and size
+        source_stat = os.stat(source_path)
+        key = (engine, source_path, source_stat.st_mtime, source_stat.st_size)
+
+    compiled = _compiled_templates.get(key)
+    if compiled is None:
+        if len(_compiled_templates) >= MAX_COMPILED_TEMPLATES:
+            _compiled_templates.clear()
+
+        compiled = compiler()
+        _compiled_templates[key] = compiled
+
+    return compiled
+
 
 def render_name(source_text, source_path, variables):
     """simplified filename rendering with dollar-variable substitution only"""
@@ -102,7 +131,10 @@ def render_name(source_text, source_path, variables):
 def render_cheetah(source_text, source_path, variables):
     assert CheetahTemplate, "Cheetah is not installed"
     try:
-        return str(CheetahTemplate(source=source_text, file=source_path, searchList=[variables]))
+        template_class = get_compiled(
+            "cheetah", source_text, source_path,
+            lambda: CheetahTemplate.compile(source=source_text, file=source_path))
+        return str(template_class(searchList=[variables]))
     except (Cheetah.Template.Error, SyntaxError, Cheetah.NameMapper.NotFound) as error:
         raise errors.TemplateError("{0}: {1}: {2}".format(source_path, error.__class__.__name__, error))
 
@@ -110,22 +142,31 @@ def render_cheetah(source_text, source_path, variables):
 def render_mako(source_text, source_path, variables):
     assert MakoTemplate, "Mako is not installed"
     try:
-        return MakoTemplate(text=source_text, filename=source_path).render(**variables)
+        # compiled modules of inline templates have no file name to store them by
+        module_dir = mako_module_dir if source_path else None
+        tmpl = get_compiled(
+            "mako", source_text, source_path,
+            lambda: MakoTemplate(text=source_text, filename=source_path,
+                                 module_directory=module_dir))
+        return tmpl.render(**variables)
     except MakoException as error:
         raise errors.TemplateError("{0}: {1}: {2}".format(source_path, error.__class__.__name__, error))
 
 
 def render_genshi(source_text, source_path, variables):
     assert genshi, "Genshi is not installed"
-    if source_path:
-        source = open(source_path)
-    else:
-        source = StringIO(source_text)
+    def compile_genshi():
+        if source_path:
+            with open(source_path) as source:
+                return genshi.template.MarkupTemplate(source, filepath=source_path)
+        else:
+            return genshi.template.MarkupTemplate(StringIO(source_text))
+
     try:
-        tmpl = genshi.template.MarkupTemplate(source, filepath=source_path)
+        tmpl = get_compiled("genshi", source_text, source_path, compile_genshi)
         stream = tmpl.generate(**variables)
         return stream.render('xml')
-    except (genshi.template.TemplateError, IOError) as error:
+    except (genshi.template.TemplateError, IOError, OSError) as error:
         raise errors.TemplateError("{0}: {1}: {2}".format(source_path, error.__class__.__name__, error))
 
 
@@ -27,6 +27,15 @@ class Times(object):
         self.entry.append(dict(task_id=task_id, name=name, start=start,
                                stop=stop, args=args))
 
+    def get_durations(self):
+        """return {(name, args): duration} of the latest run of each task"""
+        durations = {}
+        for prop in sorted(self.entry, key=lambda prop: prop["start"]):
+            key = (prop["name"], tuple(prop.get("args") or []))
+            durations[key] = prop["stop"] - prop["start"]
+
+        return durations
+
     def positions(self, prop, start, stop):
         span = stop - start
         if not span:
@@ -9,15 +9,19 @@ from __future__ import print_function
 from . import cloud
 from . import colors
 from . import config
+from . import controlcatalog
 from . import core
 from . import errors
 from . import importer
+from . import journal
 from . import listout
 from . import rcontrol_all
+from . import rendercache
 from . import template
 from . import times
 from . import util
 from . import vc
+from . import verifystate
 from . import version
 from . import work
 from distutils.version import LooseVersion  # pylint: disable=E0611
@@ -77,20 +81,36 @@ def arg_target_nodes(method):
     return arg_exclude_nodes(b(method))
 
 arg_host_access_method = argh.arg("-m", "--method",
-                                  help="override host access method (local, ssh, tar:DIR)")
+                                  help="override host access method (local, "
+                                  "ssh, tar:DIR, tar.gz:DIR, tar.zst:DIR)")
 arg_output_dir = argh.arg("-o", "--output-dir", metavar="DIR",
                           help="write command output to files in DIR")
 arg_config_pattern = argh.arg("-c", "--config", metavar="PATTERN", type=str, nargs="*",
                               help='apply to only configs matching pattern')
 arg_tag = argh.arg("-t", "--tag", metavar="TAG", type=str,
                    help='apply to only files that are labeled with the specified tag')
+arg_checksum = arg_flag("--checksum",
+                        help="compare checksums of remote files instead of "
+                        "downloading them")
+arg_delta = arg_flag("--delta",
+                     help="send only the changed blocks of files that exist "
+                     "remotely (requires Python on the host)")
+arg_render_processes = argh.arg(
+    "-P", "--render-processes", metavar="N", type=int,
+    help="render templates in N processes (default: 1)")
+arg_jobs = argh.arg("-j", "--jobs", metavar="N", type=int,
+                    help="max nodes processed concurrently (default: 1)")
+arg_stream = arg_flag("--stream", help="with --jobs: show output lines as "
+                      "they arrive, prefixed with the node name")
 
 
 class ControlTask(work.Task):
     def __init__(self, op, args, verbose=False, method=None, quiet=False,
-                 output_dir=None, color="auto"):
+                 output_dir=None, color="auto", cost=1.0, journal=None):
         work.Task.__init__(self)
         self.op = op
+        self.cost = cost
+        self.journal = journal
         self.args = args
         self.verbose = verbose
         self.method = method
@@ -106,20 +126,54 @@ class ControlTask(work.Task):
         # TODO: label each output line
         self.log.info("%s: %s", self, msg)
 
-    def can_start(self):
-        """return True when it is ok to start this task"""
-        host = self.op["node"].get("host")
-        for running_task in self.runner.started:
-            if running_task.op["node"].get("host") == host:
-                # another task is already running on the same host
-                return False
+    @staticmethod
+    def get_op_key(op):
+        return (op["node"].name, op["config"].name, op["name"])
 
-        for dep_op in self.op.get("depends", []):
-            if not "result" in dep_op:
-                # dependency task has not finished yet
-                return False
+    def get_key(self):
+        return self.get_op_key(self.op)
+
+    def get_dependencies(self):
+        return [self.get_op_key(dep_op) for dep_op in self.op.get("depends", [])]
 
-        return True
+    def get_resources(self):
+        """
+        the host of the node, by default only one task at a time may run on
+        it, plus the named pools listed in the 'control_pools' property
+        """
+        node = self.op["node"]
+        resources = [(("host", node.get("host")),
+                      self.get_limit("control_concurrency",
+                                     node.get_tree_property(
+                                         "control_concurrency", 1)))]
+        pools = node.get_tree_property("control_pools", None) or {}
+        if not isinstance(pools, dict):
+            raise errors.InvalidProperty(
+                "%s: 'control_pools' must be a dict of {name: limit}, got %r"
+                % (node.name, pools))
+
+        resources.extend(
+            (("pool", name),
+             self.get_limit("control_pools.%s" % name, limit))
+            for name, limit in sorted(pools.items()))
+        return resources
+
+    def get_limit(self, prop_name, value):
+        """convert a concurrency limit property value to a positive int"""
+        try:
+            limit = int(value)
+        except (TypeError, ValueError):
+            limit = 0
+
+        if (limit < 1) or isinstance(value, bool):
+            raise errors.InvalidProperty(
+                "%s: %r must be a positive integer, got %r" % (
+                    self.op["node"].name, prop_name, value))
+
+        return limit
+
+    def get_cost(self):
+        return self.cost
 
     def check_dependencies(self):
         for dep_op in self.op.get("depends", []):
@@ -135,6 +189,9 @@ class ControlTask(work.Task):
     def execute(self):
         try:
             self.op["start_time"] = time.time()
+            if self.journal:
+                self.journal.task_started(self.get_key())
+
             self.check_dependencies()
             handler_func = self.op["callback"]
             ret = handler_func(self.op["name"], self.args,
@@ -163,6 +220,9 @@ class ControlTask(work.Task):
             raise
         finally:
             self.op["stop_time"] = time.time()
+            if self.journal:
+                self.journal.task_finished(self.get_key(),
+                                           self.op.get("result"))
 
 
 class Tool(object):
@@ -176,6 +236,8 @@ class Tool(object):
         self.cached_confman = None
         self.cached_manager = None
         self.collect_cache = {}
+        self.collected_nodes = {}
+        self.use_render_cache = True
 
     def reset_cache(self):
         if self.cached_confman:
@@ -183,6 +245,7 @@ class Tool(object):
 
         self.cached_manager = None
         self.collect_cache = {}
+        self.collected_nodes = {}
 
     @argh_named("add-system")
     @argh.arg('system', type=str, help='system name')
@@ -490,19 +553,72 @@ class Tool(object):
     @arg_flag("-t", "--clock-tasks", dest="show_times",
               help="show timeline of execution for each tasks")
     @argh.arg("-j", "--jobs", metavar="N", type=int,
-              help="max concurrent tasks (default: unlimited)")
-    @argh.arg('pattern', type=str, help='config search pattern')
+              help="max concurrent tasks (default: %d)" % (
+            work.DEFAULT_MAX_WORKERS))
+    @argh.arg("--stack-size", metavar="KB", type=int,
+              help="stack size of the task worker threads")
+    @argh.arg("--resume", metavar="RUN_ID",
+              help="re-run the tasks of an earlier run that did not finish "
+              "successfully")
+    @argh.arg('pattern', type=str, nargs="?", help='config search pattern')
     @arg_host_access_method
-    @argh.arg('operation', type=str, help='operation to execute')
+    @argh.arg('operation', type=str, nargs="?", help='operation to execute')
     @expects_obj
     def handle_control(self, arg):
         """config control operation"""
         confman = self.get_confman(arg.root_dir, reset_cache=False)
+        run_args = ["pattern", "operation", "extras", "full_match", "no_deps"]
+        finished = {}
+        if arg.resume:
+            # repeat the selection of the original run from the journal
+            run_id = arg.resume
+            control_journal = journal.ControlJournal(confman.get_cache_path(
+                    os.path.join(core.CONTROL_JOURNAL_DIR, run_id)))
+            args, finished = control_journal.load()
+            for name in run_args:
+                setattr(arg, name, args[name])
+        elif not (arg.pattern and arg.operation):
+            raise errors.UserError("config pattern and operation are required")
+        else:
+            run_id = journal.new_run_id()
+            control_journal = journal.ControlJournal(confman.get_cache_path(
+                    os.path.join(core.CONTROL_JOURNAL_DIR, run_id)))
+            control_journal.run_started(dict((name, getattr(arg, name))
+                                             for name in run_args))
+
+        try:
+            self.run_control(confman, arg, run_id, control_journal, finished)
+        finally:
+            control_journal.close()
+
+    def run_control(self, confman, arg, run_id, control_journal, finished):
+        """run the control tasks, skipping those in 'finished' without errors"""
         manager = self.get_manager(confman)
-        self.collect_all(manager)
+        all_configs = list(confman.find_config(".", all_configs=True))
+        comparison = core.ConfigMatch(arg.pattern, full_match=arg.full_match)
+
+        # with an up-to-date catalogue of all the control operations only the
+        # nodes having the targeted operations or their dependencies are
+        # collected, otherwise the catalogue is rebuilt from all the plugins
+        catalog = controlcatalog.ControlCatalog(
+            confman.get_cache_path(core.CONTROL_CATALOG_FILE),
+            lib_paths=confman.get_library_paths())
+        catalog_key = catalog.get_key(all_configs)
+        catalog_ops = catalog.load(catalog_key) if catalog_key else None
+        if catalog_ops is None:
+            self.collect_all(manager)
+        else:
+            needed = controlcatalog.select_configs(
+                catalog_ops,
+                lambda op: ((op["name"] == arg.operation)
+                            and comparison.match_node(op["node"])
+                            and comparison.match_config(op["config"])))
+            all_configs = [(conf_node, conf) for conf_node, conf in all_configs
+                           if (conf_node.name, conf.name) in needed]
+            self.collect_nodes(manager, [conf_node for conf_node, conf
+                                         in all_configs])
 
         # collect all possible control operations
-        all_configs = list(confman.find_config(".", all_configs=True))
         all_ops = []
         provider = {}
         for conf_node, conf in all_configs:
@@ -524,6 +640,9 @@ class Tool(object):
                     ops = provider.setdefault(feature, [])
                     ops.append(op)
 
+        if (catalog_ops is None) and catalog_key:
+            catalog.save(catalog_key, all_ops)
+
         handled = set()
 
         def add_all_required_ops(op):
@@ -559,7 +678,6 @@ class Tool(object):
 
         # select user-specified ops and their dependencies from the full list
         tasks = {}
-        comparison = core.ConfigMatch(arg.pattern, full_match=arg.full_match)
         for op in all_ops:
             node = op["node"]
             conf = op["config"]
@@ -587,11 +705,32 @@ class Tool(object):
                     if not dep_op.get("run"):
                         depends.remove(dep_op)
 
+        # task durations from previous runs in the time log (-L) are used for
+        # prioritizing the longest chains, unknown ones get the median duration
+        durations = self.task_times.get_durations()
+        costs = {}
+        for op_id, op in tasks.items():
+            key = ("%s/%s" % (op["node"].name, op["config"].name),
+                   (op["name"],))
+            if key in durations:
+                costs[op_id] = durations[key]
+
+        known = sorted(costs.values())
+        default_cost = known[len(known) // 2] if known else 1.0
+
         # assign tasks
-        runner = work.Runner(max_jobs=arg.jobs)
+        runner = work.Runner(max_jobs=arg.jobs,
+                             stack_size=arg.stack_size and arg.stack_size * 1024)
         logger = self.log.info if arg.verbose else self.log.debug
+        done_count = 0
         for op_id, op in tasks.items():
             run = op.get("run") or (not arg.no_deps)
+            if run and (op_id in finished) and not finished[op_id]:
+                # succeeded in the resumed run
+                op["result"] = None
+                done_count += 1
+                run = False
+
             op["run"] = run
             if not run:
                 continue
@@ -601,10 +740,17 @@ class Tool(object):
                    op["config"].name, op["name"])
             task = ControlTask(op, arg.extras, verbose=arg.verbose,
                                quiet=arg.quiet, output_dir=arg.output_dir,
-                               method=arg.method, color=arg.color)
+                               method=arg.method, color=arg.color,
+                               cost=costs.get(op_id, default_cost),
+                               journal=control_journal)
             runner.add_task(task)
 
+        if done_count:
+            self.log.info("%d tasks already finished successfully in run %s",
+                          done_count, run_id)
+
         # execute tasks
+        self.log.info("control run: %s", run_id)
         runner.run_all()
 
         # collect results
@@ -619,7 +765,8 @@ class Tool(object):
             task_name = "%s/%s" % (task.op["node"].name,
                                    task.op["config"].name)
             self.task_times.add_task(i, task_name, task.op["start_time"],
-                                     task.op["stop_time"])
+                                     task.op["stop_time"],
+                                     args=[task.op["name"]])
 
         if arg.verbose:
             for task in runner.stopped:
@@ -633,8 +780,9 @@ class Tool(object):
         self.log.debug("all tasks finished: %r", results)
         if failed:
             raise errors.ControlError(
-                "[%d/%d] control tasks failed (%d skipped)" % (
-                    len(failed), ran_count, skipped_count))
+                "[%d/%d] control tasks failed (%d skipped), "
+                "re-run the unfinished tasks with: --resume %s" % (
+                    len(failed), ran_count, skipped_count, run_id))
         else:
             self.log.info(
                 "all [%d] control tasks finished successfully (%d skipped)",
@@ -644,6 +792,8 @@ class Tool(object):
     @arg_verbose
     @arg_quiet
     @arg_output_dir
+    @arg_jobs
+    @arg_stream
     @arg_full_match
     @arg_target_nodes
     @arg_host_access_method
@@ -654,15 +804,26 @@ class Tool(object):
         confman = self.get_confman(arg.root_dir, reset_cache=False)
         def rexec(arg, node, remote):
             color = colors.Output(sys.stdout, color=arg.color).color
+            verbose = arg.verbose
             if arg.output_dir:
                 output_file_path = os.path.join(arg.output_dir, "%s.log" % node.name.replace("/", "_"))
                 output_file = open(output_file_path, "w")
+            elif (not arg.quiet) and ((arg.jobs or 1) > 1):
+                # keep the output of concurrently running nodes apart, the
+                # BEGIN/END lines are written to the node output
+                output_file = util.NodeOutput(
+                    sys.stdout, prefix="[%s] " % node.name if arg.stream else None)
+                verbose = False
             else:
                 output_file = None
 
-            return remote.execute(arg.cmd, verbose=arg.verbose, color=color,
-                                  quiet=arg.quiet,
-                                  output_file=output_file)
+            try:
+                return remote.execute(arg.cmd, verbose=verbose, color=color,
+                                      quiet=arg.quiet,
+                                      output_file=output_file)
+            finally:
+                if output_file:
+                    output_file.close()
 
         rexec.doc = "exec: %r" % arg.cmd
         result = self.remote_op(confman, arg, rexec, exclude=arg.exclude)
@@ -672,10 +833,12 @@ class Tool(object):
 
     @argh_named("cp")
     @arg_verbose
+    @arg_jobs
     @arg_full_match
     @arg_host_access_method
     @arg_flag("-d", "--create-dest-dir", help="create missing remote target directories")
     @arg_flag("-r", "--recursive", help="copy directories recursively")
+    @arg_delta
     @argh.arg('source', type=str, nargs="+", help='source file/dir to copy')
     @arg_target_nodes
     @argh.arg('dest_dir', type=str, help='destination remote directory')
@@ -717,14 +880,17 @@ class Tool(object):
                 source_paths = [source_path]
             for file_path in source_paths:
                 dest_path = os.path.join(dest_dir, os.path.basename(file_path))
-                lstat = os.lstat(file_path.stat)
+                lstat = os.lstat(file_path)
                 if stat.S_ISDIR(lstat.st_mode):
                     copy_file_or_dir(node, remote, os.path.join(source_path, os.path.basename(file_path)), dest_path)
                     continue
 
                 if arg.verbose:
                     self.log.info("copying: %s -> %s:%s [%s]", pp(file_path), node.addr(), pp(dest_dir), node.name)
-                remote.put_file(file_path, dest_path)
+                if arg.delta:
+                    remote.put_file_delta(file_path, dest_path)
+                else:
+                    remote.put_file(file_path, dest_path)
                 remote.utime(dest_path, (int(lstat.st_mtime),
                                          int(lstat.st_mtime)))
 
@@ -753,27 +919,48 @@ class Tool(object):
         self.remote_op(confman, arg, rshell)
 
     def remote_op(self, confman, arg, op, exclude=None):
-        ret = 0
+        """
+        Run 'op' for each matching node, up to 'arg.jobs' nodes at a time.
+
+        Returns the first non-zero exit code in node order, -1 for failures.
+        """
         nodes = list(confman.find(arg.nodes, full_match=arg.full_match,
                                   exclude=exclude))
         if not nodes:
             raise errors.UserError("%r does not match any nodes" % (arg.nodes))
 
-        for node in nodes:
-            if node.get_tree_property("template"):
-                # don't try to run anything on template nodes
-                continue
+        # don't try to run anything on template nodes
+        nodes = [node for node in nodes
+                 if not node.get_tree_property("template")]
+        exit_codes = {}
 
+        def run_op(node):
             remote = node.get_remote(override=arg.method)
 
             try:
                 # TODO: pass color arg
-                exit_code = op(arg, node, remote)
-                if (not ret) and exit_code:
-                    ret = exit_code
+                exit_codes[node.name] = op(arg, node, remote)
             except errors.RemoteError as error:
                 self.log.error("failed: %s", error)
-                ret = -1
+                exit_codes[node.name] = -1
+
+        jobs = getattr(arg, "jobs", None)
+        if (not jobs) or (jobs <= 1) or (len(nodes) <= 1):
+            for node in nodes:
+                run_op(node)
+        else:
+            tasks = util.TaskPool(min(jobs, len(nodes)))
+            for node in nodes:
+                tasks.apply_async(run_op, [node])
+
+            tasks.wait_all()
+
+        ret = 0
+        for node in nodes:
+            # unexpected errors are already logged by the task pool
+            exit_code = exit_codes.get(node.name, -1)
+            if (not ret) and exit_code:
+                ret = exit_code
 
         return ret
 
@@ -1092,28 +1279,56 @@ class Tool(object):
         if items:
             return items
 
-        items = []
-        for item in manager.confman.find("."):
-            item.collect(manager)
-            items.append(item)
+        items = list(manager.confman.find("."))
+        self.collect_nodes(manager, items)
+        manager.node_collector = None
+        manager.collect_remaining = None
+        self.collect_cache[manager] = items
+
+        return items
+
+    def collect_nodes(self, manager, nodes):
+        """
+        collect the given nodes unless already collected, returns the newly
+        collected nodes
+        """
+        collected = self.collected_nodes.setdefault(manager, set())
+        new_nodes = []
+        for node in nodes:
+            if node.name not in collected:
+                collected.add(node.name)
+                new_nodes.append(node)
+
+        for node in new_nodes:
+            node.collect(manager)
 
         # parents need to be collected _after_ all nodes have been collected,
         # so that every parent node is loaded and available with full props
-        for item in items:
-            item.collect_parents(manager)
+        for node in new_nodes:
+            node.collect_parents(manager)
 
-        self.collect_cache[manager] = items
+        return new_nodes
 
-        return items
+    def collect_found(self, manager, found):
+        """collect the nodes returned by a template lookup on demand"""
+        if not isinstance(found, list):
+            found = [found]
+
+        nodes = []
+        for item in found:
+            if isinstance(item, tuple):
+                # (node, config) pair
+                item = item[0]
+
+            if isinstance(item, core.Node):
+                nodes.append(item)
+
+        if nodes:
+            self.collect_nodes(manager, nodes)
 
     def verify_op(self, confman, target, full_match=False, exclude=None,
-                  **verify_options):
+                  lazy=True, **verify_options):
         manager = self.get_manager(confman)
-        self.collect_all(manager)
-        self.log.debug("verify_op %r: confman cache=%r, manager files=%r, buckets=%r",
-                       target, confman.dump_stats(), len(manager.files),
-                       dict((k, len(v)) for k, v in manager.buckets.items()))
-
         if target:
             if exclude:
                 exclude = re.compile(exclude).search
@@ -1131,6 +1346,21 @@ class Tool(object):
         else:
             target_filter = lambda item: True
 
+        if target and lazy and (manager not in self.collect_cache):
+            # collect only the target nodes, the rest are collected when
+            # a template looks them up or accesses a bucket
+            self.collect_nodes(manager, [node for node in confman.find(".")
+                                         if search_op(node.name)])
+            manager.node_collector = (
+                lambda found: self.collect_found(manager, found))
+            manager.collect_remaining = lambda: self.collect_all(manager)
+        else:
+            self.collect_all(manager)
+
+        self.log.debug("verify_op %r: confman cache=%r, manager files=%r, buckets=%r",
+                       target, confman.dump_stats(), len(manager.files),
+                       dict((k, len(v)) for k, v in manager.buckets.items()))
+
         stats = manager.verify(callback=target_filter, **verify_options)
         return manager, stats
 
@@ -1145,6 +1375,7 @@ class Tool(object):
               help="show raw template vs. rendered output diff")
     @arg_config_pattern
     @arg_tag
+    @arg_render_processes
     @expects_obj
     def handle_show(self, arg):
         """render and show node config files"""
@@ -1152,9 +1383,10 @@ class Tool(object):
         manager, stats = self.verify_op(
             confman, arg.nodes, show=(not arg.show_buckets),
             full_match=arg.full_match, raw=arg.show_raw,
+            lazy=(not arg.show_buckets),
             color=arg.color, show_diff=arg.show_diff,
             exclude=arg.exclude, config_patterns=arg.config,
-            tag=arg.tag)
+            tag=arg.tag, render_processes=arg.render_processes)
 
         if arg.show_buckets:
             for name, items in manager.buckets.items():
@@ -1179,6 +1411,10 @@ class Tool(object):
     @arg_host_access_method
     @arg_config_pattern
     @arg_tag
+    @arg_jobs
+    @arg_checksum
+    @arg_delta
+    @arg_render_processes
     @expects_obj
     def handle_deploy(self, arg):
         """deploy node configs"""
@@ -1187,7 +1423,9 @@ class Tool(object):
             confman, arg.nodes, show=False, deploy=True, verbose=arg.verbose,
             full_match=arg.full_match, path_prefix=arg.path_prefix,
             access_method=arg.method, color=arg.color,
-            exclude=arg.exclude, config_patterns=arg.config, tag=arg.tag)
+            exclude=arg.exclude, config_patterns=arg.config, tag=arg.tag,
+            jobs=arg.jobs, checksum=arg.checksum, delta=arg.delta,
+            render_processes=arg.render_processes)
         if stats.error_count:
             raise errors.VerifyError("failed: files with errors: [%d/%d]" % (
                     stats.error_count, stats.file_count))
@@ -1205,6 +1443,9 @@ class Tool(object):
     @arg_flag("-d", "--diff", dest="show_diff", help="show config diffs")
     @arg_config_pattern
     @arg_tag
+    @arg_jobs
+    @arg_checksum
+    @arg_render_processes
     @expects_obj
     def handle_audit(self, arg):
         """audit active node configs"""
@@ -1214,7 +1455,9 @@ class Tool(object):
             show_diff=arg.show_diff, full_match=arg.full_match,
             path_prefix=arg.path_prefix, access_method=arg.method,
             color=arg.color, verbose=arg.verbose,
-            exclude=arg.exclude, config_patterns=arg.config, tag=arg.tag)
+            exclude=arg.exclude, config_patterns=arg.config, tag=arg.tag,
+            jobs=arg.jobs, checksum=arg.checksum,
+            render_processes=arg.render_processes)
 
         if stats.error_count:
             raise errors.VerifyError("failed: files with errors: [%d/%d]" % (
@@ -1231,15 +1474,27 @@ class Tool(object):
     @arg_config_pattern
     @arg_tag
     @arg_target_nodes_0_to_n
+    @arg_jobs
+    @arg_render_processes
+    @argh.arg("--changed-since", metavar="REV", type=str,
+              help="verify only files affected by changes made after "
+              "version control revision REV")
     @expects_obj
     def handle_verify(self, arg):
         """verify local node configs"""
         confman = self.get_confman(arg.root_dir, reset_cache=False)
+        changed_paths = None
+        if arg.changed_since:
+            self.require_vc(confman)
+            changed_paths = confman.vc.get_changed_files(arg.changed_since)
+
         manager, stats = self.verify_op(
             confman, arg.nodes, show=False, full_match=arg.full_match,
             access_method=arg.method, verbose=arg.verbose,
             color=arg.color, exclude=arg.exclude, config_patterns=arg.config,
-            tag=arg.tag)
+            tag=arg.tag, jobs=arg.jobs,
+            render_processes=arg.render_processes,
+            changed_paths=changed_paths)
 
         if stats.error_count:
             raise errors.VerifyError("failed: files with errors: [%d/%d]" % (
@@ -1350,6 +1605,20 @@ class Tool(object):
         else:
             self.cached_manager = config.Manager(confman)
 
+        if not self.use_render_cache:
+            self.cached_manager.render_cache = None
+            template.mako_module_dir = None
+        elif not self.cached_manager.render_cache:
+            self.cached_manager.render_cache = rendercache.RenderCache(
+                confman.get_cache_path(core.RENDER_CACHE_DIR), confman.root_dir,
+                lib_paths=confman.get_library_paths())
+            template.mako_module_dir = confman.get_cache_path(
+                core.TEMPLATE_MODULE_DIR)
+
+        if not self.cached_manager.verify_state:
+            self.cached_manager.verify_state = verifystate.VerifyState(
+                confman.get_cache_path(core.VERIFY_STATE_FILE))
+
         return self.cached_manager
 
     @argh_named("list")
@@ -1452,6 +1721,10 @@ class Tool(object):
         parser.add_argument(
             "-c", "--color", default="auto",
             choices=["on", "off", "auto"], help="use color highlighting")
+        parser.add_argument("--no-render-cache", dest="no_render_cache",
+                            default=False, action="store_true",
+                            help="always render templates, do not use or "
+                            "update the on-disk render cache")
 
         commands = [
             self.handle_list, self.handle_add_system, self.handle_init,
@@ -1532,6 +1805,8 @@ class Tool(object):
             if arg.time_log and os.path.exists(arg.time_log):
                 self.task_times.load(arg.time_log)
 
+            self.use_render_cache = not arg.no_render_cache
+
             if arg.debug:
                 logging.getLogger().setLevel(logging.DEBUG)
             else:
@@ -6,8 +6,10 @@ See LICENSE for details.
 
 """
 
+import hashlib
 import logging
 import os
+import threading
 from multiprocessing.pool import ThreadPool
 from . import errors
 from . import recode
@@ -80,6 +82,47 @@ def json_dump(data, file_path):
     os.rename(temp_path, file_path)
 
 
+def json_dump_atomic(data, file_path):
+    """
+    Write 'data' compactly to 'file_path' via a synced temp file, so that
+    readers see either the old or the new contents, never a partial file
+
+    Creates the parent directory if needed, raises IOError/OSError.
+    """
+    dir_path = os.path.dirname(file_path)
+    if dir_path and not os.path.isdir(dir_path):
+        os.makedirs(dir_path)
+
+    temp_path = "%s.tmp" % file_path
+    with open(temp_path, "w") as out:
+        json.dump(data, out, separators=(",", ":"))
+        out.flush()
+        os.fsync(out.fileno())
+
+    os.rename(temp_path, file_path)
+
+
+def json_load_or_default(file_path, default, version=None, log=None):
+    """
+    Return the parsed contents of the JSON file 'file_path' or 'default' if
+    it cannot be read, is not valid or its "version" does not match 'version'
+    """
+    try:
+        with open(file_path) as json_file:
+            data = json.load(json_file)
+
+        if (version is not None) and (data.get("version") != version):
+            raise ValueError("version %r != %r" % (data.get("version"),
+                                                   version))
+    except (IOError, OSError, ValueError, AttributeError) as error:
+        if log:
+            log.debug("%r not loaded: %s: %s", file_path,
+                      error.__class__.__name__, error)
+        return default
+
+    return data
+
+
 def parse_prop(prop_str, converters=None):
     """
     parse and return (keyname, value) from input 'prop_str'
@@ -143,6 +186,38 @@ def dir_stats(dir_path):
     return out
 
 
+def tree_stats(dir_path, skip_names=()):
+    """
+    Yield (relative path, mtime, size) of every file under 'dir_path' in a
+    stable order, entries named in 'skip_names' and compiled Python files
+    are left out. A missing directory yields nothing.
+    """
+    for sub_dir, dir_names, file_names in os.walk(dir_path):
+        dir_names[:] = sorted(name for name in dir_names
+                              if (name not in skip_names)
+                              and (name != "__pycache__"))
+        for name in sorted(file_names):
+            if (name in skip_names) or name.endswith((".pyc", ".pyo")):
+                continue
+
+            file_path = os.path.join(sub_dir, name)
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue
+
+            yield (os.path.relpath(file_path, dir_path), file_stat.st_mtime,
+                   file_stat.st_size)
+
+
+def content_digest(data):
+    """return the hex SHA-256 digest of file contents, text is utf-8 encoded"""
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+
+    return hashlib.sha256(data).hexdigest()
+
+
 def path_iter_dict(dict_obj, prefix=None):
     """
     yield (path, value) for each item in a dict possibly containing other dicts
@@ -204,3 +279,54 @@ class TaskPool(ThreadPool):
     def wait_all(self):
         self.close()
         self.join()
+
+
+class NodeOutput(object):
+    """
+    File-like output of a single node among others running concurrently
+
+    Output is written to 'out_file' (shared by all the nodes) only in whole
+    lines so that the outputs of different nodes do not get mixed up. By
+    default everything is held until close(), with a 'prefix' complete lines
+    are written as soon as they are available, each starting with the prefix.
+    """
+    lock = threading.Lock()
+
+    def __init__(self, out_file, prefix=None):
+        self.out_file = out_file
+        self.prefix = prefix
+        self.chunks = []
+
+    def isatty(self):
+        return False
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", "replace")
+
+        self.chunks.append(data)
+        if self.prefix is not None and "\n" in data:
+            text = "".join(self.chunks)
+            complete, _, rest = text.rpartition("\n")
+            self.chunks = [rest] if rest else []
+            self.write_lines(complete + "\n")
+
+    def write_lines(self, text):
+        if self.prefix is not None:
+            text = "".join("%s%s" % (self.prefix, line)
+                           for line in text.splitlines(True))
+
+        with self.lock:
+            self.out_file.write(text)
+            self.out_file.flush()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        text = "".join(self.chunks)
+        self.chunks = []
+        if text:
+            if not text.endswith("\n"):
+                text += "\n"
+            self.write_lines(text)
@@ -13,6 +13,7 @@ See LICENSE for details.
 
 import os
 import re
+from . import errors
 
 try:
     import git
@@ -24,6 +25,7 @@ except ImportError:
 GIT_IGNORE = """\
 *~
 *.pyc
+/.cache/
 """
 
 class VersionControl(object):
@@ -69,6 +71,20 @@ class GitVersionControl(VersionControl):
                 self.git.index.remove(deleted[i:i + BATCH])
         self.git.index.commit(message)
 
+    def get_changed_files(self, since):
+        """
+        Return repository paths changed since revision 'since'
+
+        Includes uncommitted changes and untracked files.
+        """
+        try:
+            changed = self.git.git.diff("--name-only", since, "--").splitlines()
+        except git.GitCommandError as error:
+            raise errors.UserError("cannot get changes since %r: %s" % (
+                    since, error))
+
+        return sorted(set(changed) | set(self.git.untracked_files))
+
     def status(self):
         diff = self.git.git.diff()
         if diff:
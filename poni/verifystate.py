@@ -0,0 +1,61 @@
+"""
+state of the previous verify run for incremental verification
+
+Copyright (c) 2010-2012 Mika Eloranta
+See LICENSE for details.
+
+"""
+
+import logging
+from . import util
+
+STATE_VERSION = 1
+
+
+class VerifyState(object):
+    """
+    Persistent per-entry information about previous renders
+
+    For each rendered file entry the state records whether the render used
+    dynamic lookups (find(), get_node(), buckets, ...), in which case its
+    output may depend on any part of the repository. Entries without a
+    recorded state are treated as dynamic.
+    """
+    def __init__(self, file_path):
+        self.log = logging.getLogger("verifystate")
+        self.file_path = file_path
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        data = util.json_load_or_default(self.file_path, {},
+                                         version=STATE_VERSION, log=self.log)
+        self.entries = data.get("entries") or {}
+        self.dirty = False
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        data = dict(version=STATE_VERSION, entries=self.entries)
+        try:
+            util.json_dump_atomic(data, self.file_path)
+        except (IOError, OSError) as error:
+            self.log.debug("verify state %r not saved: %s: %s", self.file_path,
+                           error.__class__.__name__, error)
+            return
+
+        self.dirty = False
+
+    def is_dynamic(self, key):
+        return self.entries.get(key, True)
+
+    def set_dynamic(self, key, dynamic):
+        if self.entries.get(key) != dynamic:
+            self.entries[key] = dynamic
+            self.dirty = True
+
+    def forget(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.dirty = True
@@ -8,27 +8,55 @@ See LICENSE for details.
 
 import logging
 import threading
+import heapq
+import itertools
 import time
+from . import errors
 try:
     import Queue as queue
 except ImportError:
     import queue
 
 
-class Task(threading.Thread):
+# default maximum number of worker threads when the job count is not limited
+DEFAULT_MAX_WORKERS = 64
+
+
+class Task(object):
     def __init__(self, target=None):
-        threading.Thread.__init__(self, target=target)
         self.log = logging.getLogger("task")
-        self.daemon = True
+        self.target = target
         self.runner = None
         self.start_time = None
         self.stop_time = None
 
-    def can_start(self):
-        return True
+    def get_key(self):
+        """return a hashable key identifying this task in dependencies"""
+        return self
+
+    def get_dependencies(self):
+        """return the keys of the tasks that must finish before this one"""
+        return []
+
+    def get_resources(self):
+        """
+        return the resources this task occupies while running
+
+        Returns a list of (resource, limit) pairs: at most 'limit' tasks
+        occupying the same hashable 'resource' may run at the same time.
+        """
+        return []
+
+    def get_cost(self):
+        """return the estimated duration of this task (any unit)"""
+        return 1.0
 
     def execute(self):
-        assert False, "override in sub-class"
+        assert self.target, "override in sub-class"
+        self.target()
+
+    def start(self):
+        self.runner.workers.submit(self)
 
     def run(self):
         try:
@@ -39,14 +67,111 @@ class Task(threading.Thread):
             self.runner.task_finished(self)
 
 
+class WorkerPool(object):
+    """
+    Reusable worker threads running Task.run(), at most 'max_workers' of them
+
+    Workers are started on demand when there are no idle ones. 'stack_size'
+    (bytes) overrides the default thread stack size of the workers.
+    """
+    def __init__(self, max_workers, stack_size=None):
+        self.log = logging.getLogger("workerpool")
+        self.max_workers = max_workers
+        self.stack_size = stack_size
+        self.work_queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.workers = []
+        self.idle = 0
+        self.queued = 0
+
+    def submit(self, task):
+        with self.lock:
+            self.queued += 1
+            if (self.queued > self.idle) and (len(self.workers) < self.max_workers):
+                self.add_worker()
+
+        self.work_queue.put(task)
+
+    def add_worker(self):
+        worker = threading.Thread(target=self.work,
+                                  name="worker-%d" % len(self.workers))
+        worker.daemon = True
+        if self.stack_size:
+            old_stack_size = threading.stack_size(self.stack_size)
+            try:
+                worker.start()
+            finally:
+                threading.stack_size(old_stack_size)
+        else:
+            worker.start()
+
+        self.workers.append(worker)
+
+    def work(self):
+        while True:
+            with self.lock:
+                self.idle += 1
+
+            task = self.work_queue.get()
+            with self.lock:
+                self.idle -= 1
+                self.queued -= 1
+
+            if task is None:
+                break
+
+            try:
+                task.run()
+            except BaseException as error:  # pylint: disable=W0703
+                # already recorded by the task, keep the worker alive
+                self.log.debug("task %s raised %s: %s", task,
+                               error.__class__.__name__, error)
+
+    def close(self):
+        """stop all the workers after they have finished their current tasks"""
+        with self.lock:
+            workers, self.workers = self.workers, []
+
+        for _ in workers:
+            self.work_queue.put(None)
+
+        for worker in workers:
+            worker.join()
+
+
 class Runner(object):
-    def __init__(self, max_jobs=None):
+    """
+    Run tasks as soon as their dependencies have finished
+
+    The number of unfinished dependencies of each task is tracked and tasks
+    are moved to the ready queue when the count drops to zero. The number
+    of running tasks occupying each resource is limited (see
+    Task.get_resources()), ready tasks waiting for a resource are queued per
+    resource and woken up when it is released.
+
+    Ready tasks are started in the order of their priority: the total cost
+    (Task.get_cost()) of the longest chain of tasks depending on them,
+    including themselves. Tasks on the critical path thus start first.
+
+    Tasks are run by a pool of at most 'max_jobs' (or DEFAULT_MAX_WORKERS)
+    reusable worker threads and returned via 'finished_queue' when done.
+    """
+    def __init__(self, max_jobs=None, stack_size=None):
         self.log = logging.getLogger("runner")
         self.not_started = set()
         self.started = set()
-        self.stopped = set()
+        self.stopped = []
         self.finished_queue = queue.Queue()
         self.max_jobs = max_jobs
+        self.workers = WorkerPool(max_jobs or DEFAULT_MAX_WORKERS,
+                                  stack_size=stack_size)
+        self.waiting = {}  # {task: number of unfinished dependencies}
+        self.dependents = {}  # {task key: [dependent task, ...]}
+        self.priority = {}  # {task: cost of the longest dependent chain}
+        self.order = itertools.count()
+        self.ready = []  # heap of (-priority, order, task)
+        self.blocked = {}  # {resource: heap of ready tasks waiting for it}
+        self.usage = {}  # {resource: number of running tasks occupying it}
 
     def add_task(self, task):
         task.runner = self
@@ -55,18 +180,98 @@ class Runner(object):
     def task_finished(self, task):
         self.finished_queue.put(task)
 
-    def check(self):
-        for task in list(self.not_started):
-            if self.max_jobs and (len(self.started) >= self.max_jobs):
-                continue
+    def schedule(self):
+        """add the tasks that have not been scheduled yet to the graph"""
+        keys = set(task.get_key() for task in self.not_started)
+        new_tasks = [task for task in self.not_started
+                     if task not in self.waiting]
+        for task in new_tasks:
+            depends = set(key for key in task.get_dependencies()
+                          if key in keys)
+            self.waiting[task] = len(depends)
+            for key in depends:
+                self.dependents.setdefault(key, []).append(task)
+
+        self.update_priorities(new_tasks)
+        for task in new_tasks:
+            if not self.waiting[task]:
+                self.push(self.ready, task)
+
+    def update_priorities(self, tasks):
+        """calculate the priorities of 'tasks' in reverse topological order"""
+        tasks = set(tasks)
+        by_key = dict((task.get_key(), task) for task in tasks)
+        remaining = dict(
+            (task, len([dependent for dependent
+                        in self.dependents.get(task.get_key(), [])
+                        if dependent in tasks]))
+            for task in tasks)
+        leaves = [task for task, count in remaining.items() if not count]
+        while leaves:
+            task = leaves.pop()
+            self.priority[task] = task.get_cost() + max(
+                [self.priority.get(dependent, 0)
+                 for dependent in self.dependents.get(task.get_key(), [])]
+                or [0])
+            for key in set(task.get_dependencies()):
+                dep_task = by_key.get(key)
+                if dep_task is not None:
+                    remaining[dep_task] -= 1
+                    if not remaining[dep_task]:
+                        leaves.append(dep_task)
+
+        for task in tasks:
+            # tasks in dependency cycles
+            self.priority.setdefault(task, task.get_cost())
+
+    def push(self, heap, task):
+        heapq.heappush(heap, (-self.priority[task], next(self.order), task))
+
+    def is_available(self, resource, limit):
+        return self.usage.get(resource, 0) < limit
+
+    def get_busy_resource(self, task):
+        for resource, limit in task.get_resources():
+            if not self.is_available(resource, limit):
+                return resource
+
+        return None
 
-            if not task.can_start():
+    def wake(self, resource):
+        """move the next task waiting for 'resource' back to the ready queue"""
+        blocked = self.blocked.get(resource)
+        if blocked:
+            self.push(self.ready, heapq.heappop(blocked)[2])
+            if not blocked:
+                del self.blocked[resource]
+
+    def start_ready(self):
+        while self.ready:
+            if len(self.started) >= self.workers.max_workers:
+                break
+
+            task = heapq.heappop(self.ready)[2]
+            busy_resource = self.get_busy_resource(task)
+            if busy_resource is not None:
+                self.push(self.blocked.setdefault(busy_resource, []), task)
+                # the task may have been woken up for another resource that
+                # is still free, pass the turn on to the next one waiting
+                for resource, limit in task.get_resources():
+                    if self.is_available(resource, limit):
+                        self.wake(resource)
                 continue
 
+            for resource, limit in task.get_resources():
+                self.usage[resource] = self.usage.get(resource, 0) + 1
+
             self.started.add(task)
             self.not_started.remove(task)
             task.start()
 
+    def check(self):
+        self.schedule()
+        self.start_ready()
+
     def wait_task_to_finish(self):
         try:
             task = self.finished_queue.get(timeout=60.0)
@@ -79,10 +284,31 @@ class Runner(object):
         self.log.debug("task %s finished, took %.2f seconds", task,
                        (task.stop_time - task.start_time))
         self.started.remove(task)
-        self.stopped.add(task)
+        self.stopped.append(task)
         self.finished_queue.task_done()
 
+        for resource, limit in task.get_resources():
+            self.usage[resource] -= 1
+            if not self.usage[resource]:
+                del self.usage[resource]
+            self.wake(resource)
+
+        for dependent in self.dependents.pop(task.get_key(), []):
+            self.waiting[dependent] -= 1
+            if not self.waiting[dependent]:
+                self.push(self.ready, dependent)
+
     def run_all(self):
-        while self.not_started or self.started:
+        try:
             self.check()
-            self.wait_task_to_finish()
+            while self.started:
+                self.wait_task_to_finish()
+                self.start_ready()
+        finally:
+            self.workers.close()
+
+        if self.not_started:
+            raise errors.ControlError(
+                "%d tasks cannot be started due to circular dependencies: %s"
+                % (len(self.not_started),
+                   ", ".join(sorted(str(task) for task in self.not_started))))
@@ -1,6 +1,8 @@
 from __future__ import print_function
 import json
 import os
+import sys
+from io import StringIO
 from poni import tool
 from helper import *
 
@@ -170,6 +172,111 @@ class TestCommands(Helper):
         with open(output_file, "r") as f:
             assert f.read() == new_template_text
 
+    def test_parallel_deploy(self):
+        output_dir = self.temp_file()
+        os.makedirs(output_dir)
+        args = dict(source="test.txt", dest="%s/${node.name}.txt" % output_dir,
+                    override=False)
+        poni = self.repo_and_config("tnode", "tconf",
+                                    single_file_plugin_text % args)
+        assert not poni.run(["set", "tnode", "verify:bool=off"])
+        tfile_path = os.path.join(poni.default_repo_path, "system", "tnode",
+                                  "config", "tconf", "test.txt")
+        with open(tfile_path, "w") as f:
+            f.write("hello")
+
+        nodes = ["node%d" % i for i in range(5)]
+        for node in nodes:
+            assert not poni.run(["add-node", node])
+            assert not poni.run(["set", node, "deploy=local"])
+            assert not poni.run(["add-config", node, "conf",
+                                 "--inherit", "tnode/tconf"])
+
+        # missing files are counted as errors from all nodes
+        assert poni.run(["audit", "-j", "3"])
+        assert not poni.run(["deploy", "-j", "3"])
+        for node in nodes:
+            with open(os.path.join(output_dir, "%s.txt" % node)) as f:
+                assert f.read() == "hello"
+
+    def test_parallel_exec(self):
+        poni, repo = self.init_repo()
+        nodes = ["node%d" % i for i in range(4)]
+        for node in nodes:
+            assert not poni.run(["add-node", node])
+            assert not poni.run(["set", node, "deploy=local"])
+
+        for extra_args in [[], ["--stream"]]:
+            output = StringIO()
+            stdout, sys.stdout = sys.stdout, output
+            try:
+                assert not poni.run(["remote", "exec", "node", "-j", "4", "pwd"]
+                                    + extra_args)
+            finally:
+                sys.stdout = stdout
+
+            lines = output.getvalue().splitlines()
+            for node in nodes:
+                node_lines = [line for line in lines if node in line]
+                if extra_args:
+                    # BEGIN, output and END lines, each prefixed
+                    assert len(node_lines) == 3
+                    assert ("[%s] %s" % (node, os.getcwd())) in node_lines
+                else:
+                    # the whole output of a node is written at once
+                    begin = lines.index(node_lines[0])
+                    assert lines[begin + 1] == os.getcwd()
+                    assert lines[begin + 2] == node_lines[1]
+
+        assert poni.run(["remote", "exec", "node", "-j", "4", "-q", "false"])
+
+    def test_bulk_deploy(self):
+        output_dir = self.temp_file()
+        plugin_text = """
+from poni import config
+
+class PlugIn(config.PlugIn):
+    def add_actions(self):
+        for i in range(12):
+            self.add_file("test.txt", dest_path="%s/%%d/f.txt" %% i,
+                          render=self.render_name_template)
+""" % output_dir
+        poni = self.repo_and_config("node", "conf", plugin_text)
+        assert not poni.run(["set", "node", "deploy=local"])
+        tfile_path = os.path.join(poni.default_repo_path, "system", "node",
+                                  "config", "conf", "test.txt")
+        with open(tfile_path, "w") as f:
+            f.write("hello")
+
+        assert not poni.run(["deploy"])
+        for i in range(12):
+            with open(os.path.join(output_dir, "%d/f.txt" % i)) as f:
+                assert f.read() == "hello"
+
+        assert not poni.run(["audit", "--checksum"])
+
+    def test_checksum_deploy(self):
+        output_file = self.temp_file()
+        poni = self._make_inherited_config("tnode", "tconf", "inode", "iconf",
+                                           "test.txt", "hello", output_file)
+        os.unlink(output_file)
+        assert poni.run(["audit", "--checksum"])
+        assert not poni.run(["deploy", "--checksum"])
+        mtime = os.stat(output_file).st_mtime
+        os.utime(output_file, (mtime - 100, mtime - 100))
+        # unchanged file is not rewritten
+        assert not poni.run(["deploy", "--checksum"])
+        assert os.stat(output_file).st_mtime == mtime - 100
+        assert not poni.run(["audit", "--checksum"])
+
+        with open(output_file, "w") as f:
+            f.write("changed")
+
+        assert poni.run(["audit", "--checksum"])
+        assert not poni.run(["deploy", "--checksum"])
+        with open(output_file) as f:
+            assert f.read() == "hello"
+
     def test_require(self):
         poni, repo = self.init_repo()
         assert not poni.run(["require", "poni_version>='0.1'"])
@@ -1,4 +1,5 @@
 import json
+import time
 from poni import tool
 from helper import *
 
@@ -43,3 +44,122 @@ class TestControls(Helper):
         cmd_output("bar", "foobar")
         cmd_output("baz", "foobaz")
         cmd_output("bax", "bax")
+
+    def test_concurrency_limits(self):
+        poni = self.repo_and_config("node", "conf", plugin_text)
+        temp = self.temp_file()
+        assert not poni.run(["set", "node", "host=h1",
+                             "control_concurrency=2",
+                             'control_pools:-json={"rack": "3"}'])
+        assert not poni.run(["control", ".", "foo", "--", temp])
+        assert open(temp).read() == "foo"
+
+        for invalid in ["control_concurrency=0", "control_concurrency=abc",
+                        'control_pools:-json={"rack": "many"}']:
+            assert not poni.run(["set", "node", "control_concurrency=1",
+                                 "control_pools:-json={}"])
+            assert not poni.run(["set", "node", invalid])
+            assert poni.run(["control", ".", "foo", "--", temp])
+
+        assert open(temp).read() == "foo"
+
+    def test_resume(self):
+        resume_plugin_text = """
+import argh
+import os
+from poni import config
+
+class PlugIn(config.PlugIn):
+    @config.control(provides=["foo"])
+    @argh.arg("output")
+    def foo(self, arg):
+        open(arg.output, "a").write("foo")
+
+    @config.control(requires=["foo"])
+    @argh.arg("output")
+    def bar(self, arg):
+        if os.path.exists(arg.output + ".fail"):
+            raise Exception("failing")
+        open(arg.output, "a").write("bar")
+"""
+        poni = self.repo_and_config("node", "conf", resume_plugin_text)
+        temp = self.temp_file()
+        self.temp_files.append(temp + ".fail")
+        open(temp + ".fail", "w").close()
+        assert poni.run(["control", ".", "bar", "--", temp])
+        assert open(temp).read() == "foo"
+
+        journal_dir = os.path.join(poni.default_repo_path, ".cache",
+                                   "control-runs")
+        run_ids = os.listdir(journal_dir)
+        assert len(run_ids) == 1
+
+        # only the failed task is run again
+        os.unlink(temp + ".fail")
+        assert not poni.run(["control", "--resume", run_ids[0]])
+        assert open(temp).read() == "foobar"
+        assert not poni.run(["control", "--resume", run_ids[0]])
+        assert open(temp).read() == "foobar"
+
+    def test_control_catalog(self):
+        log_file = self.temp_file()
+        catalog_plugin_text = """
+from poni import config
+
+class PlugIn(config.PlugIn):
+    def add_controls(self):
+        open(%r, "a").write(self.node.name + "\\n")
+
+    @config.control(provides=["hello"])
+    def hello(self, arg):
+        pass
+""" % log_file
+        poni = self.repo_and_config("node1", "conf", catalog_plugin_text)
+        repo = poni.default_repo_path
+        assert not poni.run(["add-node", "node2"])
+        assert not poni.run(["add-config", "node2", "conf",
+                             "--inherit", "node1/conf"])
+
+        # the catalogue is only used when the files are old enough
+        old = time.time() - 3600
+        for dir_path, dir_names, file_names in os.walk(repo):
+            for name in file_names:
+                os.utime(os.path.join(dir_path, name), (old, old))
+
+        def collected(args):
+            if os.path.exists(log_file):
+                os.unlink(log_file)
+
+            assert not tool.Tool(default_repo_path=repo).run(args)
+            return sorted(open(log_file).read().split())
+
+        assert collected(["control", "node2/conf", "hello"]) == ["node1", "node2"]
+        assert collected(["control", "node2/conf", "hello"]) == ["node2"]
+        assert collected(["control", "conf", "hello"]) == ["node1", "node2"]
+
+        # system properties and settings layers may affect the controls
+        def touch_old(file_path, text):
+            with open(file_path, "w") as f:
+                f.write(text)
+
+            old = time.time() - 1800
+            os.utime(file_path, (old, old))
+
+        touch_old(os.path.join(repo, "system", "system.json"), '{"x": 1}')
+        assert collected(["control", "node2/conf", "hello"]) == ["node1", "node2"]
+        assert collected(["control", "node2/conf", "hello"]) == ["node2"]
+        touch_old(os.path.join(repo, "system", "node1", "config", "conf",
+                               "settings", "10-extra.json"), '{"y": 2}')
+        assert collected(["control", "node2/conf", "hello"]) == ["node1", "node2"]
+        assert collected(["control", "node2/conf", "hello"]) == ["node2"]
+
+        # so may the library modules imported by the plugins
+        lib_dir = self.temp_dir()
+        touch_old(os.path.join(lib_dir, "helpers.py"), "X = 1\n")
+        assert not tool.Tool(default_repo_path=repo).run(
+            ["add-library", "helpers", lib_dir])
+        assert collected(["control", "node2/conf", "hello"]) == ["node1", "node2"]
+        assert collected(["control", "node2/conf", "hello"]) == ["node2"]
+        touch_old(os.path.join(lib_dir, "helpers.py"), "X = 22\n")
+        assert collected(["control", "node2/conf", "hello"]) == ["node1", "node2"]
+        assert collected(["control", "node2/conf", "hello"]) == ["node2"]
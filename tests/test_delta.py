@@ -0,0 +1,114 @@
+import os
+import random
+import shutil
+import subprocess
+from io import BytesIO
+from poni import core
+from poni import delta
+from poni import errors
+from poni import rcontrol
+from helper import *
+
+
+class LocalDeltaRemoteControl(rcontrol.SshRemoteControl):
+    """runs the remote scripts locally instead of over ssh"""
+    def __init__(self, node):
+        rcontrol.SshRemoteControl.__init__(self, node)
+        self.put_files = []
+
+    def execute_command(self, cmd, pseudo_tty=False):
+        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        yield rcontrol.STDOUT, stdout
+        yield rcontrol.STDERR, stderr
+        yield rcontrol.DONE, process.returncode
+
+    def put_file(self, source_path, dest_path, callback=None):
+        self.put_files.append(dest_path)
+        shutil.copyfile(source_path, dest_path)
+
+
+class NoPatchRemoteControl(LocalDeltaRemoteControl):
+    """the delta is uploaded but the patch script cannot be started"""
+    def run_script(self, script, args):
+        if script == delta.PATCH_SCRIPT:
+            raise errors.RemoteError("no python")
+
+        return LocalDeltaRemoteControl.run_script(self, script, args)
+
+
+def signatures_of(data, block_size):
+    lines = []
+    for pos in range(0, len(data) - block_size + 1, block_size):
+        block = data[pos:pos + block_size]
+        lines.append("%08x %s" % (delta.zlib.adler32(block) & 0xffffffff,
+                                  delta.hashlib.sha1(block).hexdigest()))
+
+    return delta.parse_signatures("\n".join(lines))
+
+
+def test_make_delta():
+    rand = random.Random(1)
+    old = bytes(bytearray(rand.randrange(256) for i in range(100000)))
+    # insertions shift the rest of the data
+    new = old[:1000] + b"inserted" + old[1000:50000] + b"x" * 100 + old[50100:]
+    block_size = 2048
+    out = BytesIO()
+    literal_size = delta.make_delta(new, signatures_of(old, block_size),
+                                    block_size, out)
+    assert literal_size < 3 * block_size
+    assert len(out.getvalue()) < 4 * block_size
+
+    # nothing in common
+    try:
+        delta.make_delta(new * 2, {}, block_size, BytesIO())
+    except delta.NoMatch:
+        pass
+    else:
+        assert 0, "no common blocks not detected"
+
+
+class TestDelta(Helper):
+    def test_put_file_delta(self):
+        poni, repo = self.init_repo()
+        assert not poni.run(["add-node", "foo"])
+        node = list(core.ConfigMan(repo).find("foo"))[0]
+        remote = LocalDeltaRemoteControl(node)
+
+        temp_dir = self.temp_dir()
+        source_path = os.path.join(temp_dir, "source")
+        dest_path = os.path.join(temp_dir, "dest")
+        rand = random.Random(2)
+        old = bytes(bytearray(rand.randrange(256) for i in range(300000)))
+        new = old[:123456] + b"changed" + old[123470:]
+        with open(source_path, "wb") as f:
+            f.write(new)
+        with open(dest_path, "wb") as f:
+            f.write(old)
+        os.chmod(dest_path, 0o640)
+
+        remote.put_file_delta(source_path, dest_path)
+        with open(dest_path, "rb") as f:
+            assert f.read() == new
+        assert (os.stat(dest_path).st_mode & 0o777) == 0o640
+        assert remote.put_files == [dest_path + ".poni-delta"]
+        assert sorted(os.listdir(temp_dir)) == ["dest", "source"]
+
+        # without a remote copy the file is copied in full
+        os.unlink(dest_path)
+        remote.put_file_delta(source_path, dest_path)
+        with open(dest_path, "rb") as f:
+            assert f.read() == new
+        assert remote.put_files[-1] == dest_path
+
+        # the uploaded delta is removed if it cannot be applied
+        with open(dest_path, "wb") as f:
+            f.write(old)
+
+        remote = NoPatchRemoteControl(node)
+        remote.put_file_delta(source_path, dest_path)
+        with open(dest_path, "rb") as f:
+            assert f.read() == new
+        assert remote.put_files == [dest_path + ".poni-delta", dest_path]
+        assert sorted(os.listdir(temp_dir)) == ["dest", "source"]
@@ -0,0 +1,58 @@
+import json
+import os
+import time
+from poni import core
+from helper import *
+
+
+class TestRepoIndex(Helper):
+    def age_repo(self, repo, seconds=3600):
+        """make all repo files look old enough to be stored in the index"""
+        old = time.time() - seconds
+        for dir_path, dir_names, file_names in os.walk(repo):
+            for name in dir_names + file_names:
+                os.utime(os.path.join(dir_path, name), (old, old))
+
+    def test_index_is_used_and_refreshed(self):
+        poni, repo = self.init_repo()
+        assert not poni.run(["add-node", "foo/bar"])
+        assert not poni.run(["add-config", "foo/bar", "conf"])
+        assert not poni.run(["set", "foo/bar", "x=1"])
+        self.age_repo(repo)
+
+        confman = core.ConfigMan(repo)
+        assert [n.name for n in confman.find(".")] == ["foo/bar"]
+        index_file = confman.get_cache_path(core.INDEX_FILE)
+        assert os.path.exists(index_file)
+        with open(index_file) as f:
+            index = json.load(f)
+
+        assert "system/foo/bar/node.json" in index["files"]
+
+        # edit node properties in-place and add a new node
+        node_file = os.path.join(repo, "system", "foo", "bar", "node.json")
+        with open(node_file, "w") as f:
+            json.dump({"host": "", "x": "22"}, f)
+
+        assert not poni.run(["add-node", "foo/baz"])
+
+        confman = core.ConfigMan(repo)
+        nodes = dict((n.name, n) for n in confman.find("."))
+        assert sorted(nodes) == ["foo/bar", "foo/baz"]
+        assert nodes["foo/bar"]["x"] == "22"
+        assert [c.name for n, c in confman.find_config("foo/bar/conf")] == ["conf"]
+
+    def test_invalid_index_is_rebuilt(self):
+        poni, repo = self.init_repo()
+        assert not poni.run(["add-node", "foo/bar"])
+        self.age_repo(repo)
+        confman = core.ConfigMan(repo)
+        index_file = confman.get_cache_path(core.INDEX_FILE)
+        os.makedirs(os.path.dirname(index_file))
+        with open(index_file, "w") as f:
+            f.write("garbage")
+
+        confman = core.ConfigMan(repo)
+        assert [n.name for n in confman.find(".")] == ["foo/bar"]
+        with open(index_file) as f:
+            assert json.load(f)["version"] == 1
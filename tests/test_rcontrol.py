@@ -0,0 +1,394 @@
+import os
+import shutil
+import socket
+import subprocess
+import tarfile
+import threading
+from poni import config
+from poni import core
+from poni import errors
+from poni import rcontrol
+from poni import rcontrol_all
+from poni import util
+from helper import *
+
+try:
+    import paramiko
+    from poni import rcontrol_paramiko
+except ImportError:
+    rcontrol_paramiko = None
+
+
+if rcontrol_paramiko:
+    class LocalExecRemoteControl(rcontrol_paramiko.ParamikoRemoteControl):
+        """runs the bulk remote commands locally instead of over ssh"""
+        def execute_command(self, cmd, pseudo_tty=False):
+            output = subprocess.Popen(cmd, shell=True,
+                                      stdout=subprocess.PIPE).communicate()[0]
+            yield rcontrol.STDOUT, output
+            yield rcontrol.DONE, 0
+
+        def read_file(self, file_path):
+            raise errors.RemoteFileDoesNotExist(file_path)
+
+        def stat(self, file_path):
+            raise errors.RemoteFileDoesNotExist(file_path)
+
+
+    class LocalSFTPHandle(paramiko.SFTPHandle):
+        def stat(self):
+            return paramiko.SFTPAttributes.from_stat(
+                os.fstat(self.writefile.fileno()))
+
+        def chattr(self, attrs):
+            self.server.setstats.append(attrs)
+            if attrs.st_mode is not None:
+                os.chmod(self.filename, attrs.st_mode)
+            return paramiko.SFTP_OK
+
+    class LocalSFTPServer(paramiko.SFTPServerInterface):
+        setstats = []
+
+        def open(self, path, flags, attr):
+            handle = LocalSFTPHandle(flags)
+            handle.server = self
+            handle.filename = path
+            handle.writefile = os.fdopen(os.open(path, flags, 0o644), "wb")
+            return handle
+
+        def stat(self, path):
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+
+    class LocalSSHServer(paramiko.ServerInterface):
+        def get_allowed_auths(self, username):
+            return "none"
+
+        def check_auth_none(self, username):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+    def local_sftp():
+        """return an SFTP client connected to an in-process server"""
+        client_sock, server_sock = socket.socketpair()
+        server = paramiko.Transport(server_sock)
+        server.add_server_key(paramiko.RSAKey.generate(1024))
+        server.set_subsystem_handler("sftp", paramiko.SFTPServer,
+                                     LocalSFTPServer)
+        server.start_server(event=threading.Event(), server=LocalSSHServer())
+        client = paramiko.Transport(client_sock)
+        client.start_client()
+        client.auth_none("test")
+        return paramiko.SFTPClient.from_transport(client), [client, server]
+
+
+class CountingLocalControl(rcontrol.LocalControl):
+    def __init__(self, node, copied):
+        rcontrol.LocalControl.__init__(self, node)
+        self.copied = copied
+
+    def clone(self):
+        return CountingLocalControl(self.node, self.copied)
+
+    def put_file(self, source_path, dest_path, callback=None):
+        self.copied.append(dest_path)
+        shutil.copy(source_path, dest_path)
+
+
+class LocalShellRemoteControl(rcontrol.SshRemoteControl):
+    """runs the remote commands locally and writes local files"""
+    def __init__(self, node):
+        rcontrol.SshRemoteControl.__init__(self, node)
+        self.write_args = []
+        self.uploaded = []
+
+    def execute_command(self, cmd, pseudo_tty=False):
+        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        yield rcontrol.STDOUT, stdout
+        yield rcontrol.STDERR, stderr
+        yield rcontrol.DONE, process.returncode
+
+    def write_file(self, file_path, contents, mode=None, owner=None,
+                   group=None):
+        self.written = file_path
+        self.write_args.append((file_path, mode, owner, group))
+        with open(file_path, "wb") as f:
+            f.write(contents if isinstance(contents, bytes)
+                    else contents.encode("utf-8"))
+
+    def put_file(self, source_path, dest_path, callback=None):
+        self.uploaded.append(dest_path)
+        shutil.copyfile(source_path, dest_path)
+
+    def stat(self, file_path):
+        try:
+            return os.stat(file_path)
+        except OSError as error:
+            raise errors.RemoteFileDoesNotExist(str(error))
+
+    def makedirs(self, dir_path):
+        os.makedirs(dir_path)
+
+
+class FakeSSH(object):
+    def __init__(self):
+        self.active = True
+        self.closed = False
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return self.active
+
+    def close(self):
+        self.closed = True
+
+
+class TestRemoteControl(Helper):
+    def get_node(self):
+        poni, repo = self.init_repo()
+        assert not poni.run(["add-node", "foo"])
+        return list(core.ConfigMan(repo).find("foo"))[0]
+
+    def write_files(self):
+        temp_dir = self.temp_dir()
+        paths = [os.path.join(temp_dir, name) for name in ["a", "b"]]
+        for path in paths:
+            with open(path, "w") as f:
+                f.write("data %s" % path)
+
+        return paths, os.path.join(temp_dir, "missing")
+
+    def test_read_files(self):
+        remote = rcontrol.LocalControl(self.get_node())
+        paths, missing = self.write_files()
+        files = remote.read_files(paths + [missing])
+        for path in paths:
+            contents, stat = files[path]
+            assert contents == ("data %s" % path).encode("utf-8")
+            assert stat.st_size == len(contents)
+
+        assert isinstance(files[missing], errors.RemoteFileDoesNotExist)
+
+    def test_read_files_tar(self):
+        if not rcontrol_paramiko:
+            return
+
+        remote = LocalExecRemoteControl(self.get_node())
+        paths, missing = self.write_files()
+        files = remote.read_files(paths + [missing])
+        for path in paths:
+            contents, stat = files[path]
+            assert contents == ("data %s" % path).encode("utf-8")
+            assert int(stat.st_mtime) == int(os.stat(path).st_mtime)
+
+        # files missing from the archive are read one by one
+        assert isinstance(files[missing], errors.RemoteFileDoesNotExist)
+
+    def test_checksum_files(self):
+        if not rcontrol_paramiko:
+            return
+
+        paths, missing = self.write_files()
+        for remote in [rcontrol.LocalControl(self.get_node()),
+                       LocalExecRemoteControl(self.get_node())]:
+            files = remote.checksum_files(paths + [missing])
+            for path in paths:
+                digest, stat = files[path]
+                assert digest == util.content_digest("data %s" % path)
+
+            assert isinstance(files[missing], errors.RemoteFileDoesNotExist)
+
+    def test_copy_tree(self):
+        node = self.get_node()
+        source_dir = self.temp_dir()
+        names = ["a", "b/c", "b/d/e", "b/d/f", "g/h"]
+        for name in names:
+            file_path = os.path.join(source_dir, name)
+            if not os.path.isdir(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+
+            with open(file_path, "w") as f:
+                f.write(name)
+
+        dest_dir = os.path.join(self.temp_dir(), "dest")
+        copied = []
+        remote = CountingLocalControl(node, copied)
+        manager = config.Manager(node.confman)
+        manager.copy_tree(source_dir, dest_dir, remote)
+        assert sorted(copied) == [os.path.join(dest_dir, name)
+                                  for name in names]
+        for name in names:
+            with open(os.path.join(dest_dir, name)) as f:
+                assert f.read() == name
+
+        if rcontrol_paramiko:
+            # remote listing with 'find'
+            listing = LocalExecRemoteControl(node).list_tree(dest_dir)
+            local_listing = remote.list_tree(dest_dir)
+            assert sorted(listing) == sorted(local_listing)
+            assert listing["b/d/e"].st_size == 5
+            assert int(listing["b/d/e"].st_mtime) == int(
+                local_listing["b/d/e"].st_mtime)
+            assert LocalExecRemoteControl(node).list_tree(
+                os.path.join(dest_dir, "missing")) == {}
+
+        # only changed files are copied again
+        del copied[:]
+        manager.copy_tree(source_dir, dest_dir, remote)
+        assert not copied
+        with open(os.path.join(source_dir, "b/d/f"), "w") as f:
+            f.write("changed")
+
+        manager.copy_tree(source_dir, dest_dir, remote, jobs=1)
+        assert copied == [os.path.join(dest_dir, "b/d/f")]
+
+    def test_write_files_tar(self):
+        remote = LocalShellRemoteControl(self.get_node())
+        temp_dir = self.temp_dir()
+        owned_path = os.path.join(temp_dir, "e/f")
+        files = [(os.path.join(temp_dir, "a"), "text", None, None, None),
+                 (os.path.join(temp_dir, "b/c/d"), b"bytes", 0o606, None,
+                  None),
+                 (owned_path, "owned", 0o640, os.getuid(), None)]
+        remote.write_files(files)
+        for file_path, contents, mode, owner, group in files:
+            with open(file_path, "rb") as f:
+                assert f.read() == (contents if isinstance(contents, bytes)
+                                    else contents.encode("ascii"))
+
+        # the umask applies to files without a mode, like with write_file()
+        umask = os.umask(0)
+        os.umask(umask)
+        assert (os.stat(files[0][0]).st_mode & 0o777) == (0o666 & ~umask)
+        assert (os.stat(files[1][0]).st_mode & 0o777) == 0o606
+        # files with an owner are written separately
+        assert remote.write_args[-1] == (owned_path, 0o640, os.getuid(), None)
+        # the archives are uploaded from local files and removed afterwards
+        assert len(remote.uploaded) == 2
+        assert not any(os.path.exists(path) for path in remote.uploaded)
+
+        try:
+            remote.write_files([("relative", "text", None, None, None)])
+        except errors.RemoteError:
+            pass
+        else:
+            assert 0, "relative path accepted"
+
+    def test_tar_control(self):
+        node = self.get_node()
+        node["host"] = "host"
+        tar_dir = self.temp_dir()
+
+        def write_image(method):
+            remote = rcontrol_all.get_remote(node, "%s:%s" % (method, tar_dir))
+            for i in range(3):
+                remote.write_file("/etc/f%d" % i, "data %d" % i, mode=0o600)
+
+            remote.close()
+
+        def read_image(name, mode):
+            with tarfile.open(os.path.join(tar_dir, "host", name), mode) as tar:
+                return [(info.name, info.mode, tar.extractfile(info).read())
+                        for info in tar]
+
+        expected = [("/etc/f%d" % i, 0o600, ("data %d" % i).encode("ascii"))
+                    for i in range(3)]
+        write_image("tar")
+        assert read_image("image.tar", "r:") == expected
+        # plain archives are appended to
+        write_image("tar")
+        assert read_image("image.tar", "r:") == expected * 2
+        write_image("tar.gz")
+        assert read_image("image.tar.gz", "r:gz") == expected
+
+    def test_ssh_pool(self):
+        if not rcontrol_paramiko:
+            return
+
+        pool = rcontrol_paramiko.SSHPool(max_connections=2, max_sessions=2,
+                                         idle_timeout=60.0)
+        opened = []
+        def connect():
+            opened.append(FakeSSH())
+            return opened[-1]
+
+        # sessions are multiplexed until the connection cap is reached
+        users = [pool.acquire(("host", 22), connect) for i in range(5)]
+        assert len(opened) == 2
+        assert users.count(opened[0]) == 3
+        assert pool.acquire(("other", 22), connect) is opened[2]
+
+        # dead connections are replaced
+        opened[1].active = False
+        assert pool.acquire(("host", 22), connect) is opened[3]
+
+        # idle connections are closed after the timeout
+        for ssh in users:
+            pool.release(("host", 22), ssh)
+
+        assert opened[1].closed and not opened[0].closed
+        pool.idle_timeout = 0.0
+        pool.release(("other", 22), opened[2])
+        assert opened[0].closed and opened[2].closed
+        pool.close()
+        assert opened[3].closed
+
+    def test_sftp_write(self):
+        if not rcontrol_paramiko:
+            return
+
+        remote = rcontrol_paramiko.ParamikoRemoteControl(self.get_node())
+        remote.packet_size = 4096
+        remote._sftp, transports = local_sftp()
+        try:
+            temp_dir = self.temp_dir()
+            dest_path = os.path.join(temp_dir, "written")
+            uid, gid = os.getuid(), os.getgid()
+            remote.write_file(dest_path, b"x" * 10000, mode=0o600, owner=uid)
+            with open(dest_path, "rb") as f:
+                assert f.read() == b"x" * 10000
+            assert (os.stat(dest_path).st_mode & 0o777) == 0o600
+
+            # mode and owner are set on the open handle
+            mode_attrs, owner_attrs = LocalSFTPServer.setstats
+            del LocalSFTPServer.setstats[:]
+            assert mode_attrs.st_mode == 0o600
+            assert (owner_attrs.st_uid, owner_attrs.st_gid) == (uid, gid)
+
+            source_path = os.path.join(temp_dir, "source")
+            data = os.urandom(3 * rcontrol_paramiko.PUT_BLOCK_SIZE + 123)
+            with open(source_path, "wb") as f:
+                f.write(data)
+
+            progress = []
+            remote.put_file(source_path, dest_path,
+                            callback=lambda copied, total: progress.append(
+                    (copied, total)))
+            with open(dest_path, "rb") as f:
+                assert f.read() == data
+            assert progress[-1] == (len(data), len(data))
+            assert not LocalSFTPServer.setstats
+        finally:
+            remote._sftp.close()
+            for transport in transports:
+                transport.close()
+
+    def test_asyncssh_method(self):
+        if not rcontrol_all.rcontrol_asyncssh:
+            return
+
+        node = self.get_node()
+        if rcontrol_all.rcontrol_asyncssh.asyncssh:
+            assert rcontrol_all.get_remote(node, "assh")
+        else:
+            try:
+                rcontrol_all.get_remote(node, "assh")
+            except errors.RemoteError:
+                pass
+            else:
+                assert 0, "no error without asyncssh"
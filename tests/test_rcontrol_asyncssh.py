@@ -0,0 +1,179 @@
+import asyncio
+import os
+import shutil
+from pytest import skip
+from poni import core
+from poni import errors
+from poni import rcontrol
+from poni import rcontrol_all
+from helper import *
+
+rcontrol_asyncssh = rcontrol_all.rcontrol_asyncssh
+
+
+class FakeAsyncSSH(object):
+    """stand-in for the asyncssh module, runs everything locally"""
+    FX_NO_SUCH_FILE = 2
+
+    class Error(Exception):
+        pass
+
+    class SFTPError(Error):
+        def __init__(self, code, reason):
+            FakeAsyncSSH.Error.__init__(self, reason)
+            self.code = code
+
+    @staticmethod
+    async def connect(host, **options):
+        return FakeConnection()
+
+
+class FakeProcess(object):
+    def __init__(self, process):
+        self.process = process
+        self.stdin = process.stdin
+        self.stdout = process.stdout
+        self.stderr = process.stderr
+        self.exit_status = None
+
+    async def wait_closed(self):
+        self.exit_status = await self.process.wait()
+
+    def close(self):
+        pass
+
+
+class FakeSFTPFile(object):
+    def __init__(self, file_path):
+        self.file = open(file_path, "wb")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.file.close()
+
+    async def write(self, data):
+        # a file opened without an encoding takes only bytes
+        assert isinstance(data, bytes), "text written to a binary file"
+        self.file.write(data)
+
+
+class FakeSFTP(object):
+    def open(self, file_path, mode):
+        assert mode == "wb"
+        return FakeSFTPFile(file_path)
+
+    async def chmod(self, file_path, mode):
+        os.chmod(file_path, mode)
+
+    async def put(self, source_path, dest_path, progress_handler=None):
+        if not os.path.isdir(os.path.dirname(dest_path)):
+            raise FakeAsyncSSH.SFTPError(FakeAsyncSSH.FX_NO_SUCH_FILE,
+                                         "no such file")
+        elif dest_path.endswith(".denied"):
+            raise FakeAsyncSSH.SFTPError(3, "permission denied")
+
+        shutil.copyfile(source_path, dest_path)
+        if progress_handler:
+            size = os.path.getsize(source_path)
+            progress_handler(source_path, dest_path, size, size)
+
+    def exit(self):
+        pass
+
+
+class FakeConnection(object):
+    async def create_process(self, cmd, encoding=None, term_type=None):
+        if cmd == "disconnect":
+            raise FakeAsyncSSH.Error("connection lost")
+
+        process = await asyncio.create_subprocess_shell(
+            cmd, stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        return FakeProcess(process)
+
+    async def start_sftp_client(self):
+        return FakeSFTP()
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+class TestAsyncSSH(Helper):
+    def setUp(self):
+        if not rcontrol_asyncssh:
+            skip("requires Python 3")
+
+        self.orig_asyncssh = rcontrol_asyncssh.asyncssh
+        rcontrol_asyncssh.asyncssh = FakeAsyncSSH
+
+    def tearDown(self):
+        rcontrol_asyncssh.asyncssh = self.orig_asyncssh
+        self.teardown()
+
+    def remote(self):
+        poni, repo = self.init_repo()
+        assert not poni.run(["add-node", "foo"])
+        assert not poni.run(["set", "foo", "host=localhost", "user=poni"])
+        node = list(core.ConfigMan(repo).find("foo"))[0]
+        return rcontrol_asyncssh.AsyncSSHRemoteControl(node)
+
+    def test_execute_command(self):
+        remote = self.remote()
+        try:
+            output = list(remote.execute_command(
+                    "echo out; echo err >&2; exit 3"))
+            assert output[-1] == (rcontrol.DONE, 3)
+            assert (rcontrol.STDOUT, b"out\n") in output
+            assert (rcontrol.STDERR, b"err\n") in output
+            assert len(output) == 3
+
+            try:
+                list(remote.execute_command("disconnect"))
+            except errors.RemoteError as error:
+                assert "connection lost" in str(error)
+            else:
+                assert 0, "connection error not converted"
+        finally:
+            remote.close()
+
+    def test_put_file(self):
+        remote = self.remote()
+        temp_dir = self.temp_dir()
+        source_path = os.path.join(temp_dir, "source")
+        with open(source_path, "w") as f:
+            f.write("hello")
+
+        progress = []
+        try:
+            remote.put_file(source_path, os.path.join(temp_dir, "dest"),
+                            callback=lambda *args: progress.append(args))
+            with open(os.path.join(temp_dir, "dest")) as f:
+                assert f.read() == "hello"
+
+            assert progress == [(5, 5)]
+            self.assertRaises(errors.RemoteFileDoesNotExist, remote.put_file,
+                              source_path,
+                              os.path.join(temp_dir, "missing", "dest"))
+            self.assertRaises(errors.RemoteError, remote.put_file,
+                              source_path,
+                              os.path.join(temp_dir, "dest.denied"))
+        finally:
+            remote.close()
+
+    def test_write_file(self):
+        remote = self.remote()
+        file_path = os.path.join(self.temp_dir(), "config")
+        text = u"k\u00e4ytt\u00e4j\u00e4 \u2603\n" * 20000
+        try:
+            remote.write_file(file_path, text, mode=0o640)
+            with open(file_path, "rb") as f:
+                assert f.read() == text.encode("utf-8")
+
+            assert (os.stat(file_path).st_mode & 0o777) == 0o640
+        finally:
+            remote.close()
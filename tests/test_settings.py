@@ -1,5 +1,6 @@
 import json
-from poni import tool
+import time
+from poni import core, errors, newconfig, tool
 from helper import *
 
 plugin_text = """
@@ -34,5 +35,52 @@ class TestSettings(Helper):
         assert not poni.run(["settings", "list"])
         # TODO: verify list output
 
+    def test_settings_loaded_on_access(self):
+        input_dir = self.temp_file()
+        settings_dir = os.path.join(input_dir, "settings")
+        os.makedirs(settings_dir)
+        with open(os.path.join(settings_dir, "00-defaults.json"), "w") as f:
+            f.write("invalid json")
+
+        poni = self.repo_and_config("node", "conf", plugin_text,
+                                    copy=input_dir)
+        # settings are not needed for listing nodes and configs
+        assert not poni.run(["list", "-C"])
+        confman = core.ConfigMan(poni.default_repo_path)
+        node, conf = list(confman.find_config("node/conf"))[0]
+        try:
+            conf.settings
+        except errors.SettingsError:
+            pass
+        else:
+            assert 0, "invalid settings layer loaded"
+
+    def test_shared_settings_layers(self):
+        parent_dir = self.temp_dir()
+        child_dirs = [self.temp_dir() for i in range(3)]
+        old = time.time() - 3600
+
+        def write_layer(dir_path, name, data):
+            file_path = os.path.join(dir_path, name)
+            with open(file_path, "w") as f:
+                json.dump(data, f)
+
+            os.utime(file_path, (old, old))
+
+        write_layer(parent_dir, "00-defaults.json", {"a": 1, "l": [1]})
+        write_layer(parent_dir, "10-parent.json", {"!a": 2})
+        for i, child_dir in enumerate(child_dirs):
+            write_layer(child_dir, "50-child.json", {"+l": [i]})
+
+        for repeat in range(2):
+            parent = newconfig.Config([("p", parent_dir)])
+            assert parent == {"a": 2, "l": [1]}
+            for i, child_dir in enumerate(child_dirs):
+                child = newconfig.Config([("p", parent_dir), ("c", child_dir)])
+                assert child == {"a": 2, "l": [1, i]}
+
+            # cached layers are never modified by the merges
+            assert newconfig.Config([("p", parent_dir)]) == parent
+
     # TODO: test for invalid 'set' value types
     # TODO: test for inherited scenarios
@@ -1,9 +1,15 @@
 from __future__ import print_function
 from pytest import skip
+from poni import core
+from poni import errors
 from poni import template
 from poni import tool
+from poni import verifystate
+from poni import version
 from helper import *
 import os
+import sys
+from io import StringIO
 
 
 single_xml_file_plugin_text = """
@@ -97,3 +103,217 @@ class TestTemplates(Helper):
             res = template.render_cheetah(tmpl, None, g_vars)
             assert exp == res, \
                 "template {0!r}, expected {1!r}, got {2!r}".format(tmpl, exp, res)
+
+    def test_render_cache(self):
+        if not template.MakoTemplate:
+            skip("Mako not available")
+
+        plugin_text = single_xml_file_plugin_text.replace(
+            "render_genshi_xml", "render_mako")
+        output_file = self.temp_file()
+        tfile = self.temp_file()
+        with open(tfile, "w") as f:
+            f.write("host=${node['host']}")
+
+        poni = self.repo_and_config(
+            "node", "conf", plugin_text % dict(source=tfile, dest=output_file))
+        assert not poni.run(["set", "node", "host=foo"])
+        assert not poni.run(["show"])
+
+        def render_mako(*args):
+            raise errors.TemplateError("not rendered from cache")
+
+        orig_render_mako = template.render_mako
+        template.render_mako = render_mako
+        try:
+            # unchanged repository: a new process renders from the cache
+            repo = poni.default_repo_path
+            assert not tool.Tool(default_repo_path=repo).run(["show"])
+            assert tool.Tool(default_repo_path=repo).run(
+                ["--no-render-cache", "show"]) == -1
+        finally:
+            template.render_mako = orig_render_mako
+
+        # changed repository: rendered again
+        assert not poni.run(["set", "node", "host=bar", "deploy=local"])
+        assert not poni.run(["deploy"])
+        with open(output_file) as f:
+            assert f.read() == "host=bar"
+
+    def test_render_cache_fingerprint(self):
+        poni, repo = self.init_repo()
+        lib_dir = self.temp_dir()
+        lib_file = os.path.join(lib_dir, "helpers.py")
+        with open(lib_file, "w") as f:
+            f.write("X = 1\n")
+
+        assert not poni.run(["add-library", "helpers", lib_dir])
+
+        def fingerprint():
+            poni = tool.Tool(default_repo_path=repo)
+            manager = poni.get_manager(poni.get_confman(repo))
+            assert manager.render_cache.lib_paths == [lib_dir]
+            return manager.render_cache.get_fingerprint()
+
+        first = fingerprint()
+        assert fingerprint() == first
+        # compiled modules do not matter
+        open(os.path.join(lib_dir, "helpers.pyc"), "w").close()
+        assert fingerprint() == first
+
+        # library changes and poni upgrades invalidate the cache
+        with open(lib_file, "w") as f:
+            f.write("X = 22\n")
+
+        second = fingerprint()
+        assert second != first
+        orig_version = version.__version__
+        version.__version__ = orig_version + "-upgraded"
+        try:
+            assert fingerprint() != second
+        finally:
+            version.__version__ = orig_version
+
+    def test_compiled_template_cache(self):
+        if not template.MakoTemplate:
+            skip("Mako not available")
+
+        tfile = self.temp_file()
+        with open(tfile, "w") as f:
+            f.write("x=${x}")
+
+        for source_text, source_path in [("y=${x}", None), (None, tfile)]:
+            compiled = []
+            def compiler():
+                compiled.append(1)
+                return template.MakoTemplate(text=source_text,
+                                             filename=source_path)
+
+            for i in range(3):
+                tmpl = template.get_compiled("mako", source_text, source_path,
+                                             compiler)
+                assert tmpl.render(x=i).endswith("=%d" % i)
+
+            assert len(compiled) == 1
+
+        # template file modifications are noticed
+        with open(tfile, "w") as f:
+            f.write("changed=${x}")
+
+        assert template.render_mako(None, tfile, dict(x=1)) == "changed=1"
+
+    def test_render_processes(self):
+        if not template.MakoTemplate:
+            skip("Mako not available")
+
+        plugin_text = single_xml_file_plugin_text.replace(
+            "render_genshi_xml", "render_mako")
+        output_dir = self.temp_dir()
+        tfile = self.temp_file()
+        with open(tfile, "w") as f:
+            f.write("host=${node['host']}")
+
+        poni = self.repo_and_config(
+            "tnode", "tconf", plugin_text % dict(
+                source=tfile, dest="%s/${node.name}" % output_dir))
+        assert not poni.run(["set", "tnode", "verify:bool=off"])
+        nodes = ["node%d" % i for i in range(6)]
+        for node in nodes:
+            assert not poni.run(["add-node", node])
+            assert not poni.run(["set", node, "deploy=local",
+                                 "host=%s.example" % node])
+            assert not poni.run(["add-config", node, "conf",
+                                 "--inherit", "tnode/tconf"])
+
+        assert not poni.run(["--no-render-cache", "deploy", "-P", "3"])
+        for node in nodes:
+            with open(os.path.join(output_dir, node)) as f:
+                assert f.read() == "host=%s.example" % node
+
+        # the verify state is recorded for the files rendered in parallel
+        state = verifystate.VerifyState(os.path.join(
+                poni.default_repo_path, core.CACHE_DIR,
+                core.VERIFY_STATE_FILE))
+        assert sorted(state.entries.values()) == [False] * len(nodes)
+
+        # render errors are reported by the parent process
+        with open(tfile, "w") as f:
+            f.write("% if True:\nunterminated block\n")
+
+        assert poni.run(["--no-render-cache", "verify", "-P", "3"]) == -1
+        # files filtered out by the tag are not rendered at all
+        assert not poni.run(["--no-render-cache", "verify", "-P", "3",
+                             "--tag", "other"])
+        assert not poni.run(["--no-render-cache", "verify", "--tag", "other"])
+
+    def test_collect_target_nodes(self):
+        log_file = self.temp_file()
+        plugin_text = """
+from poni import config
+
+class PlugIn(config.PlugIn):
+    def add_actions(self):
+        with open(%(log)r, "a") as f:
+            f.write("%%s\\n" %% self.node.name)
+
+        self.add_file("text", dest_path="out", render=self.render_mako,
+                      source_text=self.node.get("text", "-"))
+""" % dict(log=log_file)
+        poni = self.repo_and_config("tnode", "tconf", plugin_text)
+        assert not poni.run(["set", "tnode", "verify:bool=off"])
+        for node in ["a", "b", "c"]:
+            assert not poni.run(["add-node", node])
+            assert not poni.run(["set", node, "host=%s.example" % node])
+            assert not poni.run(["add-config", node, "conf",
+                                 "--inherit", "tnode/tconf"])
+
+        def collected(text, args):
+            repo = poni.default_repo_path
+            assert not tool.Tool(default_repo_path=repo).run(
+                ["set", "a", "text=%s" % text])
+            open(log_file, "w").close()
+            assert not tool.Tool(default_repo_path=repo).run(
+                ["--no-render-cache"] + args)
+            with open(log_file) as f:
+                return f.read().split()
+
+        # nodes looked up by the templates are collected on demand
+        assert collected("-", ["verify", "a"]) == ["a"]
+        assert collected("${get_node('b')['host']}",
+                         ["verify", "a"]) == ["a", "b"]
+        # buckets may contain records from any node
+        assert sorted(collected("${len(bucket('x'))}", ["verify", "a"])) == [
+            "a", "b", "c", "tnode"]
+        assert sorted(collected("-", ["verify"])) == ["a", "b", "c", "tnode"]
+
+    def test_collect_bucket_records(self):
+        plugin_text = """
+from poni import config
+
+class PlugIn(config.PlugIn):
+    def add_actions(self):
+        if self.node.name == "a":
+            self.add_file("record", dest_bucket="x", render=self.render_mako,
+                          source_text="record")
+        else:
+            self.add_file("count", dest_path="out", render=self.render_mako,
+                          source_text="count=${len(bucket('x'))}")
+"""
+        poni = self.repo_and_config("tnode", "tconf", plugin_text)
+        assert not poni.run(["set", "tnode", "verify:bool=off"])
+        for node in ["a", "b"]:
+            assert not poni.run(["add-node", node])
+            assert not poni.run(["add-config", node, "conf",
+                                 "--inherit", "tnode/tconf"])
+
+        # the records of the nodes collected by the bucket read are added
+        # before the bucket is returned
+        output = StringIO()
+        stdout, sys.stdout = sys.stdout, output
+        try:
+            assert not poni.run(["--no-render-cache", "show", "b"])
+        finally:
+            sys.stdout = stdout
+
+        assert "count=1" in output.getvalue()
+        assert "path=bucket:x" not in output.getvalue()
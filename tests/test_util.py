@@ -8,3 +8,18 @@ def test_dir_stats():
     assert stats['file_count'] > 30
     assert stats['total_bytes'] > 100000
     assert stats['path'] == poni_src_dir
+
+
+def test_json_dump_atomic(tmpdir):
+    file_path = str(tmpdir.join("cache", "data.json"))
+    assert util.json_load_or_default(file_path, "default", version=1) == "default"
+    util.json_dump_atomic(dict(version=1, x=[1, 2]), file_path)
+    assert os.listdir(os.path.dirname(file_path)) == ["data.json"]
+    assert util.json_load_or_default(file_path, None, version=1) == dict(
+        version=1, x=[1, 2])
+    assert util.json_load_or_default(file_path, None, version=2) is None
+
+    with open(file_path, "w") as f:
+        f.write("{truncated")
+
+    assert util.json_load_or_default(file_path, {}) == {}
@@ -1,10 +1,19 @@
 from __future__ import print_function
 from pytest import skip
-from poni import tool, vc
+from poni import template, tool, vc
 from helper import *
 import os
 import subprocess
+import time
 
+plugin_text = """
+from poni import config
+
+class PlugIn(config.PlugIn):
+    def add_actions(self):
+        self.add_file("test.txt", dest_path="/tmp/",
+                      render=self.render_name_template)
+"""
 
 class TestVersionControl(Helper):
     @classmethod
@@ -48,3 +57,118 @@ class TestVersionControl(Helper):
         assert not poni.run(["vc", "checkpoint", "checkpoint changes"])
         assert self.git(repo, ["status", "-s"]) == b""
         assert b"checkpoint changes" in self.git(repo, ["log"])
+
+    def test_verify_changed_since(self):
+        poni, repo = self.init_repo()
+        plugin_py = os.path.join(self.temp_dir(), "plugin.py")
+        with open(plugin_py, "w") as f:
+            f.write(plugin_text)
+
+        nodes = ["foo/a", "foo/b", "foo/c"]
+        for node in nodes:
+            assert not poni.run(["add-node", node])
+            assert not poni.run(["add-config", node, "conf"])
+            assert not poni.run(["update-config", node + "/conf", plugin_py])
+            with open(os.path.join(repo, "system", node, "config", "conf",
+                                   "test.txt"), "w") as f:
+                f.write("x=$node.x")
+
+            assert not poni.run(["set", node, "x=1"])
+
+        assert not poni.run(["vc", "init"])
+        # the first full verify records the state of each file
+        assert not poni.run(["verify"])
+        assert not poni.run(["set", "foo/b", "x=2"])
+
+        def verify_changed():
+            poni = tool.Tool(default_repo_path=repo)
+            confman = poni.get_confman(repo)
+            changed = confman.vc.get_changed_files("HEAD")
+            return changed, poni.verify_op(confman, None,
+                                           changed_paths=changed)[1]
+
+        changed, stats = verify_changed()
+        assert changed == ["system/foo/b/node.json"]
+        assert stats.file_count == 1
+        assert not poni.run(["verify", "--changed-since", "HEAD"])
+
+        # changes outside of any known inputs verify everything
+        with open(os.path.join(repo, "system", "foo", "new.txt"), "w") as f:
+            f.write("new")
+
+        changed, stats = verify_changed()
+        assert stats.file_count == 3
+
+    def test_verify_changed_since_old_gitignore(self):
+        poni, repo = self.init_repo()
+        plugin_py = os.path.join(self.temp_dir(), "plugin.py")
+        with open(plugin_py, "w") as f:
+            f.write(plugin_text)
+
+        for node in ["foo/a", "foo/b"]:
+            assert not poni.run(["add-node", node])
+            assert not poni.run(["add-config", node, "conf"])
+            assert not poni.run(["update-config", node + "/conf", plugin_py])
+            with open(os.path.join(repo, "system", node, "config", "conf",
+                                   "test.txt"), "w") as f:
+                f.write("x=$node.x")
+
+            assert not poni.run(["set", node, "x=1"])
+
+        assert not poni.run(["vc", "init"])
+        # repositories created before the cache dir was ignored
+        with open(os.path.join(repo, ".gitignore"), "w") as f:
+            f.write("*~\n*.pyc\n")
+
+        repo_vc = vc.GitVersionControl(repo)
+        repo_vc.add([".gitignore"])
+        repo_vc.commit("old ignores")
+        assert not poni.run(["verify"])
+        assert not poni.run(["set", "foo/b", "x=2"])
+
+        poni = tool.Tool(default_repo_path=repo)
+        confman = poni.get_confman(repo)
+        changed = confman.vc.get_changed_files("HEAD")
+        assert ".cache/verify-state.json" in changed
+        stats = poni.verify_op(confman, None, changed_paths=changed)[1]
+        assert stats.file_count == 1
+
+    def test_verify_changed_since_render_cache(self):
+        if not template.MakoTemplate:
+            skip("Mako not available")
+
+        poni, repo = self.init_repo()
+        plugin_py = os.path.join(self.temp_dir(), "plugin.py")
+        with open(plugin_py, "w") as f:
+            f.write(plugin_text.replace("render_name_template",
+                                        "render_mako"))
+
+        nodes = ["foo/a", "foo/b", "foo/c"]
+        for node in nodes:
+            assert not poni.run(["add-node", node])
+            assert not poni.run(["add-config", node, "conf"])
+            assert not poni.run(["update-config", node + "/conf", plugin_py])
+            with open(os.path.join(repo, "system", node, "config", "conf",
+                                   "test.txt"), "w") as f:
+                f.write("x=${node['x']}")
+
+            assert not poni.run(["set", node, "x=1"])
+
+        assert not poni.run(["vc", "init"])
+        # old enough files for the render cache to be used
+        old = time.time() - 3600
+        for dir_path, dir_names, file_names in os.walk(repo):
+            for name in file_names:
+                os.utime(os.path.join(dir_path, name), (old, old))
+
+        # the second verify is served from the render cache and keeps the
+        # state recorded by the first one
+        for i in range(2):
+            assert not tool.Tool(default_repo_path=repo).run(["verify"])
+
+        assert not poni.run(["set", "foo/b", "x=2"])
+        poni = tool.Tool(default_repo_path=repo)
+        confman = poni.get_confman(repo)
+        changed = confman.vc.get_changed_files("HEAD")
+        stats = poni.verify_op(confman, None, changed_paths=changed)[1]
+        assert stats.file_count == 1
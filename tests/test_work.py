@@ -0,0 +1,143 @@
+import threading
+import time
+from poni import errors
+from poni import work
+
+
+class RecordingTask(work.Task):
+    def __init__(self, name, events, depends=(), resources=(), cost=1.0):
+        work.Task.__init__(self)
+        self.name = name
+        self.events = events
+        self.depends = list(depends)
+        self.resources = list(resources)
+        self.cost = cost
+
+    def __str__(self):
+        return self.name
+
+    def get_key(self):
+        return self.name
+
+    def get_dependencies(self):
+        return self.depends
+
+    def get_resources(self):
+        return self.resources
+
+    def get_cost(self):
+        return self.cost
+
+    def execute(self):
+        self.events.append(("start", self.name))
+        time.sleep(0.01)
+        self.events.append(("stop", self.name))
+
+
+def run_tasks(tasks, max_jobs=None):
+    runner = work.Runner(max_jobs=max_jobs)
+    for task in tasks:
+        runner.add_task(task)
+
+    runner.run_all()
+    return runner
+
+
+def test_dependencies():
+    events = []
+    tasks = [RecordingTask("app", events, depends=["db"]),
+             RecordingTask("lb", events, depends=["app", "db"]),
+             RecordingTask("db", events),
+             RecordingTask("other", events)]
+    runner = run_tasks(tasks)
+    assert len(runner.stopped) == 4
+    for name, depends in [("app", ["db"]), ("lb", ["app", "db"])]:
+        for dep in depends:
+            assert events.index(("stop", dep)) < events.index(("start", name))
+
+
+def test_resources():
+    events = []
+    lock = threading.Lock()
+    running = {}
+    max_running = {}
+
+    class ResourceTask(RecordingTask):
+        def execute(self):
+            with lock:
+                for resource, limit in self.resources:
+                    running[resource] = running.get(resource, 0) + 1
+                    max_running[resource] = max(running[resource],
+                                                max_running.get(resource, 0))
+            RecordingTask.execute(self)
+            with lock:
+                for resource, limit in self.resources:
+                    running[resource] -= 1
+
+    tasks = [ResourceTask("t%d" % i, events,
+                          resources=[("host%d" % (i % 3), 1),
+                                     ("rack%d" % (i % 2), 1)])
+             for i in range(20)]
+    runner = run_tasks(tasks, max_jobs=4)
+    assert len(runner.stopped) == 20
+    assert max(max_running.values()) == 1
+
+    # concurrency up to the limits of all the resources of each task
+    max_running.clear()
+    tasks = [ResourceTask("t%d" % i, events,
+                          resources=[("host%d" % (i % 2), 3), ("rack", 4)])
+             for i in range(20)]
+    runner = run_tasks(tasks)
+    assert len(runner.stopped) == 20
+    assert max_running["rack"] == 4
+    assert max(max_running["host0"], max_running["host1"]) == 3
+
+
+def test_critical_path_first():
+    events = []
+    tasks = [RecordingTask("x%d" % i, events) for i in range(3)]
+    tasks.extend([RecordingTask("db", events),
+                  RecordingTask("app", events, depends=["db"]),
+                  RecordingTask("lb", events, depends=["app"]),
+                  RecordingTask("slow", events, cost=10.0)])
+    run_tasks(tasks, max_jobs=1)
+    started = [name for event, name in events if event == "start"]
+    assert started[:3] == ["slow", "db", "app"]
+
+
+def test_circular_dependencies():
+    events = []
+    tasks = [RecordingTask("a", events, depends=["b"]),
+             RecordingTask("b", events, depends=["a"]),
+             RecordingTask("c", events)]
+    try:
+        run_tasks(tasks)
+    except errors.ControlError as error:
+        assert "a, b" in str(error)
+    else:
+        assert 0, "circular dependencies not detected"
+
+    assert events == [("start", "c"), ("stop", "c")]
+
+
+def test_worker_reuse():
+    events = []
+    threads = set()
+
+    class ThreadTask(RecordingTask):
+        def execute(self):
+            threads.add(threading.current_thread())
+            RecordingTask.execute(self)
+
+    tasks = [ThreadTask("t%d" % i, events) for i in range(20)]
+    runner = run_tasks(tasks, max_jobs=3)
+    assert len(runner.stopped) == 20
+    assert len(threads) <= 3
+    for task in runner.stopped:
+        assert task.stop_time >= task.start_time
+
+    events = []
+    runner = work.Runner(stack_size=256 * 1024)
+    runner.add_task(RecordingTask("stack", events))
+    runner.run_all()
+    assert events[-1] == ("stop", "stack")